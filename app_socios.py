@@ -1,13 +1,29 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 import datetime
 import time
-import locale
+import math
+import uuid
+import io
 import json
+import threading
+import sqlite3
+import base64
 import pyrebase
 import firebase_admin
 from firebase_admin import credentials, firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+from urllib.parse import quote, unquote
+from pandas.api.types import union_categoricals
+from collections import namedtuple
+from abc import ABC, abstractmethod
 import copy
+import re
+import bisect
+import unicodedata
 
 # --- CONFIGURACIÓN DE PÁGINA PERSONALIZADA ---
 st.set_page_config(
@@ -16,7 +32,7 @@ st.set_page_config(
     layout="wide"
 )
 
-# --- INYECCIÓN DE CSS PARA ANIMACIONES ---
+# --- INYECCIÓN DE CSS PARA ANIMACIONES Y TARJETAS ---
 st.markdown("""
 <style>
 /* Animación de pulso para KPIs */
@@ -35,16 +51,24 @@ st.markdown("""
   justify-content: center;
   height: 100%;
 }
+/* Tarjetas de la Bóveda */
+.card-boveda { border-radius: 5px; padding: 15px; margin-bottom: 10px; background-color: #f8f9fa; color: #333; height: 100%; display: flex; flex-direction: column; justify-content: space-between; transition: all 0.3s ease-in-out;}
+.card-boveda:hover { transform: translateY(-5px); box-shadow: 0 4px 12px rgba(0,0,0,0.1); }
+.glow-modelando { box-shadow: 0 0 25px 8px #ffc107aa; }
+.glow-pruebas { box-shadow: 0 0 25px 8px #28a745aa; }
+.fade-archivada { opacity: 0.6; }
+.fecha-registro { margin: 0; font-size: 0.9em; color: #6c757d; }
+.card-body { display: flex; justify-content: space-between; }
+.card-col { flex: 1; }
+.card-col:first-child { padding-right: 5px; }
+.card-col:last-child { padding-left: 5px; }
+.card-footer { margin-top: 15px; }
+.card-footer details summary { cursor: pointer; font-size: 0.9em; margin-top: 10px; }
+.comentarios { background-color: #e9ecef; padding: 10px; border-radius: 5px; margin-top: 5px; color: black; }
 </style>
 """, unsafe_allow_html=True)
 
 
-# --- Configuración de Localismo para Español ---
-try:
-    locale.setlocale(locale.LC_TIME, 'es_ES.UTF-8')
-except locale.Error:
-    pass
-
 # --- INICIALIZACIÓN DE FIREBASE (MÉTODO JSON DIRECTO) ---
 def init_firebase_admin():
     """Inicializa Firebase Admin SDK leyendo todo el JSON desde los secretos."""
@@ -68,14 +92,44 @@ def init_firebase_auth():
         st.error("Verifica la sección [firebase_auth] en tu archivo .streamlit/secrets.toml.")
         st.stop()
 
-if not firebase_admin._apps:
-    init_firebase_admin()
+# Sección opcional [storage] de secrets.toml; sin ella se usa Firestore.
+CONFIG_ALMACENAMIENTO = dict(st.secrets.get("storage", {}))
+
+if CONFIG_ALMACENAMIENTO.get("backend", "firestore") == "firestore":
+    if not firebase_admin._apps:
+        init_firebase_admin()
+    db = firestore.client()
+else:
+    db = None
+
+def autenticacion_local(config_autenticacion):
+    """Entrar sin contraseña sólo con un `[auth] modo = "local"` explícito (desarrollo), nunca por defecto."""
+    return config_autenticacion.get("modo", "firebase") == "local"
 
-db = firestore.client()
-auth_client = init_firebase_auth()
+# Sección opcional [auth] de secrets.toml, independiente del almacenamiento: sin ella, login con Firebase.
+AUTENTICACION_LOCAL = autenticacion_local(dict(st.secrets.get("auth", {})))
+auth_client = None if AUTENTICACION_LOCAL else init_firebase_auth()
 
 
 # --- FUNCIONES DE MANEJO DE DATOS CON FIRESTORE (VERSIÓN SOCIOS) ---
+# Estructura fragmentada del espacio de trabajo en socios/{workspace_id}/:
+#   ofertas/{id_oferta}            -> metadatos de la oferta
+#   campanas/{id_oferta}__{id_camp} -> metadatos de una campaña de escala
+#   instantaneas/{id_oferta}__{seg} -> DataFrame de registros de un segmento (testeos o una campaña)
+#   boveda/{id_entrada}             -> una entrada de la Bóveda de Inteligencia
+#   plantillas/{id_plantilla}       -> una plantilla de lanzamiento
+#   app_data/layout                 -> versión del esquema (marca la migración desde app_data/main)
+# Los DataFrames viven aparte para que las escuchas de ofertas y campañas sólo reciban metadatos:
+# el campo `version_instantanea` de la oferta/campaña cambia cada vez que se reescribe su instantánea.
+VERSION_ESQUEMA_ALMACENAMIENTO = 3
+CAMPO_VERSION_INSTANTANEA = 'version_instantanea'
+LIMITE_OPERACIONES_LOTE = 450
+
+# Cabecera de los DataFrames binarios: firma + versión del formato. Los payloads antiguos
+# (strings JSON 'split') se siguen leyendo con `json_to_df`.
+CABECERA_DF_BINARIO = b'INFDF'
+VERSION_DF_ARROW_ZSTD = 1
+
 def df_to_json(df):
     """Convierte un DataFrame a formato JSON compatible con Firestore."""
     return df.to_json(orient='split', date_format='iso')
@@ -84,70 +138,1885 @@ def json_to_df(json_str):
     """Convierte un string JSON de vuelta a un DataFrame."""
     if not json_str or not isinstance(json_str, str):
         return pd.DataFrame()
-    df = pd.read_json(json_str, orient='split')
+    df = pd.read_json(io.StringIO(json_str), orient='split')
     if 'Fecha' in df.columns:
         df['Fecha'] = pd.to_datetime(df['Fecha'])
     return df
 
+def codificar_df(df):
+    """Serializa un DataFrame como Arrow IPC comprimido con zstd (se guarda como Blob en Firestore)."""
+    df = df.reset_index(drop=True).infer_objects()
+    if 'Fecha' in df.columns:
+        df['Fecha'] = pd.to_datetime(df['Fecha'])
+    try:
+        tabla = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Columnas con tipos mezclados que Arrow no sabe tipar: se mantiene el formato JSON.
+        return df_to_json(df)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, tabla.schema, options=pa.ipc.IpcWriteOptions(compression='zstd')) as writer:
+        writer.write_table(tabla)
+    return CABECERA_DF_BINARIO + bytes([VERSION_DF_ARROW_ZSTD]) + sink.getvalue().to_pybytes()
+
+def decodificar_df(valor):
+    """Reconstruye un DataFrame desde cualquiera de los formatos guardados (binario Arrow o JSON antiguo)."""
+    if isinstance(valor, (bytes, bytearray, memoryview)):
+        datos = bytes(valor)
+        if not datos.startswith(CABECERA_DF_BINARIO):
+            raise ValueError("Formato binario de DataFrame desconocido.")
+        version = datos[len(CABECERA_DF_BINARIO)]
+        if version != VERSION_DF_ARROW_ZSTD:
+            raise ValueError(f"Versión {version} del formato binario de DataFrame no soportada.")
+        return aplicar_esquema(pa.ipc.open_stream(datos[len(CABECERA_DF_BINARIO) + 1:]).read_all().to_pandas())
+    return aplicar_esquema(json_to_df(valor))
+
+# --- ESQUEMA DE TIPOS DE LAS TABLAS DE REGISTROS ---
+# Al cargar, las etiquetas que se repiten en cada fila (anuncio, componente, oferta) pasan a
+# categóricas, los conteos a int32 (float32 si tienen huecos) y Fecha a datetime64. Los importes
+# se quedan en float64 para que las sumas no pierdan céntimos.
+COLUMNAS_ETIQUETA = ('Anuncio', 'Componente', 'Oferta', 'id_oferta', 'componente')
+COLUMNAS_CONTEO = ('Pagos Iniciados',)
+
+def es_columna_conteo(columna):
+    return columna in COLUMNAS_CONTEO or str(columna).startswith(get_safe_column_name(''))
+
+def tipo_conteo(serie):
+    numerica = pd.to_numeric(serie, errors='coerce')
+    return numerica.astype('float32' if numerica.isna().any() else 'int32')
+
+def aplicar_esquema(df):
+    """El DataFrame con el esquema compacto; si ya lo cumple se devuelve tal cual, sin copiar."""
+    cambios = {}
+    for col in df.columns:
+        serie = df[col]
+        if col == 'Fecha':
+            if not pd.api.types.is_datetime64_dtype(serie):
+                cambios[col] = pd.to_datetime(serie)
+        elif col in COLUMNAS_ETIQUETA:
+            if not isinstance(serie.dtype, pd.CategoricalDtype):
+                cambios[col] = serie.astype('category')
+        elif es_columna_conteo(col) and serie.dtype not in (np.int32, np.float32):
+            cambios[col] = tipo_conteo(serie)
+    return df.assign(**cambios) if cambios else df
+
+def concatenar_registros(partes):
+    """`pd.concat` de tablas de registros que conserva las etiquetas categóricas con las categorías unificadas."""
+    partes = [aplicar_esquema(p) for p in partes]
+    for col in COLUMNAS_ETIQUETA:
+        series = [p[col] for p in partes if col in p.columns]
+        if len(series) > 1:
+            categorias = union_categoricals([s.array for s in series], sort_categories=True).categories
+            partes = [p.assign(**{col: p[col].cat.set_categories(categorias)}) if col in p.columns else p for p in partes]
+    # Las tablas vacías sólo aportan columnas: concatenarlas haría que pandas dejara de ignorarlas al
+    # decidir los dtypes del resultado (FutureWarning). Se quitan y sus columnas se añaden al final.
+    columnas = list(dict.fromkeys(col for p in partes for col in p.columns))
+    con_filas = [p for p in partes if not p.empty]
+    if not con_filas:
+        return pd.concat(partes, ignore_index=True)
+
+    return pd.concat(con_filas, ignore_index=True).reindex(columns=columnas)
+
+
+def id_documento(id_logico):
+    """Convierte un id de la app en un id de documento válido para Firestore (sin '/')."""
+    return quote(str(id_logico), safe='')
+
+
+def serializar_oferta(oferta):
+    """Prepara el documento de una oferta, sin sus campañas de escala ni su DataFrame de testeos."""
+    return {k: v for k, v in oferta.items() if k not in ('escala', 'testeos') and not k.startswith('_')}
+
+def serializar_campana(id_oferta, id_campana, campana):
+    """Prepara el documento de una campaña de escala, enlazado a su oferta y sin sus registros."""
+    doc = {k: v for k, v in campana.items() if k != 'registros' and not k.startswith('_')}
+    doc['oferta_id'] = id_oferta
+    doc['campana_id'] = id_campana
+    return doc
+
+def id_instantanea(id_oferta, segmento):
+    return f"{id_oferta}__{segmento}"
+
+def operacion_instantanea(id_oferta, segmento, contenedor):
+    """El 'set' de la instantánea de un segmento; renueva la versión que anuncia el contenedor."""
+    contenedor[CAMPO_VERSION_INSTANTANEA] = nuevo_id_registro()
+    clave = 'testeos' if segmento == 'testeos' else 'registros'
+    return ('set', Documento('instantaneas', id_instantanea(id_oferta, segmento)),
+            {'oferta_id': id_oferta, 'segmento': segmento, **datos_instantanea(obtener_registros(contenedor, clave))})
+
+def deserializar_campana(doc):
+    campana = {k: v for k, v in doc.items() if k not in ('oferta_id', 'campana_id', CAMPO_ORIGEN_ESCRITURA)}
+    if 'registros' in campana:
+        campana['registros'] = decodificar_df(campana['registros'])
+    return campana
+
+def clave_orden_boveda(entrada):
+    """Las entradas más recientes primero, igual que el antiguo `insert(0, ...)`."""
+    try:
+        return int(str(entrada.get('id', '')).rsplit('_', 1)[-1])
+    except ValueError:
+        return 0
+
+def registrar_cambio(tipo, id_logico, *ruta):
+    """Marca un cambio en un fragmento (oferta, campaña, entrada de bóveda o plantilla) para el próximo guardado.
+
+    Para las campañas, `id_logico` es la tupla (id_oferta, id_campana). Sin `ruta` se reescribe
+    (o se borra) el documento completo; con `ruta` sólo se envía ese campo, p. ej.
+    registrar_cambio('ofertas', id_oferta, 'funnel', 'bump_1', 'estado').
+    """
+    pendientes = st.session_state.setdefault('_cambios_pendientes', {})
+    clave = (tipo, id_logico)
+    if not ruta:
+        pendientes[clave] = None
+    elif pendientes.get(clave, set()) is not None:
+        pendientes.setdefault(clave, set()).add(tuple(ruta))
+
+def obtener_fragmento(tipo, id_logico):
+    """Devuelve el objeto en memoria de un fragmento, o None si ya no existe."""
+    if tipo == 'ofertas':
+        return st.session_state.get('ofertas', {}).get(id_logico)
+    if tipo == 'campanas':
+        id_oferta, id_campana = id_logico
+        return st.session_state.get('ofertas', {}).get(id_oferta, {}).get('escala', {}).get(id_campana)
+    if tipo == 'boveda':
+        return next((e for e in st.session_state.get('boveda', []) if e['id'] == id_logico), None)
+    if tipo == 'plantillas':
+        return st.session_state.get('plantillas', {}).get(id_logico)
+    if tipo == 'registros':
+        return st.session_state.get('_documentos_log', {}).get(id_logico)
+    return None
+
+def referencia_fragmento(tipo, id_logico):
+    if tipo == 'campanas':
+        return Documento('campanas', '{}__{}'.format(*id_logico))
+    return Documento(tipo, str(id_logico))
+
+def serializar_valor(valor):
+    return codificar_df(valor) if isinstance(valor, pd.DataFrame) else valor
+
+def rutas_minimas(rutas):
+    """Descarta las rutas ya cubiertas por otra más corta (p. ej. ('funnel',) cubre ('funnel', 'bump_1'))."""
+    resultado = []
+    for ruta in sorted(rutas, key=len):
+        if not any(ruta[:len(previa)] == previa for previa in resultado):
+            resultado.append(ruta)
+    return resultado
+
+def operaciones_de_cambios(cambios):
+    """Traduce los cambios marcados en operaciones set/update/delete, sólo sobre los campos tocados."""
+    operaciones = []
+    for (tipo, id_logico), rutas in cambios.items():
+        ref = referencia_fragmento(tipo, id_logico)
+        fragmento = obtener_fragmento(tipo, id_logico)
+        if fragmento is None:
+            operaciones.append(('delete', ref, None))
+            if tipo == 'ofertas':
+                operaciones.append(('delete_consulta', Consulta('campanas', 'oferta_id', id_logico), None))
+                operaciones.append(('delete_consulta', Consulta('instantaneas', 'oferta_id', id_logico), None))
+                operaciones.append(('delete_consulta', Consulta('registros', 'oferta_id', id_logico), None))
+                operaciones.append(('delete_consulta', Consulta('rollups', 'oferta_id', id_logico), None))
+            elif tipo == 'campanas':
+                operaciones.append(('delete', Documento('instantaneas', id_instantanea(*id_logico)), None))
+        elif rutas is None:
+            if tipo == 'ofertas':
+                # La instantánea va primero: renueva la versión que lleva el documento de la oferta.
+                if isinstance(fragmento.get('testeos'), pd.DataFrame):
+                    operaciones.append(operacion_instantanea(id_logico, 'testeos', fragmento))
+                operaciones.append(('set', ref, dict(serializar_oferta(fragmento), **{CAMPO_ORIGEN_ESCRITURA: TOKEN_PROCESO})))
+                # Una oferta nueva o reescrita arrastra también sus campañas.
+                for id_campana, campana in fragmento.get('escala', {}).items():
+                    if isinstance(campana.get('registros'), pd.DataFrame):
+                        operaciones.append(operacion_instantanea(id_logico, id_campana, campana))
+                    operaciones.append(('set', referencia_fragmento('campanas', (id_logico, id_campana)), dict(serializar_campana(id_logico, id_campana, campana), **{CAMPO_ORIGEN_ESCRITURA: TOKEN_PROCESO})))
+            elif tipo == 'campanas':
+                if isinstance(fragmento.get('registros'), pd.DataFrame):
+                    operaciones.append(operacion_instantanea(*id_logico, fragmento))
+                operaciones.append(('set', ref, dict(serializar_campana(*id_logico, fragmento), **{CAMPO_ORIGEN_ESCRITURA: TOKEN_PROCESO})))
+            else:
+                operaciones.append(('set', ref, dict(fragmento, **{CAMPO_ORIGEN_ESCRITURA: TOKEN_PROCESO})))
+        else:
+            campos = {}
+            for ruta in rutas_minimas(rutas):
+                valor = fragmento
+                try:
+                    if (tipo, ruta) in (('ofertas', ('testeos',)), ('campanas', ('registros',))):
+                        # El DataFrame se reescribe en su instantánea; el documento sólo anuncia la nueva versión
+                        # (y pierde el campo heredado del esquema anterior, si aún lo tenía).
+                        segmento = 'testeos' if tipo == 'ofertas' else id_logico[1]
+                        operaciones.append(operacion_instantanea(id_logico if tipo == 'ofertas' else id_logico[0], segmento, fragmento))
+                        campos[(CAMPO_VERSION_INSTANTANEA,)] = fragmento[CAMPO_VERSION_INSTANTANEA]
+                        campos[ruta] = BORRAR_CAMPO
+                        continue
+                    for parte in ruta:
+                        valor = valor[parte]
+                    campos[ruta] = serializar_valor(valor)
+                except (KeyError, IndexError, TypeError):
+                    campos[ruta] = BORRAR_CAMPO
+            campos[(CAMPO_ORIGEN_ESCRITURA,)] = TOKEN_PROCESO
+            operaciones.append(('update', ref, campos))
+    return operaciones
+
+# --- BACKENDS DE ALMACENAMIENTO ---
+# La app sólo habla con un BackendAlmacenamiento: documentos por colección (ofertas, campanas, instantaneas,
+# registros, boveda, plantillas, app_data) dentro del espacio de trabajo. Se elige en secrets.toml:
+#   [storage]
+#   backend = "firestore"   # por defecto
+#   # backend = "sqlite"
+#   # ruta = "infinity_local.db"
+Documento = namedtuple('Documento', ['coleccion', 'id'])
+Consulta = namedtuple('Consulta', ['coleccion', 'campo', 'valor'])
+
+class _BorrarCampo:
+    """Centinela independiente del backend para eliminar un campo en una operación 'update'."""
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __repr__(self):
+        return 'BORRAR_CAMPO'
+
+BORRAR_CAMPO = _BorrarCampo()
+
+class Incremento(namedtuple('Incremento', ['valor'])):
+    """Suma atómica sobre un campo numérico en una operación 'incrementar' (Increment en Firestore)."""
+
+def leer_en_ruta(origen, ruta, defecto=None):
+    for parte in ruta:
+        if not isinstance(origen, dict) or parte not in origen:
+            return defecto
+        origen = origen[parte]
+    return origen
+
+
+class BackendAlmacenamiento(ABC):
+    """Interfaz de persistencia. Los ids de documento son los ids lógicos de la app (sin escapar)."""
+
+    @abstractmethod
+    def confirmar(self, operaciones):
+        """Aplica en un lote las operaciones (accion, Documento|Consulta, datos).
+
+        Acciones: 'set', 'update' y 'incrementar' ({ruta: valor|Incremento}, crea el documento si
+        no existe), 'delete' y 'delete_consulta'.
+        """
+
+    @abstractmethod
+    def leer(self, coleccion, id_doc, campos=None):
+        """Devuelve el documento (o sólo `campos`), o None si no existe."""
+
+    @abstractmethod
+    def listar(self, coleccion, campos=None):
+        """Itera (id_doc, datos) sobre todos los documentos de una colección."""
+
+    @abstractmethod
+    def consultar(self, coleccion, campo, valor):
+        """Itera (id_doc, datos) sobre los documentos con `campo == valor`."""
+
+    def escuchar(self, coleccion, callback):
+        """Llama a callback([(id_doc, datos, eliminado), ...]) con cada cambio. Por defecto no hay push."""
+        return None
+
+    def consultar_registros(self, id_oferta, desde=None, hasta=None, anuncio=None):
+        """Registros diarios de una oferta (testeos y escala) en [desde, hasta], opcionalmente de un anuncio/componente.
+
+        Implementación genérica: reconstruye snapshot + log de cada segmento y filtra en memoria.
+        """
+        logs = {}
+        for id_log, doc in self.consultar('registros', 'oferta_id', id_oferta):
+            logs.setdefault(doc.get('segmento'), {})[id_log] = doc
+        segmentos = {doc['segmento']: leer_instantanea(doc) for _, doc in self.consultar('instantaneas', 'oferta_id', id_oferta)}
+        for segmento in logs:
+            segmentos.setdefault(segmento, pd.DataFrame())
+        partes = [aplicar_log_registros(df, logs.get(segmento, {})).assign(segmento=segmento) for segmento, df in segmentos.items()]
+        df = concatenar_registros([p for p in partes if not p.empty]) if any(not p.empty for p in partes) else pd.DataFrame()
+        if df.empty:
+            return df
+        mascara = pd.Series(True, index=df.index)
+        if desde is not None:
+            mascara &= df['Fecha'] >= pd.Timestamp(desde)
+        if hasta is not None:
+            mascara &= df['Fecha'] <= pd.Timestamp(hasta)
+        if anuncio is not None:
+            mascara &= (df.get('Anuncio') == anuncio) | (df.get('Componente') == anuncio)
+        return df[mascara].sort_values('Fecha', kind='stable').reset_index(drop=True)
+
+class BackendFirestore(BackendAlmacenamiento):
+    """Documentos en socios/{workspace_id}/{coleccion}/{id escapado} de Cloud Firestore."""
+
+    def __init__(self, ws_ref):
+        self.ws_ref = ws_ref
+
+    def _ref(self, coleccion, id_doc):
+        return self.ws_ref.collection(coleccion).document(id_documento(id_doc))
+
+    def _valor(self, valor):
+        if isinstance(valor, Incremento):
+            return firestore.Increment(valor.valor)
+        return firestore.DELETE_FIELD if valor is BORRAR_CAMPO else valor
+
+    def confirmar(self, operaciones):
+        # Se expanden primero las consultas para que ningún lote supere el límite de escrituras.
+        escrituras = []
+        for accion, ref, datos in operaciones:
+            if accion == 'set':
+                escrituras.append(('set', (self._ref(*ref), datos), {}))
+            elif accion == 'update':
+                escrituras.append(('update', (self._ref(*ref), {FieldPath(*ruta).to_api_repr(): self._valor(valor) for ruta, valor in datos.items()}), {}))
+            elif accion == 'incrementar':
+                anidado = {}
+                for ruta, valor in datos.items():
+                    asignar_en_ruta(anidado, ruta, self._valor(valor))
+                escrituras.append(('set', (self._ref(*ref), anidado), {'merge': True}))
+            elif accion == 'delete':
+                escrituras.append(('delete', (self._ref(*ref),), {}))
+            elif accion == 'delete_consulta':
+                for doc in self.ws_ref.collection(ref.coleccion).where(ref.campo, '==', ref.valor).stream():
+                    escrituras.append(('delete', (doc.reference,), {}))
+        for inicio in range(0, len(escrituras), LIMITE_OPERACIONES_LOTE):
+            batch = db.batch()
+            for metodo, args, kwargs in escrituras[inicio:inicio + LIMITE_OPERACIONES_LOTE]:
+                getattr(batch, metodo)(*args, **kwargs)
+            batch.commit()
+
+    def leer(self, coleccion, id_doc, campos=None):
+        doc = self._ref(coleccion, id_doc).get(field_paths=campos)
+        return doc.to_dict() or {} if doc.exists else None
+
+    def listar(self, coleccion, campos=None):
+        consulta = self.ws_ref.collection(coleccion)
+        if campos is not None:
+            consulta = consulta.select(campos)
+        for doc in consulta.stream():
+            yield unquote(doc.id), doc.to_dict() or {}
+
+    def consultar(self, coleccion, campo, valor):
+        for doc in self.ws_ref.collection(coleccion).where(campo, '==', valor).stream():
+            yield unquote(doc.id), doc.to_dict() or {}
+
+    def escuchar(self, coleccion, callback):
+        def al_cambiar(docs, changes, read_time):
+            callback([(unquote(c.document.id), c.document.to_dict() or {}, c.type.name == 'REMOVED') for c in changes])
+        return self.ws_ref.collection(coleccion).on_snapshot(al_cambiar)
+
+ESQUEMA_SQLITE = """
+CREATE TABLE IF NOT EXISTS documentos (
+    workspace TEXT NOT NULL,
+    coleccion TEXT NOT NULL,
+    id TEXT NOT NULL,
+    datos TEXT NOT NULL,
+    PRIMARY KEY (workspace, coleccion, id)
+);
+CREATE INDEX IF NOT EXISTS idx_documentos_oferta ON documentos (workspace, coleccion, json_extract(datos, '$.oferta_id'));
+CREATE TABLE IF NOT EXISTS registros (
+    workspace TEXT NOT NULL,
+    oferta_id TEXT NOT NULL,
+    segmento TEXT NOT NULL,
+    id_registro TEXT NOT NULL,
+    fecha TEXT,
+    anuncio TEXT,
+    fila TEXT NOT NULL,
+    PRIMARY KEY (workspace, oferta_id, segmento, id_registro)
+);
+CREATE INDEX IF NOT EXISTS idx_registros_fecha ON registros (workspace, oferta_id, fecha);
+CREATE INDEX IF NOT EXISTS idx_registros_anuncio ON registros (workspace, oferta_id, anuncio, fecha);
+"""
+
+def a_json(datos):
+    """JSON de un documento; los bytes (DataFrames binarios) viajan como {'__bytes__': base64}."""
+    def por_defecto(valor):
+        if isinstance(valor, (bytes, bytearray, memoryview)):
+            return {'__bytes__': base64.b64encode(bytes(valor)).decode('ascii')}
+        if isinstance(valor, (datetime.date, datetime.datetime)):
+            return valor.isoformat()
+        if hasattr(valor, 'item'):
+            return valor.item()
+        raise TypeError(f"Tipo no serializable: {type(valor).__name__}")
+    return json.dumps(datos, default=por_defecto, ensure_ascii=False)
+
+def desde_json(texto):
+    return json.loads(texto, object_hook=lambda d: base64.b64decode(d['__bytes__']) if d.keys() == {'__bytes__'} else d)
+
+class BackendSQLite(BackendAlmacenamiento):
+    """Almacenamiento local embebido: documentos JSON + una tabla indexada con cada registro diario.
+
+    La tabla `registros` refleja snapshot + log de cada segmento y permite consultas por rango de
+    fechas por oferta y por anuncio/componente sin decodificar ningún DataFrame.
+    """
+
+    def __init__(self, ruta, workspace_id):
+        self.workspace_id = workspace_id
+        self._lock = threading.Lock()
+        self._conexion = sqlite3.connect(ruta, check_same_thread=False)
+        self._conexion.executescript(ESQUEMA_SQLITE)
+
+    def _leer(self, coleccion, id_doc):
+        fila = self._conexion.execute(
+            "SELECT datos FROM documentos WHERE workspace = ? AND coleccion = ? AND id = ?",
+            (self.workspace_id, coleccion, id_doc)).fetchone()
+        return desde_json(fila[0]) if fila else None
+
+    def _guardar(self, ref, datos, campos_tocados):
+        self._conexion.execute(
+            "INSERT OR REPLACE INTO documentos (workspace, coleccion, id, datos) VALUES (?, ?, ?, ?)",
+            (self.workspace_id, ref.coleccion, ref.id, a_json(datos)))
+        if ref.coleccion == 'registros':
+            if datos.get('borrado'):
+                self._conexion.execute(
+                    "DELETE FROM registros WHERE workspace = ? AND oferta_id = ? AND segmento = ? AND id_registro = ?",
+                    (self.workspace_id, datos['oferta_id'], datos['segmento'], ref.id))
+            else:
+                self._indexar_filas(datos['oferta_id'], datos['segmento'], [dict(fila_con_ventas(datos.get('fila', {}), datos.get('ventas')), **{COLUMNA_ID_REGISTRO: ref.id})])
+        elif ref.coleccion == 'instantaneas' and 'registros' in campos_tocados:
+            self._indexar_segmento(datos['oferta_id'], datos['segmento'], datos)
+
+    def _borrar(self, ref):
+        datos = self._leer(*ref) or {}
+        self._conexion.execute(
+            "DELETE FROM documentos WHERE workspace = ? AND coleccion = ? AND id = ?",
+            (self.workspace_id, ref.coleccion, ref.id))
+        # Borrar un documento de log no borra el registro: ya está absorbido en el snapshot.
+        if ref.coleccion == 'ofertas':
+            self._conexion.execute("DELETE FROM registros WHERE workspace = ? AND oferta_id = ?", (self.workspace_id, ref.id))
+        elif ref.coleccion == 'instantaneas' and datos:
+            self._conexion.execute(
+                "DELETE FROM registros WHERE workspace = ? AND oferta_id = ? AND segmento = ?",
+                (self.workspace_id, datos['oferta_id'], datos['segmento']))
+
+    def _indexar_filas(self, id_oferta, segmento, filas):
+        """Indexa registros en formato ancho; cada fila se guarda con sus ventas como {paso: unidades}."""
+        filas = [dict(base, ventas=ventas) for base, ventas in map(ventas_de_fila, filas)]
+        self._conexion.executemany(
+            "INSERT OR REPLACE INTO registros (workspace, oferta_id, segmento, id_registro, fecha, anuncio, fila) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(self.workspace_id, id_oferta, segmento, fila[COLUMNA_ID_REGISTRO], str(fila.get('Fecha'))[:10],
+              fila.get('Anuncio', fila.get('Componente')), a_json(fila)) for fila in filas])
+
+    def _indexar_segmento(self, id_oferta, segmento, instantanea):
+        """Sustituye las filas indexadas de un segmento por las de su nueva instantánea."""
+        self._conexion.execute(
+            "DELETE FROM registros WHERE workspace = ? AND oferta_id = ? AND segmento = ?",
+            (self.workspace_id, id_oferta, segmento))
+        df = leer_instantanea(instantanea)
+        if df.empty:
+            return
+        filas = [{col: valor_para_documento(valor) for col, valor in fila.items()} for fila in df.to_dict('records')]
+        for i, fila in enumerate(filas):
+            if not isinstance(fila.get(COLUMNA_ID_REGISTRO), str):
+                fila[COLUMNA_ID_REGISTRO] = f"fila_{i}"
+        self._indexar_filas(id_oferta, segmento, filas)
+
+    def confirmar(self, operaciones):
+        with self._lock, self._conexion:
+            for accion, ref, datos in operaciones:
+                if accion == 'set':
+                    self._guardar(ref, datos, set(datos))
+                elif accion == 'update':
+                    doc = self._leer(*ref) or {}
+                    for ruta, valor in datos.items():
+                        asignar_en_ruta(doc, ruta, valor)
+                    self._guardar(ref, doc, {ruta[0] for ruta in datos})
+                elif accion == 'incrementar':
+                    doc = self._leer(*ref) or {}
+                    for ruta, valor in datos.items():
+                        if isinstance(valor, Incremento):
+                            valor = (leer_en_ruta(doc, ruta) or 0) + valor.valor
+                        asignar_en_ruta(doc, ruta, valor)
+                    self._guardar(ref, doc, set())
+                elif accion == 'delete':
+                    self._borrar(ref)
+                elif accion == 'delete_consulta':
+                    for id_doc, _ in list(self.consultar(*ref)):
+                        self._borrar(Documento(ref.coleccion, id_doc))
+
+    def leer(self, coleccion, id_doc, campos=None):
+        datos = self._leer(coleccion, id_doc)
+        if datos is None or campos is None:
+            return datos
+        return {k: v for k, v in datos.items() if k in campos}
+
+    def listar(self, coleccion, campos=None):
+        filas = self._conexion.execute(
+            "SELECT id, datos FROM documentos WHERE workspace = ? AND coleccion = ?",
+            (self.workspace_id, coleccion)).fetchall()
+        for id_doc, texto in filas:
+            datos = desde_json(texto)
+            yield id_doc, datos if campos is None else {k: v for k, v in datos.items() if k in campos}
+
+    def consultar(self, coleccion, campo, valor):
+        if not campo.isidentifier():
+            raise ValueError(f"Campo de consulta no válido: {campo}")
+        filas = self._conexion.execute(
+            f"SELECT id, datos FROM documentos WHERE workspace = ? AND coleccion = ? AND json_extract(datos, '$.{campo}') = ?",
+            (self.workspace_id, coleccion, valor)).fetchall()
+        for id_doc, texto in filas:
+            yield id_doc, desde_json(texto)
+
+    def consultar_registros(self, id_oferta, desde=None, hasta=None, anuncio=None):
+        condiciones, parametros = ["workspace = ?", "oferta_id = ?"], [self.workspace_id, id_oferta]
+        if anuncio is not None:
+            condiciones.append("anuncio = ?")
+            parametros.append(anuncio)
+        if desde is not None:
+            condiciones.append("fecha >= ?")
+            parametros.append(pd.Timestamp(desde).strftime('%Y-%m-%d'))
+        if hasta is not None:
+            condiciones.append("fecha <= ?")
+            parametros.append(pd.Timestamp(hasta).strftime('%Y-%m-%d'))
+        filas = self._conexion.execute(
+            f"SELECT segmento, fila FROM registros WHERE {' AND '.join(condiciones)} ORDER BY fecha",
+            parametros).fetchall()
+        if not filas:
+            return pd.DataFrame()
+        registros = [desde_json(fila) for _, fila in filas]
+        df = pd.DataFrame([dict(fila_con_ventas(fila, fila.pop('ventas', None)), segmento=segmento) for (segmento, _), fila in zip(filas, registros)])
+        df['Fecha'] = pd.to_datetime(df['Fecha'])
+        return rellenar_ventas(df)
+
+@st.cache_resource
+def obtener_backend(workspace_id):
+    if CONFIG_ALMACENAMIENTO.get('backend', 'firestore') == 'sqlite':
+        return BackendSQLite(CONFIG_ALMACENAMIENTO.get('ruta', 'infinity_local.db'), workspace_id)
+    return BackendFirestore(db.collection('socios').document(workspace_id))
+
+def backend_actual():
+    return obtener_backend(st.secrets["team_config"]["workspace_id"])
+
+# --- COLA DE ESCRITURA EN SEGUNDO PLANO (WRITE-BEHIND) ---
+VENTANA_AGRUPACION_SEG = 0.5
+MAX_REINTENTOS_ESCRITURA = 3
+
+def copiar_valor(valor):
+    """Copia profunda que conserva los centinelas (BORRAR_CAMPO) por identidad."""
+    return copy.deepcopy(valor)
+
+def asignar_en_ruta(destino, ruta, valor):
+    """Aplica un valor (o un borrado de campo) dentro de un dict anidado."""
+    for parte in ruta[:-1]:
+        destino = destino.setdefault(parte, {})
+    if valor is BORRAR_CAMPO:
+        destino.pop(ruta[-1], None)
+    else:
+        destino[ruta[-1]] = valor
+
+def combinar_operaciones(previa, nueva):
+    """Fusiona dos operaciones sobre el mismo documento en una sola (los incrementos se suman)."""
+    accion_previa, ref, datos_previos = previa
+    accion, _, datos = nueva
+    if accion == 'incrementar':
+        if accion_previa == 'incrementar':
+            for ruta, valor in datos.items():
+                previo = datos_previos.get(ruta)
+                if isinstance(valor, Incremento) and isinstance(previo, Incremento):
+                    datos_previos[ruta] = Incremento(previo.valor + valor.valor)
+                else:
+                    datos_previos[ruta] = valor
+            return previa
+        if accion_previa in ('set', 'delete'):
+            documento = datos_previos if accion_previa == 'set' else {}
+            for ruta, valor in datos.items():
+                if isinstance(valor, Incremento):
+                    valor = (leer_en_ruta(documento, ruta) or 0) + valor.valor
+                asignar_en_ruta(documento, ruta, valor)
+            return ('set', ref, documento)
+        return nueva
+    if accion != 'update':
+        return nueva
+    if accion_previa == 'delete':
+        return previa
+    if accion_previa == 'set':
+        for ruta, valor in datos.items():
+            asignar_en_ruta(datos_previos, ruta, valor)
+        return previa
+    for ruta, valor in datos.items():
+        prefijo = next((p for p in datos_previos if ruta[:len(p)] == p), None)
+        if prefijo is not None and isinstance(datos_previos[prefijo], dict):
+            asignar_en_ruta(datos_previos[prefijo], ruta[len(prefijo):], valor)
+        else:
+            for cubierta in [p for p in datos_previos if p[:len(ruta)] == ruta]:
+                del datos_previos[cubierta]
+            datos_previos[ruta] = valor
+    return previa
+
+class ColaEscritura:
+    """Hilo por espacio de trabajo que agrupa las escrituras pendientes y las envía en un solo lote."""
+
+    def __init__(self, workspace_id, backend):
+        self.workspace_id = workspace_id
+        self.backend = backend
+        self._condicion = threading.Condition()
+        self._pendientes = {}
+        self._en_vuelo = 0
+        self._reintentos = {}
+        self.confirmadas = 0
+        self.operaciones_fallidas = []
+        self.ultimo_error = None
+        self.ultima_confirmacion = None
+        self._hilo = threading.Thread(target=self._bucle, name=f"cola-escritura-{workspace_id}", daemon=True)
+        self._hilo.start()
+
+    def encolar(self, operaciones):
+        with self._condicion:
+            for operacion in operaciones:
+                accion, ref, datos = operacion
+                clave = ref if accion != 'delete_consulta' else ('consulta', ref)
+                nueva = (accion, ref, copiar_valor(datos))
+                # La operación fusionada pasa al final: un documento reescrito después de un
+                # delete_consulta debe confirmarse detrás de él, no en el hueco de su versión previa.
+                self._pendientes[clave] = combinar_operaciones(self._pendientes.pop(clave), nueva) if clave in self._pendientes else nueva
+            self._condicion.notify_all()
+
+    @property
+    def fallidas(self):
+        with self._condicion:
+            return len(self.operaciones_fallidas)
+
+    def reintentar_fallidas(self):
+        """Devuelve a la cola las operaciones agotadas, delante de lo encolado después de ellas."""
+        with self._condicion:
+            reencoladas = {}
+            for clave, operacion in self.operaciones_fallidas:
+                reencoladas[clave] = combinar_operaciones(reencoladas.pop(clave), operacion) if clave in reencoladas else operacion
+            for clave, operacion in self._pendientes.items():
+                reencoladas[clave] = combinar_operaciones(reencoladas.pop(clave), operacion) if clave in reencoladas else operacion
+            self._pendientes = reencoladas
+            self.operaciones_fallidas = []
+            self.ultimo_error = None
+            self._condicion.notify_all()
+
+    @property
+    def num_pendientes(self):
+        with self._condicion:
+            return len(self._pendientes) + self._en_vuelo
+
+    def vaciar(self, timeout=10):
+        """Bloquea hasta que no quede nada pendiente (p. ej. al cerrar sesión)."""
+        limite = time.time() + timeout
+        with self._condicion:
+            self._condicion.notify_all()
+            while (self._pendientes or self._en_vuelo) and time.time() < limite:
+                self._condicion.wait(timeout=0.1)
+            return not (self._pendientes or self._en_vuelo)
+
+    def _bucle(self):
+        while True:
+            with self._condicion:
+                while not self._pendientes:
+                    self._condicion.wait()
+            # Ventana de agrupación: los clics seguidos se fusionan en el mismo lote.
+            time.sleep(VENTANA_AGRUPACION_SEG)
+            with self._condicion:
+                lote = self._pendientes
+                self._pendientes = {}
+                self._en_vuelo = len(lote)
+            try:
+                self.backend.confirmar(list(lote.values()))
+                with self._condicion:
+                    self.confirmadas += len(lote)
+                    self.ultima_confirmacion = time.time()
+                    self.ultimo_error = None
+                    for clave in lote:
+                        self._reintentos.pop(clave, None)
+            except Exception as e:
+                with self._condicion:
+                    self.ultimo_error = str(e)
+                    # El lote fallido vuelve delante de lo encolado mientras estaba en vuelo, en su orden.
+                    reencoladas = {}
+                    for clave, operacion in lote.items():
+                        intentos = self._reintentos.get(clave, 0) + 1
+                        if intentos >= MAX_REINTENTOS_ESCRITURA:
+                            # No se descarta: queda en la lista de fallidas hasta que alguien la reintente.
+                            self.operaciones_fallidas.append((clave, operacion))
+                            self._reintentos.pop(clave, None)
+                        else:
+                            self._reintentos[clave] = intentos
+                            reencoladas[clave] = operacion
+                    for clave, operacion in self._pendientes.items():
+                        reencoladas[clave] = combinar_operaciones(reencoladas.pop(clave), operacion) if clave in reencoladas else operacion
+                    self._pendientes = reencoladas
+                time.sleep(VENTANA_AGRUPACION_SEG * 2)
+            finally:
+                with self._condicion:
+                    self._en_vuelo = 0
+                    self._condicion.notify_all()
+
+@st.cache_resource
+def obtener_cola_escritura(workspace_id):
+    return ColaEscritura(workspace_id, obtener_backend(workspace_id))
+
 def save_data_to_firestore():
-    """Guarda todo el estado de la sesión del equipo en una ruta compartida en Firestore."""
+    """Encola en segundo plano sólo los campos marcados con `registrar_cambio` desde el último guardado."""
+    cambios = st.session_state.get('_cambios_pendientes') or {}
+    incrementos = st.session_state.get('_incrementos_pendientes') or {}
+    if not cambios and not incrementos:
+        return
     try:
-        workspace_id = st.secrets["team_config"]["workspace_id"]
-        doc_ref = db.collection('socios').document(workspace_id).collection('app_data').document('main')
+        cola = obtener_cola_escritura(st.secrets["team_config"]["workspace_id"])
     except KeyError:
         st.error("Error de configuración: No se encontró 'team_config' o 'workspace_id' en los secretos.")
         return
 
-    data_to_save = {
-        'ofertas': copy.deepcopy(st.session_state.get('ofertas', {})),
-        'boveda': copy.deepcopy(st.session_state.get('boveda', [])),
-        'plantillas': copy.deepcopy(st.session_state.get('plantillas', {}))
-    }
-
-    for offer_id, offer_data in data_to_save['ofertas'].items():
-        if 'testeos' in offer_data and isinstance(offer_data['testeos'], pd.DataFrame):
-            offer_data['testeos'] = df_to_json(offer_data['testeos'])
-        if 'escala' in offer_data:
-            for camp_id, camp_data in offer_data['escala'].items():
-                if 'registros' in camp_data and isinstance(camp_data['registros'], pd.DataFrame):
-                    camp_data['registros'] = df_to_json(camp_data['registros'])
+    cola.encolar(operaciones_de_cambios(cambios) + operaciones_de_rollups(incrementos))
+    publicar_en_almacen(cambios, st.session_state.get('_documentos_log', {}))
+    publicar_rollups(incrementos)
+    st.session_state['_cambios_pendientes'] = {}
+    st.session_state['_documentos_log'] = {}
+    st.session_state['_incrementos_pendientes'] = {}
 
+def render_estado_sincronizacion():
+    """Muestra en la barra lateral el estado de la cola de escritura del equipo."""
     try:
-        doc_ref.set(data_to_save)
-    except Exception as e:
-        st.error(f"Error al guardar los datos en la nube: {e}")
+        cola = obtener_cola_escritura(st.secrets["team_config"]["workspace_id"])
+    except KeyError:
+        return
+    pendientes = cola.num_pendientes
+    if cola.ultimo_error:
+        st.warning(f"⚠️ Error al sincronizar ({pendientes} pendientes, {cola.fallidas} fallidos): {cola.ultimo_error}")
+    elif pendientes:
+        st.info(f"⏳ Guardando {pendientes} cambio(s) en la nube...")
+    elif cola.ultima_confirmacion:
+        st.success(f"✅ {cola.confirmadas} cambio(s) sincronizados · último hace {int(time.time() - cola.ultima_confirmacion)} s")
+    else:
+        st.info("Los datos del equipo se guardan automáticamente en la nube.")
+    fallidas = list(cola.operaciones_fallidas)
+    if fallidas:
+        with st.expander(f"⚠️ {len(fallidas)} cambio(s) sin guardar tras varios intentos", expanded=True):
+            for _, (accion, ref, _) in fallidas:
+                destino = ref.id if isinstance(ref, Documento) else f"{ref.campo}={ref.valor}"
+                st.caption(f"`{accion}` · {ref.coleccion}/{destino}")
+            if st.button("🔁 Reintentar", key="reintentar_fallidas", use_container_width=True):
+                cola.reintentar_fallidas()
+                st.rerun()
+
+def migrar_documento_main(backend):
+    """Migración única: reparte el antiguo documento app_data/main en documentos por fragmento."""
+    data = backend.leer('app_data', 'main')
+    operaciones = []
+    if data is not None:
+        for id_oferta, oferta in data.get('ofertas', {}).items():
+            doc_oferta = {k: v for k, v in oferta.items() if k not in ('escala', 'testeos')}
+            operaciones += operaciones_mover_instantanea(id_oferta, 'testeos', oferta.get('testeos'), doc_oferta)
+            operaciones.append(('set', referencia_fragmento('ofertas', id_oferta), doc_oferta))
+            for id_campana, campana in oferta.get('escala', {}).items():
+                doc_campana = {k: v for k, v in campana.items() if k != 'registros'}
+                doc_campana.update(oferta_id=id_oferta, campana_id=id_campana)
+                operaciones += operaciones_mover_instantanea(id_oferta, id_campana, campana.get('registros'), doc_campana)
+                operaciones.append(('set', referencia_fragmento('campanas', (id_oferta, id_campana)), doc_campana))
+        for entrada in data.get('boveda', []):
+            operaciones.append(('set', referencia_fragmento('boveda', entrada['id']), entrada))
+        for id_plantilla, plantilla in data.get('plantillas', {}).items():
+            operaciones.append(('set', referencia_fragmento('plantillas', id_plantilla), plantilla))
+    # El documento main se conserva intacto como respaldo; la marca de layout evita repetir la migración.
+    operaciones.append(('set', Documento('app_data', 'layout'), {
+        'version': VERSION_ESQUEMA_ALMACENAMIENTO,
+        'migrado_desde_main': data is not None,
+        'fecha_migracion': datetime.datetime.now().isoformat()
+    }))
+    backend.confirmar(operaciones)
+
+def operaciones_mover_instantanea(id_oferta, segmento, blob, doc):
+    """Lleva el DataFrame guardado de un segmento a su instantánea y anota su versión en `doc`."""
+    if blob is None:
+        return []
+    doc[CAMPO_VERSION_INSTANTANEA] = nuevo_id_registro()
+    return [('set', Documento('instantaneas', id_instantanea(id_oferta, segmento)), {'oferta_id': id_oferta, 'segmento': segmento, 'registros': blob})]
 
+def migrar_instantaneas(backend):
+    """Migración única (esquema 2 -> 3): saca los DataFrames de ofertas y campañas a `instantaneas`.
+
+    Se confirma oferta a oferta para que ningún lote crezca con el número de ofertas.
+    """
+    campanas = {}
+    for id_doc, doc in backend.listar('campanas', campos=['oferta_id', 'campana_id', 'registros']):
+        campanas.setdefault(doc['oferta_id'], []).append((id_doc, doc))
+    for id_oferta, doc in backend.listar('ofertas', campos=['testeos']):
+        cambios = {}
+        operaciones = operaciones_mover_instantanea(id_oferta, 'testeos', doc.get('testeos'), cambios)
+        if cambios:
+            operaciones.append(('update', Documento('ofertas', id_oferta), {(CAMPO_VERSION_INSTANTANEA,): cambios[CAMPO_VERSION_INSTANTANEA], ('testeos',): BORRAR_CAMPO}))
+        for id_doc, doc_campana in campanas.get(id_oferta, []):
+            cambios = {}
+            operaciones += operaciones_mover_instantanea(id_oferta, doc_campana['campana_id'], doc_campana.get('registros'), cambios)
+            if cambios:
+                operaciones.append(('update', Documento('campanas', id_doc), {(CAMPO_VERSION_INSTANTANEA,): cambios[CAMPO_VERSION_INSTANTANEA], ('registros',): BORRAR_CAMPO}))
+        if operaciones:
+            backend.confirmar(operaciones)
+    backend.confirmar([('update', Documento('app_data', 'layout'), {
+        ('version',): VERSION_ESQUEMA_ALMACENAMIENTO,
+        ('fecha_migracion_instantaneas',): datetime.datetime.now().isoformat()
+    })])
 
 def load_data_from_firestore():
-    """Carga los datos del equipo desde la ruta compartida de Firestore."""
+    """Carga los datos del equipo desde los documentos fragmentados del espacio de trabajo."""
     try:
-        workspace_id = st.secrets["team_config"]["workspace_id"]
-        doc_ref = db.collection('socios').document(workspace_id).collection('app_data').document('main')
+        backend = backend_actual()
     except KeyError:
         st.error("Error de configuración: No se encontró 'team_config' o 'workspace_id' en los secretos.")
         return
-        
-    doc = doc_ref.get()
-    if doc.exists:
-        data = doc.to_dict()
-        st.session_state.boveda = data.get('boveda', [])
-        st.session_state.plantillas = data.get('plantillas', {})
-        loaded_ofertas = {}
-        for offer_id, offer_data in data.get('ofertas', {}).items():
-            processed_offer = offer_data.copy()
-            if 'testeos' in processed_offer:
-                processed_offer['testeos'] = json_to_df(processed_offer['testeos'])
-            if 'escala' in processed_offer:
-                for camp_id, camp_data in processed_offer['escala'].items():
-                    if 'registros' in camp_data:
-                        camp_data['registros'] = json_to_df(camp_data['registros'])
-            loaded_ofertas[offer_id] = processed_offer
-        st.session_state.ofertas = loaded_ofertas
+
+    st.session_state['_cambios_pendientes'] = {}
+    st.session_state['_documentos_log'] = {}
+    almacen = almacen_actual()
+    with almacen.lock:
+        # Sólo el primer inicio de sesión del proceso lee el backend; los demás se sirven de memoria.
+        if not almacen.cargado:
+            layout = backend.leer('app_data', 'layout')
+            if layout is None:
+                migrar_documento_main(backend)
+            elif layout.get('version', 0) < VERSION_ESQUEMA_ALMACENAMIENTO:
+                migrar_instantaneas(backend)
+
+            # Sólo metadatos ligeros: los DataFrames de cada oferta se hidratan bajo demanda.
+            for id_oferta, oferta in backend.listar('ofertas', campos=CAMPOS_METADATOS_OFERTA):
+                oferta['escala'] = {}
+                oferta['_hidratada'] = False
+                almacen.ofertas[id_oferta] = oferta
+                almacen.versiones[id_oferta] = almacen.siguiente_version()
+            almacen.boveda = sorted((sin_marca_origen(datos) for _, datos in backend.listar('boveda')), key=clave_orden_boveda, reverse=True)
+            almacen.indice_boveda = IndiceBoveda(almacen.boveda)
+            almacen.plantillas = {id_plantilla: sin_marca_origen(datos) for id_plantilla, datos in backend.listar('plantillas')}
+            almacen.version_boveda = almacen.siguiente_version()
+            almacen.version_plantillas = almacen.siguiente_version()
+            almacen.cargado = True
+            # A partir de aquí los cambios de otros procesos llegan por push, sin recargas completas.
+            iniciar_escuchas(almacen, backend)
+    st.session_state.ofertas = {}
+    st.session_state['_versiones_almacen'] = {}
+    st.session_state['_lru_ofertas'] = []
+    sincronizar_sesion_con_almacen()
+
+# --- ÍNDICE DE BÚSQUEDA DE LA BÓVEDA ---
+# Índice invertido en memoria, uno por espacio de trabajo, que vive en el almacén compartido.
+# Los términos se normalizan sin acentos ni mayúsculas y se guardan en un vocabulario ordenado,
+# así que cada palabra de la búsqueda se resuelve como prefijo con bisect ("vsl" encuentra "VSLs").
+# Para cada faceta guarda los ids por valor, de modo que filtrar y contar son operaciones de conjuntos.
+# Se mantiene entrada a entrada desde publicar_en_almacen y aplicar_cambios_remotos.
+CAMPOS_BUSQUEDA_BOVEDA = ('nombre', 'tipo_oferta', 'nicho', 'idioma', 'estatus', 'comentarios')
+FACETAS_BOVEDA = {'tipo_oferta': 'Tipo', 'estatus': 'Estatus', 'nicho': 'Nicho', 'idioma': 'Idioma', 'calificacion': 'Calificación'}
+ESTATUS_BOVEDA_POR_DEFECTO = '💡 Idea'
+
+def normalizar_busqueda(texto):
+    """Minúsculas y sin diacríticos: 'Nutrición' y 'nutricion' producen el mismo término."""
+    descompuesto = unicodedata.normalize('NFKD', str(texto))
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c)).lower()
+
+def terminos_busqueda(texto):
+    return re.findall(r'\w+', normalizar_busqueda(texto))
+
+class IndiceBoveda:
+    """Índice invertido con prefijos y facetas sobre las entradas de la Bóveda."""
+
+    def __init__(self, entradas=()):
+        self.postings = {}
+        self.vocabulario = []
+        self.facetas = {campo: {} for campo in FACETAS_BOVEDA}
+        self.por_id = {}
+        for entrada in entradas:
+            self.agregar(entrada)
+
+    def agregar(self, entrada):
+        id_entrada = entrada['id']
+        if id_entrada in self.por_id:
+            self.quitar(id_entrada)
+        # Las entradas antiguas sin estatus se muestran como Idea: se indexan igual.
+        if not entrada.get('estatus'):
+            entrada = dict(entrada, estatus=ESTATUS_BOVEDA_POR_DEFECTO)
+        terminos = set()
+        for campo in CAMPOS_BUSQUEDA_BOVEDA:
+            if entrada.get(campo) is not None:
+                terminos.update(terminos_busqueda(entrada[campo]))
+        valores = {campo: entrada.get(campo) for campo in FACETAS_BOVEDA if entrada.get(campo) not in (None, '')}
+        for termino in terminos:
+            ids = self.postings.get(termino)
+            if ids is None:
+                ids = self.postings[termino] = set()
+                bisect.insort(self.vocabulario, termino)
+            ids.add(id_entrada)
+        for campo, valor in valores.items():
+            self.facetas[campo].setdefault(valor, set()).add(id_entrada)
+        self.por_id[id_entrada] = (terminos, valores)
+
+    def quitar(self, id_entrada):
+        terminos, valores = self.por_id.pop(id_entrada, ((), {}))
+        for termino in terminos:
+            ids = self.postings[termino]
+            ids.discard(id_entrada)
+            if not ids:
+                del self.postings[termino]
+                del self.vocabulario[bisect.bisect_left(self.vocabulario, termino)]
+        for campo, valor in valores.items():
+            ids = self.facetas[campo][valor]
+            ids.discard(id_entrada)
+            if not ids:
+                del self.facetas[campo][valor]
+
+    def ids_con_prefijo(self, prefijo):
+        ids = set()
+        for posicion in range(bisect.bisect_left(self.vocabulario, prefijo), len(self.vocabulario)):
+            termino = self.vocabulario[posicion]
+            if not termino.startswith(prefijo):
+                break
+            ids |= self.postings[termino]
+        return ids
+
+    def buscar(self, texto):
+        """Ids de las entradas que contienen todas las palabras de `texto`, cada una como prefijo."""
+        resultado = None
+        # Se empieza por las palabras más largas: suelen ser las más selectivas.
+        for termino in sorted(set(terminos_busqueda(texto)), key=len, reverse=True):
+            ids = self.ids_con_prefijo(termino)
+            resultado = ids if resultado is None else resultado & ids
+            if not resultado:
+                return set()
+        return set(self.por_id) if resultado is None else resultado
+
+    def filtrar(self, ids, filtros):
+        """Restringe `ids` a los filtros de faceta {campo: valores}: O dentro de una faceta, Y entre facetas."""
+        for campo, valores in filtros.items():
+            if valores:
+                ids = ids & set().union(*(self.facetas[campo].get(valor, set()) for valor in valores))
+        return ids
+
+    def conteos(self, campo, ids=None):
+        """{valor: número de entradas} de una faceta, restringido a `ids` si se indica."""
+        if ids is None:
+            return {valor: len(miembros) for valor, miembros in self.facetas[campo].items()}
+        return {valor: len(miembros & ids) for valor, miembros in self.facetas[campo].items()}
+
+# --- ALMACÉN COMPARTIDO DEL ESPACIO DE TRABAJO (TODO EL PROCESO) ---
+# Todas las sesiones del proceso leen de una única copia en memoria por espacio de trabajo.
+# Cada sesión trabaja sobre copias de los metadatos que comparten los DataFrames con el almacén
+# (los DataFrames nunca se modifican in situ: cada cambio crea uno nuevo), y al guardar publica
+# aquí los campos que tocó. Al inicio de cada rerun la sesión trae lo que otras hayan publicado.
+MAX_OFERTAS_HIDRATADAS_PROCESO = 32
+
+class AlmacenWorkspace:
+    """Instantánea versionada del espacio de trabajo compartida por las sesiones del proceso."""
+
+    def __init__(self, workspace_id):
+        self.workspace_id = workspace_id
+        self.lock = threading.RLock()
+        self.cargado = False
+        self.ofertas = {}
+        self.versiones = {}
+        self.boveda = []
+        self.indice_boveda = IndiceBoveda()
+        self.plantillas = {}
+        self.version_boveda = 0
+        # Versión de cada entrada de la Bóveda (las que faltan no han cambiado desde la carga).
+        self.versiones_boveda = {}
+        self.version_plantillas = 0
+        self.lru = []
+        self.rollups = {}
+        self.sugerencias = {}
+        self.cubos = {}
+        self.escuchas = []
+        self.ultimo_error_escucha = None
+        self._contador = 0
+
+    def siguiente_version(self):
+        self._contador += 1
+        return self._contador
+
+    def marcar_reciente(self, id_oferta):
+        """Mantiene acotado el número de ofertas hidratadas que retiene el proceso."""
+        if id_oferta in self.lru:
+            self.lru.remove(id_oferta)
+        self.lru.append(id_oferta)
+        while len(self.lru) > MAX_OFERTAS_HIDRATADAS_PROCESO:
+            self.descartar_hidratacion(self.lru.pop(0))
+
+    def descartar_hidratacion(self, id_oferta):
+        """Deja sólo los metadatos de una oferta; la próxima sesión que la necesite la recarga."""
+        if id_oferta in self.ofertas:
+            # Sólo se sustituye la referencia: las sesiones que aún la usan conservan sus DataFrames.
+            metadatos = dict(self.ofertas[id_oferta])
+            liberar_oferta(metadatos)
+            self.ofertas[id_oferta] = metadatos
+        if id_oferta in self.lru:
+            self.lru.remove(id_oferta)
+
+@st.cache_resource
+def obtener_almacen(workspace_id):
+    return AlmacenWorkspace(workspace_id)
+
+def almacen_actual():
+    return obtener_almacen(st.secrets["team_config"]["workspace_id"])
+
+def copiar_compartiendo_dfs(objeto):
+    """Copia profunda de metadatos que reutiliza (sin duplicar) los DataFrames que contiene."""
+    memo = {}
+    pila = [objeto]
+    while pila:
+        actual = pila.pop()
+        if isinstance(actual, pd.DataFrame):
+            memo[id(actual)] = actual
+        elif isinstance(actual, dict):
+            pila.extend(actual.values())
+    return copy.deepcopy(objeto, memo)
+
+def materializar_oferta(oferta):
+    """Vuelca los búferes de anexos pendientes antes de compartir la oferta con otras sesiones."""
+    if oferta.get('_hidratada', True):
+        obtener_registros(oferta, 'testeos')
+        for campana in oferta.get('escala', {}).values():
+            obtener_registros(campana, 'registros')
+
+def copiar_en_ruta(origen, destino, ruta):
+    """Copia el valor de `origen` en `ruta` sobre `destino`, o lo elimina si ya no existe."""
+    for parte in ruta[:-1]:
+        origen = origen.get(parte) if isinstance(origen, dict) else None
+        destino = destino.setdefault(parte, {})
+    if isinstance(origen, dict) and ruta[-1] in origen:
+        destino[ruta[-1]] = copiar_compartiendo_dfs(origen[ruta[-1]])
     else:
-        st.session_state.ofertas = {}
-        st.session_state.boveda = []
-        st.session_state.plantillas = {}
-        save_data_to_firestore()
+        destino.pop(ruta[-1], None)
+
+def cambiar_version_entrada_boveda(almacen, id_entrada, eliminada=False):
+    """Nueva versión de una entrada de la Bóveda; su tarjeta memorizada se descarta (y su versión, si se borró)."""
+    almacen.cubos.pop(('tarjeta_boveda', id_entrada), None)
+    if eliminada:
+        almacen.versiones_boveda.pop(id_entrada, None)
+    else:
+        almacen.versiones_boveda[id_entrada] = almacen.siguiente_version()
+
+def publicar_en_almacen(cambios, documentos_log):
+    """Aplica sobre el almacén compartido los fragmentos que la sesión acaba de guardar."""
+    almacen = almacen_actual()
+    versiones = st.session_state.setdefault('_versiones_almacen', {})
+    ofertas_tocadas, segmentos_log = set(), set()
+    boveda_tocada = plantillas_tocadas = False
+    with almacen.lock:
+        for (tipo, id_logico), rutas in cambios.items():
+            if tipo == 'registros':
+                doc = documentos_log.get(id_logico)
+                if doc is not None:
+                    ofertas_tocadas.add(doc['oferta_id'])
+                    segmentos_log.add((doc['oferta_id'], doc['segmento']))
+                continue
+            fragmento = obtener_fragmento(tipo, id_logico)
+            if tipo == 'ofertas':
+                ofertas_tocadas.add(id_logico)
+                compartida = almacen.ofertas.get(id_logico)
+                if fragmento is None:
+                    almacen.ofertas.pop(id_logico, None)
+                    almacen.rollups.pop(id_logico, None)
+                elif rutas is None or compartida is None:
+                    materializar_oferta(fragmento)
+                    almacen.ofertas[id_logico] = copiar_compartiendo_dfs(fragmento)
+                else:
+                    for ruta in rutas_minimas(rutas):
+                        if ruta == ('testeos',):
+                            compartida[CAMPO_VERSION_INSTANTANEA] = fragmento.get(CAMPO_VERSION_INSTANTANEA)
+                        if ruta[0] == 'testeos' and not compartida.get('_hidratada'):
+                            continue
+                        if ruta == ('testeos',):
+                            compartida['testeos'] = obtener_registros(fragmento, 'testeos')
+                        else:
+                            copiar_en_ruta(fragmento, compartida, ruta)
+            elif tipo == 'campanas':
+                id_oferta, id_campana = id_logico
+                ofertas_tocadas.add(id_oferta)
+                compartida = almacen.ofertas.get(id_oferta)
+                if compartida is None or not compartida.get('_hidratada'):
+                    continue
+                if fragmento is None:
+                    compartida['escala'].pop(id_campana, None)
+                elif rutas is None or id_campana not in compartida['escala']:
+                    obtener_registros(fragmento, 'registros')
+                    compartida['escala'][id_campana] = copiar_compartiendo_dfs(fragmento)
+                else:
+                    for ruta in rutas_minimas(rutas):
+                        if ruta == ('registros',):
+                            compartida['escala'][id_campana]['registros'] = obtener_registros(fragmento, 'registros')
+                            compartida['escala'][id_campana][CAMPO_VERSION_INSTANTANEA] = fragmento.get(CAMPO_VERSION_INSTANTANEA)
+                        else:
+                            copiar_en_ruta(fragmento, compartida['escala'][id_campana], ruta)
+            elif tipo == 'boveda':
+                boveda_tocada = True
+                almacen.boveda = [e for e in almacen.boveda if e['id'] != id_logico]
+                almacen.indice_boveda.quitar(id_logico)
+                cambiar_version_entrada_boveda(almacen, id_logico, fragmento is None)
+                if fragmento is not None:
+                    almacen.boveda.append(copy.deepcopy(fragmento))
+                    almacen.boveda.sort(key=clave_orden_boveda, reverse=True)
+                    almacen.indice_boveda.agregar(fragmento)
+            elif tipo == 'plantillas':
+                plantillas_tocadas = True
+                if fragmento is None:
+                    almacen.plantillas.pop(id_logico, None)
+                else:
+                    almacen.plantillas[id_logico] = copy.deepcopy(fragmento)
+
+        # Las altas del log viven en los búferes de la sesión: se publica el segmento ya materializado.
+        for id_oferta, segmento in segmentos_log:
+            oferta, compartida = st.session_state.ofertas.get(id_oferta), almacen.ofertas.get(id_oferta)
+            if oferta is None or compartida is None or not (oferta.get('_hidratada') and compartida.get('_hidratada')):
+                continue
+            id_campana = None if segmento == 'testeos' else segmento
+            if id_campana is None:
+                origen, destino = oferta, compartida
+            elif id_campana in oferta.get('escala', {}) and id_campana in compartida['escala']:
+                origen, destino = oferta['escala'][id_campana], compartida['escala'][id_campana]
+            else:
+                continue
+            clave = clave_registros(id_campana)
+            destino[clave] = obtener_registros(origen, clave)
+            destino['_ids_log'] = set(origen.get('_ids_log', ()))
+
+        # Si nadie más publicó entre medias, la copia de la sesión ya refleja la nueva versión;
+        # si no, se deja la antigua para que el próximo rerun traiga el estado combinado.
+        for id_oferta in ofertas_tocadas:
+            anterior = almacen.versiones.get(id_oferta)
+            if id_oferta not in almacen.ofertas:
+                almacen.versiones.pop(id_oferta, None)
+                versiones.pop(id_oferta, None)
+                continue
+            almacen.versiones[id_oferta] = almacen.siguiente_version()
+            if versiones.get(id_oferta) == anterior:
+                versiones[id_oferta] = almacen.versiones[id_oferta]
+        if boveda_tocada:
+            al_dia = versiones.get('_boveda') == almacen.version_boveda
+            almacen.version_boveda = almacen.siguiente_version()
+            if al_dia:
+                versiones['_boveda'] = almacen.version_boveda
+                st.session_state['_versiones_boveda'] = dict(almacen.versiones_boveda)
+        if plantillas_tocadas:
+            al_dia = versiones.get('_plantillas') == almacen.version_plantillas
+            almacen.version_plantillas = almacen.siguiente_version()
+            if al_dia:
+                versiones['_plantillas'] = almacen.version_plantillas
+
+def sincronizar_sesion_con_almacen():
+    """Trae a la sesión las ofertas, la bóveda y las plantillas que otras sesiones hayan cambiado."""
+    almacen = almacen_actual()
+    versiones = st.session_state.setdefault('_versiones_almacen', {})
+    ofertas = st.session_state.setdefault('ofertas', {})
+    with almacen.lock:
+        for id_oferta, version in almacen.versiones.items():
+            if versiones.get(id_oferta) != version:
+                ofertas[id_oferta] = copiar_compartiendo_dfs(almacen.ofertas[id_oferta])
+                versiones[id_oferta] = version
+        for id_oferta in [i for i in ofertas if i not in almacen.versiones]:
+            del ofertas[id_oferta]
+            versiones.pop(id_oferta, None)
+        if versiones.get('_boveda') != almacen.version_boveda:
+            st.session_state.boveda = copy.deepcopy(almacen.boveda)
+            st.session_state['_versiones_boveda'] = dict(almacen.versiones_boveda)
+            versiones['_boveda'] = almacen.version_boveda
+        if versiones.get('_plantillas') != almacen.version_plantillas:
+            st.session_state.plantillas = copy.deepcopy(almacen.plantillas)
+            versiones['_plantillas'] = almacen.version_plantillas
+
+# --- ESCUCHAS EN TIEMPO REAL (INVALIDACIÓN POR PUSH) ---
+# Un on_snapshot por colección mantiene el almacén al día con lo que escriben otros procesos.
+# Cada escritura lleva la marca del proceso que la hizo, así el eco de las propias se ignora.
+TOKEN_PROCESO = uuid.uuid4().hex
+CAMPO_ORIGEN_ESCRITURA = 'actualizado_por'
+COLECCIONES_ESCUCHADAS = ('ofertas', 'campanas', 'registros', 'boveda', 'plantillas', 'rollups')
+
+def sin_marca_origen(datos):
+    return {k: v for k, v in datos.items() if k != CAMPO_ORIGEN_ESCRITURA}
+
+def aplicar_cambios_remotos(almacen, cambios, token=TOKEN_PROCESO):
+    """Aplica en el almacén los documentos que otros procesos cambiaron.
+
+    `cambios` es una lista de (coleccion, id_logico, datos, eliminado), donde `datos` es la última
+    versión conocida del documento. No depende de Streamlit: se puede probar con el emulador de
+    Firestore o con cambios fabricados a mano. Devuelve los ids de las ofertas afectadas.
+    """
+    ofertas_tocadas = set()
+    boveda_tocada = plantillas_tocadas = False
+    with almacen.lock:
+        for coleccion, id_logico, datos, eliminado in cambios:
+            if coleccion == 'rollups':
+                # Tras un Increment el documento del servidor es el total real, incluso para los
+                # ecos propios, así que se aplica siempre.
+                rollup = almacen.rollups.get(datos.get('oferta_id'))
+                if rollup is not None:
+                    rollup.reemplazar_dia(datos['segmento'], datos['fecha'], {} if eliminado else datos.get('componentes', {}))
+                continue
+            # Los borrados se aplican siempre: `datos` es el último estado del documento, que puede
+            # llevar la marca de este proceso si fue el último en escribirlo antes de que otro lo borrara.
+            if not eliminado and datos.get(CAMPO_ORIGEN_ESCRITURA) == token:
+                continue
+            if coleccion == 'ofertas':
+                ofertas_tocadas.add(id_logico)
+                if eliminado:
+                    almacen.ofertas.pop(id_logico, None)
+                    almacen.rollups.pop(id_logico, None)
+                    continue
+                compartida = almacen.ofertas.setdefault(id_logico, {'escala': {}, '_hidratada': False})
+                # Una instantánea de testeos reescrita (compactación ajena) invalida los DataFrames.
+                instantanea_nueva = compartida.get(CAMPO_VERSION_INSTANTANEA) != datos.get(CAMPO_VERSION_INSTANTANEA)
+                for campo in CAMPOS_METADATOS_OFERTA:
+                    if campo in datos:
+                        compartida[campo] = datos[campo]
+                    else:
+                        compartida.pop(campo, None)
+                if compartida.get('_hidratada') and instantanea_nueva:
+                    almacen.descartar_hidratacion(id_logico)
+            elif coleccion == 'campanas':
+                # Las campañas sólo importan a las ofertas hidratadas; las demás las leerán al hidratarse.
+                id_oferta, id_campana = datos.get('oferta_id'), datos.get('campana_id')
+                compartida = almacen.ofertas.get(id_oferta)
+                if compartida is None or not compartida.get('_hidratada'):
+                    continue
+                campana = compartida['escala'].get(id_campana)
+                if eliminado:
+                    compartida['escala'].pop(id_campana, None)
+                elif campana is None or campana.get(CAMPO_VERSION_INSTANTANEA) != datos.get(CAMPO_VERSION_INSTANTANEA):
+                    almacen.descartar_hidratacion(id_oferta)
+                else:
+                    metadatos = deserializar_campana({k: v for k, v in datos.items() if k != 'registros'})
+                    for campo in [k for k in campana if k != 'registros' and not k.startswith('_') and k not in metadatos]:
+                        del campana[campo]
+                    campana.update(metadatos)
+                ofertas_tocadas.add(id_oferta)
+            elif coleccion == 'registros':
+                id_oferta, segmento = datos.get('oferta_id'), datos.get('segmento')
+                compartida = almacen.ofertas.get(id_oferta)
+                if compartida is None or not compartida.get('_hidratada'):
+                    continue
+                contenedor = compartida if segmento == 'testeos' else compartida['escala'].get(segmento)
+                if contenedor is None:
+                    almacen.descartar_hidratacion(id_oferta)
+                elif eliminado:
+                    # El borrado de un documento de log sólo significa que ya está en el snapshot.
+                    contenedor['_ids_log'] = set(contenedor.get('_ids_log', ())) - {id_logico}
+                    continue
+                else:
+                    clave = 'testeos' if segmento == 'testeos' else 'registros'
+                    contenedor[clave] = aplicar_log_registros(contenedor.get(clave, pd.DataFrame()), {id_logico: datos})
+                    contenedor['_ids_log'] = set(contenedor.get('_ids_log', ())) | {id_logico}
+                ofertas_tocadas.add(id_oferta)
+            elif coleccion == 'boveda':
+                boveda_tocada = True
+                almacen.boveda = [e for e in almacen.boveda if e['id'] != id_logico]
+                almacen.indice_boveda.quitar(id_logico)
+                cambiar_version_entrada_boveda(almacen, id_logico, eliminado)
+                if not eliminado:
+                    entrada = sin_marca_origen(datos)
+                    almacen.boveda.append(entrada)
+                    almacen.boveda.sort(key=clave_orden_boveda, reverse=True)
+                    almacen.indice_boveda.agregar(entrada)
+            elif coleccion == 'plantillas':
+                plantillas_tocadas = True
+                if eliminado:
+                    almacen.plantillas.pop(id_logico, None)
+                else:
+                    almacen.plantillas[id_logico] = sin_marca_origen(datos)
+
+        for id_oferta in ofertas_tocadas:
+            if id_oferta in almacen.ofertas:
+                almacen.versiones[id_oferta] = almacen.siguiente_version()
+            else:
+                almacen.versiones.pop(id_oferta, None)
+        if boveda_tocada:
+            almacen.version_boveda = almacen.siguiente_version()
+        if plantillas_tocadas:
+            almacen.version_plantillas = almacen.siguiente_version()
+    return ofertas_tocadas
+
+def iniciar_escuchas(almacen, backend):
+    """Suscribe el almacén a las colecciones del espacio de trabajo (una vez por proceso)."""
+    def al_cambiar(coleccion):
+        def callback(cambios):
+            try:
+                aplicar_cambios_remotos(almacen, [(coleccion, id_doc, datos, eliminado) for id_doc, datos, eliminado in cambios])
+            except Exception as e:
+                almacen.ultimo_error_escucha = str(e)
+        return callback
+    almacen.escuchas = [backend.escuchar(coleccion, al_cambiar(coleccion)) for coleccion in COLECCIONES_ESCUCHADAS]
+
+# --- HIDRATACIÓN PEREZOSA DE OFERTAS ---
+# Al iniciar sesión sólo se leen los metadatos de cada oferta. Los testeos, las campañas y su
+# log se cargan al abrir el laboratorio (o cuando el dashboard global los necesita) y se
+# mantienen en un LRU de MAX_OFERTAS_HIDRATADAS ofertas por sesión.
+CAMPOS_METADATOS_OFERTA = ['nombre', 'tipo_embudo', 'estado', 'funnel', 'anuncios_testeo', 'comision_pp', 'cpa_objetivo', 'historial_tarifas', 'umbrales_sugerencias', 'checklist', 'rollups', CAMPO_VERSION_INSTANTANEA]
+MAX_OFERTAS_HIDRATADAS = 8
+
+def hidratar_oferta(id_oferta):
+    """Carga los testeos, las campañas de escala y el log de registros de una oferta.
+
+    Si otra sesión del proceso ya la hidrató, se reutilizan sus DataFrames del almacén compartido.
+    """
+    almacen = almacen_actual()
+    with almacen.lock:
+        compartida = almacen.ofertas.get(id_oferta)
+        if compartida is not None and compartida.get('_hidratada'):
+            st.session_state.ofertas[id_oferta] = copiar_compartiendo_dfs(compartida)
+            st.session_state.setdefault('_versiones_almacen', {})[id_oferta] = almacen.versiones[id_oferta]
+            almacen.marcar_reciente(id_oferta)
+            return
+        version = almacen.versiones.get(id_oferta)
+
+    # Lo que haya pendiente en la cola debe estar en el backend antes de leerlo.
+    obtener_cola_escritura(st.secrets["team_config"]["workspace_id"]).vaciar()
+    backend = backend_actual()
+    oferta = st.session_state.ofertas[id_oferta]
+    instantaneas = {doc['segmento']: doc for _, doc in backend.consultar('instantaneas', 'oferta_id', id_oferta)}
+    if 'testeos' not in instantaneas:
+        # Oferta aún sin instantánea: el DataFrame puede seguir en el campo del esquema anterior.
+        instantaneas['testeos'] = {'registros': (backend.leer('ofertas', id_oferta, campos=['testeos']) or {}).get('testeos')}
+    oferta['testeos'] = leer_instantanea(instantaneas['testeos'])
+    oferta['escala'] = {}
+    for _, data in backend.consultar('campanas', 'oferta_id', id_oferta):
+        campana = deserializar_campana(data)
+        if data['campana_id'] in instantaneas or 'registros' not in campana:
+            campana['registros'] = leer_instantanea(instantaneas.get(data['campana_id'], {}))
+        oferta['escala'][data['campana_id']] = campana
+    logs = {}
+    for id_log, doc_log in backend.consultar('registros', 'oferta_id', id_oferta):
+        logs.setdefault(doc_log.get('segmento'), {})[id_log] = doc_log
+    preparar_registros_cargados(id_oferta, None, logs.get('testeos', {}))
+    for id_campana in oferta['escala']:
+        preparar_registros_cargados(id_oferta, id_campana, logs.get(id_campana, {}))
+    oferta['_hidratada'] = True
+    with almacen.lock:
+        compartida = almacen.ofertas.get(id_oferta)
+        # Si otra sesión la cambió mientras se leía, no se publica: su versión manda.
+        if compartida is not None and almacen.versiones.get(id_oferta) == version:
+            materializar_oferta(oferta)
+            hidratada = copiar_compartiendo_dfs(oferta)
+            for clave in CAMPOS_METADATOS_OFERTA:
+                if clave in compartida:
+                    hidratada[clave] = compartida[clave]
+            almacen.ofertas[id_oferta] = hidratada
+            almacen.marcar_reciente(id_oferta)
+    # Los snapshots antiguos sin id de registro se reescriben una vez con ids asignados.
+    save_data_to_firestore()
+
+def liberar_oferta(oferta):
+    """Descarta los DataFrames de una oferta hidratada, dejando sólo sus metadatos."""
+    for clave in ('testeos', '_anexos_testeos', '_ids_log'):
+        oferta.pop(clave, None)
+    oferta['escala'] = {}
+    oferta['_hidratada'] = False
+
+def asegurar_ofertas_hidratadas(ids_ofertas):
+    """Hidrata las ofertas indicadas y las marca como recientes en el LRU de la sesión."""
+    ofertas = st.session_state.ofertas
+    lru = st.session_state.setdefault('_lru_ofertas', [])
+    for id_oferta in ids_ofertas:
+        if not ofertas[id_oferta].get('_hidratada', True):
+            hidratar_oferta(id_oferta)
+        if id_oferta in lru:
+            lru.remove(id_oferta)
+        lru.append(id_oferta)
+    capacidad = max(MAX_OFERTAS_HIDRATADAS, len(ids_ofertas))
+    con_cambios = {id_logico if tipo == 'ofertas' else id_logico[0] for tipo, id_logico in st.session_state.get('_cambios_pendientes', {}) if tipo in ('ofertas', 'campanas')}
+    while len(lru) > capacidad:
+        id_antiguo = lru.pop(0)
+        if id_antiguo in ofertas and id_antiguo not in con_cambios:
+            liberar_oferta(ofertas[id_antiguo])
+
+# --- REGISTROS DIARIOS: LOG DE SÓLO-ANEXAR CON COMPACTACIÓN ---
+# Cada alta, edición o baja de un registro diario se persiste como un documento pequeño en
+# registros/{id_registro}. El DataFrame completo de la oferta/campaña (snapshot columnar) sólo
+# se reescribe al compactar, cuando el log de ese segmento supera UMBRAL_COMPACTACION_LOG.
+UMBRAL_COMPACTACION_LOG = 150
+COLUMNA_ID_REGISTRO = 'id_registro'
+
+def nuevo_id_registro():
+    return uuid.uuid4().hex
+
+def clave_registros(id_campana=None):
+    return 'testeos' if id_campana is None else 'registros'
+
+def contenedor_registros(id_oferta, id_campana=None):
+    """La oferta (testeos) o la campaña de escala (registros) que guarda un segmento de registros."""
+    oferta = st.session_state.ofertas[id_oferta]
+    return oferta if id_campana is None else oferta['escala'][id_campana]
+
+def obtener_registros(contenedor, clave):
+    """Devuelve el DataFrame de registros, materializando antes los anexos pendientes del búfer."""
+    anexos = contenedor.get(f'_anexos_{clave}')
+    if anexos:
+        df_anexos = aplicar_esquema(pd.DataFrame(anexos))
+        base = contenedor.get(clave)
+        if base is None or base.empty:
+            columnas = df_anexos.columns if base is None else base.columns.union(df_anexos.columns, sort=False)
+            contenedor[clave] = df_anexos.reindex(columns=columnas)
+        else:
+            contenedor[clave] = concatenar_registros([base, df_anexos])
+        contenedor[f'_anexos_{clave}'] = []
+    return contenedor.get(clave, pd.DataFrame())
+
+def valor_para_documento(valor):
+    """Convierte un valor de una fila de pandas en algo serializable por Firestore."""
+    if isinstance(valor, datetime.date):
+        return valor.strftime('%Y-%m-%d')
+    if hasattr(valor, 'item'):
+        valor = valor.item()
+    if isinstance(valor, float) and math.isnan(valor):
+        return None
+    return valor
+
+def registrar_documento_log(id_registro, doc):
+    """Programa la escritura (o el borrado, si `doc` es None) de un documento del log de registros."""
+    st.session_state.setdefault('_documentos_log', {})[id_registro] = doc
+    registrar_cambio('registros', id_registro)
+
+def anotar_en_log(id_oferta, id_campana, id_registro, fila):
+    """Persiste el estado de un registro en el log; `fila=None` deja una marca de borrado."""
+    contenedor = contenedor_registros(id_oferta, id_campana)
+    doc = {'oferta_id': id_oferta, 'segmento': id_campana or 'testeos', 'ts': time.time()}
+    if fila is None:
+        doc['borrado'] = True
+    else:
+        doc['fila'], doc['ventas'] = ventas_de_fila({col: valor_para_documento(valor) for col, valor in fila.items()})
+    registrar_documento_log(id_registro, doc)
+    ids_log = contenedor.setdefault('_ids_log', set())
+    ids_log.add(id_registro)
+    if len(ids_log) >= UMBRAL_COMPACTACION_LOG:
+        compactar_registros(id_oferta, id_campana)
+
+def anexar_registro(id_oferta, id_campana, registro):
+    """Añade un registro diario en O(1): búfer en memoria + un único documento de log."""
+    registro = dict(registro)
+    registro[COLUMNA_ID_REGISTRO] = nuevo_id_registro()
+    contenedor = contenedor_registros(id_oferta, id_campana)
+    contenedor.setdefault(f'_anexos_{clave_registros(id_campana)}', []).append(registro)
+    actualizar_rollups(id_oferta, id_campana, nueva=registro)
+    anotar_en_log(id_oferta, id_campana, registro[COLUMNA_ID_REGISTRO], registro)
+    return registro[COLUMNA_ID_REGISTRO]
+
+def reemplazar_registro(id_oferta, id_campana, id_registro, valores):
+    """Sobrescribe las columnas de un registro y anota la nueva versión en el log.
+
+    Las columnas que el segmento aún no tiene (p. ej. las ventas de un elemento del funnel añadido
+    después) se crean vacías para el resto de filas.
+    """
+    contenedor = contenedor_registros(id_oferta, id_campana)
+    clave = clave_registros(id_campana)
+    df = obtener_registros(contenedor, clave).copy()
+    mascara = df[COLUMNA_ID_REGISTRO] == id_registro
+    anterior = df.loc[mascara].iloc[0].to_dict()
+    for col, valor in valores.items():
+        if col in df.columns and isinstance(df[col].dtype, pd.CategoricalDtype) and valor not in df[col].cat.categories:
+            df[col] = df[col].cat.add_categories([valor])
+        df.loc[mascara, col] = valor
+    contenedor[clave] = df
+    nueva = df.loc[mascara].iloc[0].to_dict()
+    actualizar_rollups(id_oferta, id_campana, anterior, nueva)
+    anotar_en_log(id_oferta, id_campana, id_registro, nueva)
+
+def borrar_registro(id_oferta, id_campana, id_registro):
+    contenedor = contenedor_registros(id_oferta, id_campana)
+    clave = clave_registros(id_campana)
+    df = obtener_registros(contenedor, clave)
+    mascara = df[COLUMNA_ID_REGISTRO] == id_registro
+    if mascara.any():
+        actualizar_rollups(id_oferta, id_campana, anterior=df.loc[mascara].iloc[0].to_dict())
+    contenedor[clave] = df[~mascara].reset_index(drop=True)
+    anotar_en_log(id_oferta, id_campana, id_registro, None)
+
+def compactar_registros(id_oferta, id_campana=None):
+    """Reescribe el snapshot columnar del segmento y borra los documentos de log que ya absorbe."""
+    contenedor = contenedor_registros(id_oferta, id_campana)
+    clave = clave_registros(id_campana)
+    obtener_registros(contenedor, clave)
+    if id_campana is None:
+        registrar_cambio('ofertas', id_oferta, 'testeos')
+    else:
+        registrar_cambio('campanas', (id_oferta, id_campana), 'registros')
+    for id_log in contenedor.get('_ids_log', ()):
+        registrar_documento_log(id_log, None)
+    contenedor['_ids_log'] = set()
+
+def aplicar_log_registros(df, docs_log):
+    """Aplica sobre el snapshot los documentos del log: altas y ediciones en orden, y bajas."""
+    filas, borrados = {}, set()
+    for id_registro, doc in sorted(docs_log.items(), key=lambda item: item[1].get('ts', 0)):
+        if doc.get('borrado'):
+            filas.pop(id_registro, None)
+            borrados.add(id_registro)
+        else:
+            filas[id_registro] = dict(fila_con_ventas(doc.get('fila', {}), doc.get('ventas')), **{COLUMNA_ID_REGISTRO: id_registro})
+            borrados.discard(id_registro)
+    if borrados and not df.empty:
+        df = df[~df[COLUMNA_ID_REGISTRO].isin(borrados)]
+    if not filas:
+        return df.reset_index(drop=True)
+    nuevas = aplicar_esquema(pd.DataFrame(list(filas.values())))
+    if df.empty:
+        return rellenar_ventas(nuevas.reindex(columns=df.columns.union(nuevas.columns, sort=False)))
+    # Las ediciones conservan la posición original de la fila; las altas van al final.
+    posiciones = pd.Series(np.arange(len(df)), index=df[COLUMNA_ID_REGISTRO].values)
+    combinado = concatenar_registros([nuevas, df]).drop_duplicates(COLUMNA_ID_REGISTRO, keep='first')
+    orden = combinado[COLUMNA_ID_REGISTRO].map(posiciones).to_numpy(dtype=float)
+    orden = np.where(np.isnan(orden), len(df) + np.arange(len(combinado)), orden)
+    return rellenar_ventas(combinado.iloc[np.argsort(orden, kind='stable')].reset_index(drop=True))
+
+def preparar_registros_cargados(id_oferta, id_campana, docs_log):
+    """Combina snapshot + log de un segmento recién cargado y asigna ids a filas antiguas."""
+    contenedor = contenedor_registros(id_oferta, id_campana)
+    clave = clave_registros(id_campana)
+    df = contenedor.get(clave)
+    if df is None:
+        return
+    sin_id = COLUMNA_ID_REGISTRO not in df.columns or df[COLUMNA_ID_REGISTRO].isna().any()
+    if sin_id and not df.empty:
+        df = df.copy()
+        ids = df[COLUMNA_ID_REGISTRO] if COLUMNA_ID_REGISTRO in df.columns else pd.Series(None, index=df.index, dtype=object)
+        df[COLUMNA_ID_REGISTRO] = [i if isinstance(i, str) else nuevo_id_registro() for i in ids]
+    contenedor[clave] = aplicar_log_registros(df, docs_log)
+    contenedor['_ids_log'] = set(docs_log)
+    if sin_id and not df.empty:
+        compactar_registros(id_oferta, id_campana)
+
+# --- ROLLUPS DIARIOS INCREMENTALES ---
+# rollups/{id_oferta}__{segmento}__{fecha} guarda, por componente (anuncio o conjunto de escala),
+# la suma de las métricas de ese día. Cada alta/edición/baja de un registro envía sólo la
+# diferencia como Incremento, y el almacén mantiene una copia en memoria con los agregados por
+# día y por segmento, de modo que los KPIs no recorren el histórico de registros.
+METRICAS_ROLLUP = ('inversion', 'facturacion', 'ganancia_neta', 'ventas_pp', 'pagos_iniciados', 'registros')
+VERSION_ROLLUPS = 2
+
+def metricas_registro(fila):
+    """Vector de métricas acumulables (METRICAS_ROLLUP) de un registro diario."""
+    valores = (fila.get('Inversión'), fila.get('Facturación Total'), fila.get('Ganancia Neta'), fila.get(get_safe_column_name("PP")), fila.get('Pagos Iniciados'), 1)
+    return np.array([0.0 if v is None or pd.isna(v) else float(v) for v in valores])
+
+def id_rollup(id_oferta, segmento, fecha):
+    return f"{id_oferta}__{segmento}__{fecha}"
+
+class RollupOferta:
+    """Copia en memoria de los rollups de una oferta: celdas por día y componente y sus agregados."""
+
+    def __init__(self):
+        self.dias = {}
+        self.por_dia = {}
+        self.por_segmento = {}
+        self.version = 0
+
+    def _acumular(self, tabla, clave, delta):
+        total = tabla.get(clave, 0) + delta
+        # El contador de registros (última métrica) decide si la celda sigue existiendo.
+        if total[-1] <= 0:
+            tabla.pop(clave, None)
+        else:
+            tabla[clave] = total
+
+    def sumar(self, segmento, fecha, componente, delta):
+        self.version += 1
+        self._acumular(self.dias.setdefault((segmento, fecha), {}), componente, delta)
+        if not self.dias[(segmento, fecha)]:
+            del self.dias[(segmento, fecha)]
+        self._acumular(self.por_dia, (segmento, fecha), delta)
+        self._acumular(self.por_segmento, segmento, delta)
+
+    def reemplazar_dia(self, segmento, fecha, componentes):
+        """Sustituye un día completo por el contenido de su documento persistido."""
+        for componente, celda in list(self.dias.get((segmento, fecha), {}).items()):
+            self.sumar(segmento, fecha, componente, -celda)
+        for componente, metricas in componentes.items():
+            delta = np.array([float(metricas.get(m) or 0) for m in METRICAS_ROLLUP])
+            if delta[-1] > 0:
+                self.sumar(segmento, fecha, componente, delta)
+
+    def totales(self, segmentos):
+        total = sum((self.por_segmento[s] for s in segmentos if s in self.por_segmento), np.zeros(len(METRICAS_ROLLUP)))
+        return dict(zip(METRICAS_ROLLUP, total))
+
+    def dias_transcurridos(self, segmentos):
+        fechas = [fecha for segmento, fecha in self.por_dia if segmento in segmentos]
+        if not fechas:
+            return 0
+        return (pd.Timestamp(max(fechas)) - pd.Timestamp(min(fechas))).days + 1
+
+    def df_diario(self):
+        """Un DataFrame con una fila por (segmento, día) y sus métricas sumadas."""
+        if not self.por_dia:
+            return pd.DataFrame(columns=['segmento', 'Fecha', *METRICAS_ROLLUP])
+        claves = list(self.por_dia)
+        df = pd.DataFrame(np.vstack([self.por_dia[c] for c in claves]), columns=list(METRICAS_ROLLUP))
+        df.insert(0, 'Fecha', pd.to_datetime([fecha for _, fecha in claves]))
+        df.insert(0, 'segmento', [segmento for segmento, _ in claves])
+        return df
+
+    def df_componentes(self, segmento):
+        """Un DataFrame con una fila por (día, componente) de un segmento y sus métricas."""
+        filas = [(fecha, componente, celda) for (seg, fecha), componentes in self.dias.items() if seg == segmento for componente, celda in componentes.items()]
+        if not filas:
+            return pd.DataFrame(columns=['Fecha', 'componente', *METRICAS_ROLLUP])
+        df = pd.DataFrame(np.vstack([celda for _, _, celda in filas]), columns=list(METRICAS_ROLLUP))
+        df.insert(0, 'componente', [componente for _, componente, _ in filas])
+        df.insert(0, 'Fecha', pd.to_datetime([fecha for fecha, _, _ in filas]))
+        return df
+
+    @classmethod
+    def desde_registros(cls, segmentos):
+        """Construye el rollup desde cero a partir de {segmento: DataFrame de registros}."""
+        rollup = cls()
+        for segmento, df in segmentos.items():
+            if df.empty:
+                continue
+            columna = 'Anuncio' if segmento == 'testeos' else 'Componente'
+            metricas = pd.DataFrame({
+                'fecha': pd.to_datetime(df['Fecha']).dt.strftime('%Y-%m-%d'),
+                'componente': df.get(columna, pd.Series('', index=df.index)).astype(object).fillna('').astype(str),
+                'inversion': df.get('Inversión'),
+                'facturacion': df.get('Facturación Total'),
+                'ganancia_neta': df.get('Ganancia Neta'),
+                'ventas_pp': df.get(get_safe_column_name("PP")),
+                'pagos_iniciados': df.get('Pagos Iniciados'),
+                'registros': 1.0,
+            })
+            agrupado = metricas.fillna({m: 0.0 for m in METRICAS_ROLLUP}).groupby(['fecha', 'componente'])[list(METRICAS_ROLLUP)].sum()
+            for (fecha, componente), fila in zip(agrupado.index, agrupado.to_numpy(dtype=float)):
+                rollup.sumar(segmento, fecha, componente, fila)
+        return rollup
+
+    def documentos(self, id_oferta):
+        """Los documentos de rollup de la oferta, listos para un 'set' completo."""
+        for (segmento, fecha), componentes in self.dias.items():
+            yield id_rollup(id_oferta, segmento, fecha), {
+                'oferta_id': id_oferta, 'segmento': segmento, 'fecha': fecha,
+                'componentes': {c: dict(zip(METRICAS_ROLLUP, map(float, v))) for c, v in componentes.items()},
+            }
+
+def actualizar_rollups(id_oferta, id_campana, anterior=None, nueva=None):
+    """Acumula para el próximo guardado la diferencia entre la versión anterior y la nueva de un registro."""
+    segmento = id_campana or 'testeos'
+    columna = 'Anuncio' if id_campana is None else 'Componente'
+    pendientes = st.session_state.setdefault('_incrementos_pendientes', {})
+    for fila, signo in ((anterior, -1), (nueva, 1)):
+        if fila is None:
+            continue
+        fecha = pd.Timestamp(fila['Fecha']).strftime('%Y-%m-%d')
+        componente = '' if pd.isna(fila.get(columna)) else str(fila.get(columna))
+        dia = pendientes.setdefault((id_oferta, segmento, fecha), {})
+        dia[componente] = dia.get(componente, 0) + signo * metricas_registro(fila)
+
+def operaciones_de_rollups(incrementos):
+    operaciones = []
+    for (id_oferta, segmento, fecha), componentes in incrementos.items():
+        datos = {('oferta_id',): id_oferta, ('segmento',): segmento, ('fecha',): fecha, (CAMPO_ORIGEN_ESCRITURA,): TOKEN_PROCESO}
+        for componente, delta in componentes.items():
+            for metrica, valor in zip(METRICAS_ROLLUP, delta):
+                if valor:
+                    datos[('componentes', componente, metrica)] = Incremento(float(valor))
+        operaciones.append(('incrementar', Documento('rollups', id_rollup(id_oferta, segmento, fecha)), datos))
+    return operaciones
+
+def publicar_rollups(incrementos):
+    """Aplica los incrementos recién encolados sobre los rollups en memoria del almacén."""
+    almacen = almacen_actual()
+    with almacen.lock:
+        for (id_oferta, segmento, fecha), componentes in incrementos.items():
+            rollup = almacen.rollups.get(id_oferta)
+            if rollup is not None:
+                for componente, delta in componentes.items():
+                    rollup.sumar(segmento, fecha, componente, delta)
+
+def operaciones_reescritura_rollups(id_oferta, rollup, anterior=None):
+    """Operaciones que dejan en el backend exactamente los documentos de rollup de `rollup`.
+
+    Con el rollup `anterior` en memoria sólo se borran los días que desaparecen; sin él, se borran
+    antes todos los documentos de la oferta.
+    """
+    if anterior is None:
+        operaciones = [('delete_consulta', Consulta('rollups', 'oferta_id', id_oferta), None)]
+    else:
+        operaciones = [('delete', Documento('rollups', id_rollup(id_oferta, segmento, fecha)), None) for segmento, fecha in anterior.dias if (segmento, fecha) not in rollup.dias]
+    operaciones += [('set', Documento('rollups', id_doc), dict(doc, **{CAMPO_ORIGEN_ESCRITURA: TOKEN_PROCESO})) for id_doc, doc in rollup.documentos(id_oferta)]
+    return operaciones
+
+def reconstruir_rollups(id_oferta):
+    """Recalcula los rollups de una oferta desde sus registros y los reescribe por completo."""
+    oferta = st.session_state.ofertas[id_oferta]
+    estaba_hidratada = oferta.get('_hidratada', True)
+    if not estaba_hidratada:
+        hidratar_oferta(id_oferta)
+        oferta = st.session_state.ofertas[id_oferta]
+    segmentos = {'testeos': obtener_registros(oferta, 'testeos')}
+    for id_campana, campana in oferta.get('escala', {}).items():
+        segmentos[id_campana] = obtener_registros(campana, 'registros')
+    rollup = RollupOferta.desde_registros(segmentos)
+    # Los incrementos aún sin guardar ya están en los registros: sumarlos al rollup reconstruido los duplicaría.
+    pendientes = st.session_state.get('_incrementos_pendientes', {})
+    for clave in [c for c in pendientes if c[0] == id_oferta]:
+        del pendientes[clave]
+    almacen = almacen_actual()
+    with almacen.lock:
+        anterior = almacen.rollups.get(id_oferta)
+        almacen.rollups[id_oferta] = rollup
+    obtener_cola_escritura(st.secrets["team_config"]["workspace_id"]).encolar(operaciones_reescritura_rollups(id_oferta, rollup, anterior))
+    oferta['rollups'] = VERSION_ROLLUPS
+    registrar_cambio('ofertas', id_oferta, 'rollups')
+    save_data_to_firestore()
+    if not estaba_hidratada:
+        liberar_oferta(oferta)
+
+def asegurar_rollups(ids_ofertas):
+    """Carga en el almacén los rollups de las ofertas indicadas (o los construye si aún no existen)."""
+    almacen = almacen_actual()
+    with almacen.lock:
+        faltan = [i for i in ids_ofertas if i not in almacen.rollups]
+    if not faltan:
+        return
+    # Los incrementos aún en la cola deben estar en el backend antes de leerlo.
+    obtener_cola_escritura(st.secrets["team_config"]["workspace_id"]).vaciar()
+    backend = backend_actual()
+    for id_oferta in faltan:
+        if st.session_state.ofertas[id_oferta].get('rollups') != VERSION_ROLLUPS:
+            reconstruir_rollups(id_oferta)
+            continue
+        rollup = RollupOferta()
+        for _, doc in backend.consultar('rollups', 'oferta_id', id_oferta):
+            rollup.reemplazar_dia(doc['segmento'], doc['fecha'], doc.get('componentes', {}))
+        with almacen.lock:
+            almacen.rollups.setdefault(id_oferta, rollup)
+
+def resumen_rollups(id_oferta):
+    """Totales por fase y por campaña de una oferta, leídos del rollup sin recorrer registros."""
+    asegurar_rollups([id_oferta])
+    almacen = almacen_actual()
+    with almacen.lock:
+        rollup = almacen.rollups.get(id_oferta, RollupOferta())
+        escala = [s for s in rollup.por_segmento if s != 'testeos']
+        return {
+            'testeo': rollup.totales(['testeos']),
+            'escala': rollup.totales(escala),
+            'dias_testeo': rollup.dias_transcurridos(['testeos']),
+            'dias_escala': rollup.dias_transcurridos(escala),
+            'campanas': {s: rollup.totales([s]) for s in escala},
+        }
+
+def df_diario_rollups(ids_ofertas):
+    """Métricas diarias por oferta (todas las fases) para el dashboard global."""
+    asegurar_rollups(ids_ofertas)
+    almacen = almacen_actual()
+    with almacen.lock:
+        partes = [almacen.rollups[i].df_diario().assign(id_oferta=i) for i in ids_ofertas if i in almacen.rollups]
+    partes = [p for p in partes if not p.empty]
+    return ordenar_por_fecha(concatenar_registros(partes)) if partes else pd.DataFrame()
+
+def componentes_rollups(id_oferta):
+    """Anuncios y componentes de escala con algún día en el rollup de la oferta."""
+    asegurar_rollups([id_oferta])
+    almacen = almacen_actual()
+    with almacen.lock:
+        rollup = almacen.rollups.get(id_oferta)
+        return sorted({componente for componentes in rollup.dias.values() for componente in componentes}) if rollup else []
+
+def registros_en_rango(id_oferta, desde=None, hasta=None, anuncio=None):
+    """Registros diarios de una oferta en [desde, hasta] consultados al backend, sin hidratarla."""
+    # Lo que haya pendiente en la cola debe estar en el backend antes de consultarlo.
+    obtener_cola_escritura(st.secrets["team_config"]["workspace_id"]).vaciar()
+    return backend_actual().consultar_registros(id_oferta, desde, hasta, anuncio)
+
+def version_rollups(ids_ofertas):
+    """Clave que cambia cuando cambia cualquiera de los rollups de las ofertas indicadas."""
+    almacen = almacen_actual()
+    with almacen.lock:
+        return tuple((i, id(almacen.rollups.get(i)), getattr(almacen.rollups.get(i), 'version', None)) for i in ids_ofertas)
+
+# --- CUBOS DE SUMAS ACUMULADAS POR RANGO DE FECHAS ---
+# Para cada clave (anuncio, componente, oferta...) se guardan las sumas acumuladas día a día de sus
+# métricas. Los totales de cualquier rango salen de dos búsquedas y una resta, sin recorrer filas.
+# Los cubos se construyen una vez por versión de datos y se comparten en el almacén del proceso.
+COLUMNA_FILAS_CUBO = '_filas'
+
+class CuboAcumulado:
+    """Sumas acumuladas por día (claves × días+1 × métricas) de un DataFrame con columna Fecha."""
+
+    def __init__(self, claves, dias, acumulado, metricas, enteras=()):
+        self.claves = claves
+        self.dias = dias
+        self.acumulado = acumulado
+        self.metricas = metricas
+        self.enteras = list(enteras)
+
+    @classmethod
+    def desde_df(cls, df, metricas, clave=None):
+        """Construye el cubo agrupando por `clave` (o una sola clave 'Total' si es None)."""
+        metricas = [m for m in metricas if m in df.columns]
+        if clave is None:
+            codigos, claves = np.zeros(len(df), dtype=int), pd.Index(['Total'])
+        else:
+            codigos, claves = pd.factorize(df[clave], sort=True)
+        validas = codigos >= 0
+        dias, posicion_dia = np.unique(df['Fecha'].to_numpy(dtype='datetime64[D]')[validas], return_inverse=True)
+        celda = codigos[validas] * (len(dias) + 1) + posicion_dia + 1
+        tamano = len(claves) * (len(dias) + 1)
+        columnas = [np.bincount(celda, weights=columna_numerica(df, m)[validas], minlength=tamano) for m in metricas]
+        columnas.append(np.bincount(celda, minlength=tamano).astype(float))
+        acumulado = np.stack(columnas, axis=-1).reshape(len(claves), len(dias) + 1, len(metricas) + 1)
+        np.cumsum(acumulado, axis=1, out=acumulado)
+        enteras = [m for m in metricas if pd.api.types.is_integer_dtype(df[m])]
+        return cls(claves, dias, acumulado, metricas + [COLUMNA_FILAS_CUBO], enteras)
+
+    def rango(self, desde=None, hasta=None):
+        """Totales por clave entre `desde` y `hasta` (días incluidos); sólo claves con filas en el rango."""
+        inicio = 0 if desde is None else np.searchsorted(self.dias, np.datetime64(pd.Timestamp(desde).date(), 'D'), side='left')
+        fin = len(self.dias) if hasta is None else np.searchsorted(self.dias, np.datetime64(pd.Timestamp(hasta).date(), 'D'), side='right')
+        totales = pd.DataFrame(self.acumulado[:, fin, :] - self.acumulado[:, inicio, :], index=self.claves, columns=self.metricas)
+        totales = totales[totales[COLUMNA_FILAS_CUBO] > 0].drop(columns=COLUMNA_FILAS_CUBO)
+        # Las columnas enteras (ventas, pagos) se devuelven enteras, como las daría un groupby.
+        return totales.astype({m: 'int64' for m in self.enteras}) if self.enteras else totales
+
+    def total(self, desde=None, hasta=None):
+        return self.rango(desde, hasta).sum()
+
+def memorizar_por_version(clave, version, construir):
+    """Devuelve `construir()` memorizado en el almacén mientras `version` no cambie (None desactiva la memoria)."""
+    almacen = almacen_actual()
+    with almacen.lock:
+        memorizado = almacen.cubos.get(clave)
+    if version is not None and memorizado is not None and memorizado[0] == version:
+        return memorizado[1]
+    valor = construir()
+    if version is not None:
+        with almacen.lock:
+            almacen.cubos[clave] = (version, valor)
+    return valor
+
+def version_oferta(id_oferta):
+    return st.session_state.get('_versiones_almacen', {}).get(id_oferta)
+
+# --- AGREGADOS POR PERIODO (DÍA / SEMANA / MES) ---
+# Una sola agrupación por día; semanas y meses se suman después sobre esa tabla diaria (ordenada),
+# donde cada periodo ocupa un tramo contiguo [inicio, fin) que sirve también como su desglose diario.
+# Las etiquetas en español salen de tablas fijas, sin depender del locale del servidor.
+DIAS_SEMANA = ('Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo')
+MESES = ('Enero', 'Febrero', 'Marzo', 'Abril', 'Mayo', 'Junio', 'Julio', 'Agosto', 'Septiembre', 'Octubre', 'Noviembre', 'Diciembre')
+
+def nombres_dia_semana(fechas):
+    return np.array(DIAS_SEMANA)[pd.DatetimeIndex(fechas).dayofweek]
+
+def agregar_por_periodos(df, columnas):
+    """Sumas de `columnas` por día, semana (de lunes a domingo) y mes en una pasada sobre las filas.
+
+    Devuelve {'Día': diario, 'Semana': semanal, 'Mes': mensual}. Las tablas de semana y mes llevan
+    'Periodo' (etiqueta) e 'inicio'/'fin', las posiciones de sus días en la tabla diaria.
+    """
+    columnas = [c for c in columnas if c in df.columns]
+    diario = df.groupby(df['Fecha'].dt.normalize(), sort=True)[columnas].sum()
+    fechas = diario.index
+    diario = diario.reset_index()
+    diario.insert(1, 'Día de la Semana', nombres_dia_semana(fechas))
+    valores = diario[columnas].to_numpy(dtype=float)
+    niveles = {'Día': diario}
+    inicios_periodo = {
+        'Semana': (fechas - pd.to_timedelta(fechas.dayofweek, unit='D')).to_numpy(),
+        'Mes': fechas.to_period('M').to_timestamp().to_numpy(),
+    }
+    for nivel, claves in inicios_periodo.items():
+        inicios, posiciones = np.unique(claves, return_index=True)
+        if len(posiciones):
+            sumas = np.add.reduceat(valores, posiciones, axis=0)
+        else:
+            sumas = np.zeros((0, len(columnas)))
+        tabla = pd.DataFrame(sumas, columns=columnas)
+        inicios = pd.DatetimeIndex(inicios)
+        if nivel == 'Semana':
+            etiquetas = inicios.strftime('%Y-%m-%d')
+        else:
+            etiquetas = [f"{MESES[mes - 1]} {anio}" for mes, anio in zip(inicios.month, inicios.year)]
+        tabla.insert(0, 'Periodo', etiquetas)
+        tabla['inicio'] = posiciones
+        tabla['fin'] = np.append(posiciones[1:], len(diario))[:len(posiciones)].astype(int)
+        niveles[nivel] = tabla
+    return niveles
 
 # --- LÓGICA DE AUTENTICACIÓN Y PANTALLA DE LOGIN (VERSIÓN SOCIOS) ---
 def show_login_page():
@@ -163,7 +2032,23 @@ def show_login_page():
     if 'auth_form' not in st.session_state:
         st.session_state.auth_form = 'Login'
     
-    if st.session_state.auth_form == 'Login':
+    if AUTENTICACION_LOCAL:
+        with st.form("login_local_form"):
+            st.write("#### Iniciar Sesión (modo local)")
+            st.warning("Modo de desarrollo: se entra sin contraseña. No lo actives en un despliegue compartido.")
+
+            email = st.text_input("Email")
+            if st.form_submit_button("Entrar"):
+                if email not in authorized_emails:
+                    st.error("Acceso denegado. Tu correo no está en la lista de usuarios autorizados.")
+                else:
+                    st.session_state.logged_in = True
+                    st.session_state.user_id = f"local:{email}"
+                    st.session_state.user_email = email
+                    st.session_state.show_welcome_animation = True
+                    load_data_from_firestore()
+                    st.rerun()
+    elif st.session_state.auth_form == 'Login':
         with st.form("login_form"):
             st.write("#### Iniciar Sesión")
             email = st.text_input("Email")
@@ -228,6 +2113,7 @@ if 'editing_checklist_oferta_id' not in st.session_state: st.session_state['edit
 # --- Funciones para la Bóveda ---
 def eliminar_entrada_boveda(id_entrada):
     st.session_state.boveda = [entrada for entrada in st.session_state.boveda if entrada['id'] != id_entrada]
+    registrar_cambio('boveda', id_entrada)
     save_data_to_firestore()
     st.balloons()
     st.success("Oferta eliminada de la Bóveda.")
@@ -235,11 +2121,53 @@ def eliminar_entrada_boveda(id_entrada):
 def render_rating_stars(rating):
     return "⭐" * rating + "☆" * (5 - rating)
 
+TAMANOS_PAGINA_BOVEDA = [12, 24, 48, 96]
+TIPOS_OFERTA_BOVEDA = { "VSL": {"color": "#007bff", "emoji": "🟦"}, "QUIZ": {"color": "#6f42c1", "emoji": "🟪"}, "TSL": {"color": "#28a745", "emoji": "🟩"} }
+CLASES_ESTATUS_BOVEDA = {'⚙️ Modelando': 'glow-modelando', '🧪 En Pruebas': 'glow-pruebas', '🗄️ Archivada': 'fade-archivada'}
+
+def html_tarjeta_boveda(entrada):
+    """HTML de la tarjeta de una entrada de la Bóveda, memorizado por id y versión de la entrada."""
+    def construir():
+        tipo_info = TIPOS_OFERTA_BOVEDA.get(entrada['tipo_oferta'], {"color": "#6c757d", "emoji": "❔"})
+        extra_class = CLASES_ESTATUS_BOVEDA.get(entrada.get('estatus', ESTATUS_BOVEDA_POR_DEFECTO), '')
+        return f"""
+        <div class="card-boveda {extra_class}" style="border-left: 5px solid {tipo_info['color']};">
+            <h4 style="color: black;">{entrada['nombre']} <span style="font-size: 1.2em;">{render_rating_stars(entrada['calificacion'])}</span></h4>
+            <p class="fecha-registro">Registrado el: {entrada['fecha_registro']}</p>
+            <hr>
+            <div class="card-body">
+                <div class="card-col">
+                    <p><strong>{tipo_info['emoji']} Tipo:</strong> {entrada['tipo_oferta']}</p>
+                    <p><strong>🎯 Nicho:</strong> {entrada.get('nicho', 'N/A')}</p>
+                    <p><strong>🌎 Idioma:</strong> {entrada.get('idioma', 'N/A')}</p>
+                </div>
+                <div class="card-col">
+                    <p><strong>📊 Ads Activos:</strong> {entrada.get('num_anuncios', 'N/A')}</p>
+                    <p><strong>💡 ¿Testear?:</strong> {entrada.get('testear', 'N/A')}</p>
+                </div>
+            </div>
+            <div class="card-footer">
+                <strong>🔗 Links:</strong>
+                {'<a href="' + entrada["link_anuncios"] + '" target="_blank">Ver Anuncios</a>' if entrada.get("link_anuncios") else ''}
+                {' | <a href="' + entrada["link_oferta"] + '" target="_blank">Ver Oferta</a>' if entrada.get("link_oferta") else ''}
+                <details>
+                    <summary>Ver Comentarios</summary>
+                    <p class="comentarios">
+                        {entrada.get('comentarios') if entrada.get('comentarios') else 'Sin comentarios.'}
+                    </p>
+                </details>
+            </div>
+        </div>
+        """
+    version = st.session_state.get('_versiones_boveda', {}).get(entrada['id'], 0)
+    return memorizar_por_version(('tarjeta_boveda', entrada['id']), version, construir)
+
 def update_entrada_boveda(id_entrada, nuevos_datos):
     for i, entrada in enumerate(st.session_state.boveda):
         if entrada['id'] == id_entrada:
             st.session_state.boveda[i] = nuevos_datos
             break
+    registrar_cambio('boveda', id_entrada)
     save_data_to_firestore()
     st.balloons()
     st.success("¡Oferta actualizada en la Bóveda!")
@@ -250,9 +2178,32 @@ def update_boveda_status(entrada_id, key):
         if entrada['id'] == entrada_id:
             st.session_state.boveda[i]['estatus'] = nuevo_estatus
             break
+    registrar_cambio('boveda', entrada_id, 'estatus')
     save_data_to_firestore()
 
 # --- Funciones para Plantillas y Checklists ---
+# Las tareas de un checklist se guardan como mapa {id_tarea: item con 'orden'}: marcar una tarea
+# envía sólo ('checklist', 'tareas', id_tarea, 'completed'), porque Firestore no puede actualizar un
+# elemento suelto de un array. Los checklists guardados antes como lista usan su posición como id.
+def mapa_tareas(tareas):
+    if isinstance(tareas, dict):
+        return tareas
+    return {str(orden): dict(item, orden=orden) for orden, item in enumerate(tareas)}
+
+def items_checklist(tareas):
+    """(id_tarea, item) de fases y tareas en su orden."""
+    return sorted(mapa_tareas(tareas).items(), key=lambda par: par[1].get('orden', 0))
+
+def update_tarea_checklist(id_oferta, id_tarea, key):
+    checklist = st.session_state.ofertas[id_oferta]['checklist']
+    if not isinstance(checklist['tareas'], dict):
+        # Primera marca sobre un checklist en lista: se reescribe una vez ya como mapa.
+        checklist['tareas'] = mapa_tareas(checklist['tareas'])
+        registrar_cambio('ofertas', id_oferta, 'checklist', 'tareas')
+    checklist['tareas'][id_tarea]['completed'] = st.session_state[key]
+    registrar_cambio('ofertas', id_oferta, 'checklist', 'tareas', id_tarea, 'completed')
+    save_data_to_firestore()
+
 def parse_checklist(raw_text):
     parsed = []
     lines = raw_text.strip().split('\n')
@@ -271,11 +2222,11 @@ def parse_checklist(raw_text):
                 "type": "phase",
                 "text": stripped_line
             })
-    return parsed
+    return {uuid.uuid4().hex[:8]: dict(item, orden=orden) for orden, item in enumerate(parsed)}
 
 def unparse_checklist(tareas):
     raw_text = []
-    for item in tareas:
+    for _, item in items_checklist(tareas):
         if item['type'] == 'phase':
             raw_text.append(item['text'])
         elif item['type'] == 'task':
@@ -283,18 +2234,27 @@ def unparse_checklist(tareas):
     return "\n".join(raw_text)
 
 def merge_checklists(old_tareas, new_raw_text):
-    new_tareas = parse_checklist(new_raw_text)
-    old_task_status = {task['text']: task['completed'] for task in old_tareas if task['type'] == 'task'}
-    
-    for i, new_item in enumerate(new_tareas):
-        if new_item['type'] == 'task':
-            if new_item['text'] in old_task_status:
-                new_tareas[i]['completed'] = old_task_status[new_item['text']]
-    return new_tareas
+    old_items = [(id_tarea, task) for id_tarea, task in items_checklist(old_tareas) if task['type'] == 'task']
+    old_task_status = {task['text']: task['completed'] for _, task in old_items}
+    # Las tareas que siguen conservan su id, así sus marcas siguen apuntando a ellas.
+    old_task_ids = {}
+    for id_tarea, task in old_items:
+        old_task_ids.setdefault(task['text'], []).append(id_tarea)
+
+    merged = {}
+    for id_tarea, new_item in items_checklist(parse_checklist(new_raw_text)):
+        if new_item['type'] == 'task' and new_item['text'] in old_task_status:
+            new_item['completed'] = old_task_status[new_item['text']]
+            if old_task_ids[new_item['text']]:
+                id_tarea = old_task_ids[new_item['text']].pop(0)
+        merged[id_tarea] = new_item
+    return merged
 
 def update_plantilla(id_plantilla, nombre, checklist_raw):
     st.session_state.plantillas[id_plantilla]['nombre'] = nombre
     st.session_state.plantillas[id_plantilla]['checklist_raw'] = checklist_raw
+    registrar_cambio('plantillas', id_plantilla, 'nombre')
+    registrar_cambio('plantillas', id_plantilla, 'checklist_raw')
     save_data_to_firestore()
     st.success("¡Plantilla actualizada con éxito!")
 
@@ -302,54 +2262,482 @@ def update_plantilla(id_plantilla, nombre, checklist_raw):
 def get_safe_column_name(alias):
     return f"Ventas: {alias}"
 
-def calcular_metricas_diarias(registro, funnel, comision_pp=0.0):
-    facturacion_bruta = 0
-    ventas_pp = 0
-    col_pp = get_safe_column_name("PP")
-    
-    for item_details in funnel.values():
-        col_name = get_safe_column_name(item_details['alias'])
-        if col_name in registro and pd.notna(registro[col_name]) and registro[col_name] > 0:
-            facturacion_bruta += registro[col_name] * item_details['precio']
-            if col_name == col_pp:
-                ventas_pp += registro[col_name]
-
-    total_comisiones = ventas_pp * comision_pp
-    facturacion_neta = facturacion_bruta - total_comisiones
-
-    registro['Facturación Total'] = facturacion_bruta
-    registro['Ganancia Bruta'] = facturacion_bruta - registro['Inversión']
-    registro['Ganancia Neta'] = facturacion_neta - registro['Inversión']
-    registro['ROAS Bruto'] = facturacion_bruta / registro['Inversión'] if registro['Inversión'] > 0 else 0
-    registro['ROAS Neto'] = facturacion_neta / registro['Inversión'] if registro['Inversión'] > 0 else 0
+COLUMNAS_METRICAS_DIARIAS = ['Facturación Total', 'Ganancia Bruta', 'Ganancia Neta', 'ROAS Bruto', 'ROAS Neto']
+
+def ordenar_por_fecha(df):
+    """El DataFrame ordenado por Fecha (orden estable); si ya lo está, se devuelve tal cual, sin copiar."""
+    if df.empty or df['Fecha'].is_monotonic_increasing:
+        return df
+    return df.sort_values('Fecha', kind='stable')
+
+def filtrar_por_fechas(df, desde=None, hasta=None):
+    """Filas con Fecha entre `desde` y `hasta` (días completos, ambos incluidos).
+
+    Busca los extremos con búsqueda binaria sobre la columna ordenada y corta con iloc, sin convertir
+    cada fila a `date`. El resultado queda ordenado por fecha.
+    """
+    df = ordenar_por_fecha(df)
+    fechas = df['Fecha'].to_numpy(dtype='datetime64[ns]')
+    inicio = 0 if desde is None else np.searchsorted(fechas, pd.Timestamp(desde).to_datetime64(), side='left')
+    fin = len(df) if hasta is None else np.searchsorted(fechas, (pd.Timestamp(hasta) + pd.Timedelta(days=1)).to_datetime64(), side='left')
+    return df.iloc[inicio:fin]
+
+def dividir(numerador, denominador):
+    """División elemento a elemento que devuelve 0 donde el denominador no es positivo."""
+    numerador, denominador = np.broadcast_arrays(np.asarray(numerador, dtype=float), np.asarray(denominador, dtype=float))
+    return np.divide(numerador, denominador, out=np.zeros(numerador.shape), where=denominador > 0)
+
+def columna_numerica(df, columna):
+    if columna not in df.columns:
+        return np.zeros(len(df))
+    return pd.to_numeric(df[columna], errors='coerce').fillna(0).to_numpy(dtype=float)
+
+def matriz_precios_funnel(funnel, columnas, filas):
+    """Columnas de ventas del funnel presentes en `columnas` y su matriz de precios (filas x columnas).
+
+    El precio de cada elemento puede ser un escalar o un vector con el precio vigente en cada fila.
+    """
+    items = [(get_safe_column_name(v['alias']), v['precio']) for v in funnel.values()]
+    items = [(col, precio) for col, precio in items if col in columnas]
+    if not items:
+        return [], np.zeros((filas, 0))
+    precios = np.column_stack([np.broadcast_to(np.asarray(precio, dtype=float), (filas,)) for _, precio in items])
+    return [col for col, _ in items], precios
+
+def calcular_metricas_df(df, funnel, comision_pp=0.0, diarias=True):
+    """Calcula con NumPy, para todas las filas a la vez, las métricas derivadas de un DataFrame de registros.
+
+    Con `diarias=True` recalcula las columnas de cada registro (COLUMNAS_METRICAS_DIARIAS) a partir
+    de las ventas y la matriz de precios del funnel. Con `diarias=False` las respeta (p. ej. en sumas
+    ya agregadas) y sólo añade las de los paneles: Comisiones, CPA, Facturación FE, ROAS FE y
+    ROAS Total (Neto); si ya vienen Ganancia Neta o Facturación FE, las comisiones y la facturación
+    FE se toman de ahí, así que respetan las tarifas con las que se valoró cada día.
+    `comision_pp` y los precios del funnel pueden ser escalares o un valor por fila.
+    """
+    df = df.copy()
+    inversion = columna_numerica(df, 'Inversión')
+    ventas_pp = columna_numerica(df, get_safe_column_name("PP"))
+    comision = np.asarray(comision_pp, dtype=float)
+    if diarias:
+        columnas_ventas, precios = matriz_precios_funnel(funnel, df.columns, len(df))
+        ventas = np.column_stack([columna_numerica(df, col) for col in columnas_ventas]) if columnas_ventas else np.zeros((len(df), 0))
+        ventas = np.where(ventas > 0, ventas, 0.0)
+        ventas_pp = np.where(ventas_pp > 0, ventas_pp, 0.0)
+        facturacion = (ventas * precios).sum(axis=1)
+        facturacion_neta = facturacion - ventas_pp * comision
+        df['Facturación Total'] = facturacion
+        df['Ganancia Bruta'] = facturacion - inversion
+        df['Ganancia Neta'] = facturacion_neta - inversion
+        df['ROAS Bruto'] = dividir(facturacion, inversion)
+        df['ROAS Neto'] = dividir(facturacion_neta, inversion)
+    facturacion = columna_numerica(df, 'Facturación Total')
+    if 'Ganancia Neta' in df.columns:
+        df['Comisiones'] = facturacion - inversion - columna_numerica(df, 'Ganancia Neta')
+    else:
+        df['Comisiones'] = ventas_pp * comision
+    if 'Facturación FE' not in df.columns:
+        df['Facturación FE'] = ventas_pp * np.asarray(funnel.get('principal', {}).get('precio', 0.0), dtype=float)
+    df['CPA'] = dividir(inversion, ventas_pp)
+    df['ROAS FE'] = dividir(columna_numerica(df, 'Facturación FE'), inversion)
+    df['ROAS Total (Neto)'] = dividir(facturacion - df['Comisiones'].to_numpy(), inversion)
+    return df
+
+def calcular_metricas_oferta(df, oferta, diarias=True):
+    """`calcular_metricas_df` valorando cada registro con las tarifas vigentes en su fecha."""
+    if df.empty or 'Fecha' not in df.columns:
+        return calcular_metricas_df(df, oferta['funnel'], oferta.get('comision_pp', 0.0), diarias)
+    funnel, comision_pp = tarifas_vigentes(oferta, df['Fecha'])
+    return calcular_metricas_df(df, funnel, comision_pp, diarias)
+
+def facturacion_fe(df, oferta):
+    """Facturación del producto principal de cada registro con el precio vigente en su fecha."""
+    funnel, _ = tarifas_vigentes(oferta, df['Fecha'])
+    return columna_numerica(df, get_safe_column_name("PP")) * funnel['principal']['precio']
+
+def calcular_metricas_diarias(registro, oferta):
+    """Versión de un solo registro (dict) de `calcular_metricas_oferta`, para los formularios."""
+    fila = calcular_metricas_oferta(pd.DataFrame([registro]), oferta).iloc[0]
+    for col in COLUMNAS_METRICAS_DIARIAS:
+        registro[col] = fila[col].item()
     return registro
 
-def analizar_sugerencias_anuncios(df_testeos_global):
+# --- VENTAS DEL FUNNEL EN FORMATO LARGO ---
+# Un segmento sólo tiene columna "Ventas: <alias>" para los elementos del funnel que ya registraron
+# alguna venta: añadir un elemento al funnel no reescribe ningún DataFrame, y donde falta la columna
+# (o la celda está vacía) las ventas cuentan como 0. Los análisis del funnel trabajan sobre la tabla
+# larga (id_registro, item_id, unidades), que sólo guarda ventas > 0, y la vista ancha con todos los
+# elementos se pivota bajo demanda.
+# Lo guardado también va en formato largo: la instantánea de un segmento lleva los registros sin
+# columnas de ventas más la tabla (id_registro, paso, unidades), y cada documento del log su
+# {paso: unidades}. El paso es el alias del elemento, así que leer no depende del funnel; la vista
+# ancha sólo existe en memoria. Las instantáneas antiguas, con las ventas en columnas, se leen igual.
+def es_columna_ventas(columna):
+    return str(columna).startswith(get_safe_column_name(''))
+
+def ventas_de_fila(fila):
+    """Reparte un registro en (campos que no son ventas, {paso: unidades} con las ventas > 0)."""
+    prefijo = get_safe_column_name('')
+    base, ventas = {}, {}
+    for col, valor in fila.items():
+        if not es_columna_ventas(col):
+            base[col] = valor
+        elif valor is not None and not pd.isna(valor) and valor > 0:
+            ventas[col[len(prefijo):]] = valor
+    return base, ventas
+
+def fila_con_ventas(fila, ventas):
+    """Registro en formato ancho a partir de sus campos y su {paso: unidades}."""
+    return dict(fila, **{get_safe_column_name(paso): unidades for paso, unidades in (ventas or {}).items()})
+
+def rellenar_ventas(df):
+    """Las celdas de ventas sin valor (pasos sin venta en ese registro) pasan a 0."""
+    columnas = [c for c in df.columns if es_columna_ventas(c) and df[c].isna().any()]
+    return aplicar_esquema(df.assign(**{c: df[c].fillna(0) for c in columnas})) if columnas else df
+
+def separar_ventas(df):
+    """Reparte un segmento en (registros sin columnas de ventas, tabla larga id_registro/paso/unidades).
+
+    La tabla larga sólo guarda ventas > 0; las categorías de `paso` recuerdan todas las columnas de
+    ventas del segmento. Sin ids (segmentos antiguos) no hay con qué enlazarla y se devuelve None.
+    """
+    columnas = [c for c in df.columns if es_columna_ventas(c)]
+    if COLUMNA_ID_REGISTRO not in df.columns:
+        return df, None
+    prefijo = get_safe_column_name('')
+    unidades = np.column_stack([columna_numerica(df, col) for col in columnas]) if columnas else np.zeros((len(df), 0))
+    filas, posiciones = np.nonzero(unidades > 0)
+    largo = pd.DataFrame({
+        COLUMNA_ID_REGISTRO: df[COLUMNA_ID_REGISTRO].to_numpy()[filas],
+        'paso': pd.Categorical.from_codes(posiciones, categories=[c[len(prefijo):] for c in columnas]),
+        'unidades': unidades[filas, posiciones],
+    })
+    return df.drop(columns=columnas), largo
+
+def unir_ventas(df, largo, pasos):
+    """Vista ancha de un segmento guardado: una columna "Ventas: <paso>" por paso, a 0 en los registros sin ventas."""
+    if largo is None or COLUMNA_ID_REGISTRO not in df.columns:
+        return df
+    pasos = [p for p in pasos if get_safe_column_name(p) not in df.columns]
+    sumas = largo.assign(paso=largo['paso'].astype(str)).groupby([COLUMNA_ID_REGISTRO, 'paso'])['unidades'].sum().unstack() if not largo.empty else pd.DataFrame()
+    vista = sumas.reindex(index=pd.Index(df[COLUMNA_ID_REGISTRO]), columns=pasos, fill_value=0).fillna(0)
+    ventas = pd.DataFrame({get_safe_column_name(p): vista[p].to_numpy() for p in pasos}, index=df.index)
+    # Las ventas vuelven a su sitio habitual, justo antes de la facturación.
+    posicion = df.columns.get_loc('Facturación Total') if 'Facturación Total' in df.columns else len(df.columns)
+    return aplicar_esquema(pd.concat([df.iloc[:, :posicion], ventas, df.iloc[:, posicion:]], axis=1))
+
+def datos_instantanea(df):
+    """Campos de la instantánea de un segmento: registros sin ventas, ventas en formato largo y sus pasos."""
+    base, largo = separar_ventas(df)
+    datos = {'registros': codificar_df(base)}
+    if largo is not None:
+        # Los pasos van aparte: un segmento sin ventas no conservaría las categorías en el binario.
+        datos['ventas'] = codificar_df(largo)
+        datos['pasos'] = list(largo['paso'].cat.categories)
+    return datos
+
+def leer_instantanea(doc):
+    """DataFrame en formato ancho de una instantánea (o de un campo de registros del esquema anterior)."""
+    largo = decodificar_df(doc['ventas']) if doc.get('ventas') is not None else None
+    return unir_ventas(decodificar_df(doc.get('registros')), largo, doc.get('pasos', []))
+
+def columnas_ventas_funnel(funnel):
+    """Columna de ventas de cada elemento del funnel: {"Ventas: <alias>": item_id}."""
+    return {get_safe_column_name(v['alias']): item_id for item_id, v in funnel.items()}
+
+def ventas_formato_largo(df, funnel):
+    """Tabla larga (id_registro, Fecha, item_id, unidades) con las ventas > 0 de cada registro, en el orden de `df`."""
+    columnas = {col: item for col, item in columnas_ventas_funnel(funnel).items() if col in df.columns}
+    unidades = np.column_stack([columna_numerica(df, col) for col in columnas]) if columnas else np.zeros((len(df), 0))
+    filas, posiciones = np.nonzero(unidades > 0)
+    ids = df[COLUMNA_ID_REGISTRO].to_numpy() if COLUMNA_ID_REGISTRO in df.columns else df.index.to_numpy()
+    largo = pd.DataFrame({
+        COLUMNA_ID_REGISTRO: ids[filas],
+        'item_id': np.asarray(list(columnas.values()), dtype=object)[posiciones],
+        'unidades': unidades[filas, posiciones].round().astype('int64'),
+    })
+    if 'Fecha' in df.columns:
+        largo.insert(1, 'Fecha', df['Fecha'].to_numpy()[filas])
+    return largo
+
+def pivotar_ventas(largo, funnel, ids):
+    """Vista ancha de la tabla larga: una fila por id de `ids` y una columna de ventas por elemento del funnel."""
+    vista = largo.pivot_table(index=COLUMNA_ID_REGISTRO, columns='item_id', values='unidades', aggfunc='sum') if not largo.empty else pd.DataFrame()
+    vista = vista.reindex(index=pd.Index(ids), columns=list(funnel)).fillna(0).astype('int64')
+    return vista.rename(columns={item_id: get_safe_column_name(v['alias']) for item_id, v in funnel.items()}).rename_axis(index=COLUMNA_ID_REGISTRO, columns=None)
+
+def completar_ventas_funnel(df, funnel):
+    """`df` con todas las columnas de ventas del funnel, a 0 en los registros sin ventas de ese elemento."""
+    ventas = pivotar_ventas(ventas_formato_largo(df, funnel), funnel, df[COLUMNA_ID_REGISTRO])
+    return df.assign(**{col: ventas[col].to_numpy() for col in ventas.columns})
+
+def tasas_adopcion_funnel(largo, funnel):
+    """Unidades vendidas de cada elemento del funnel y su adopción (% sobre las ventas del producto principal)."""
+    unidades = largo.groupby('item_id')['unidades'].sum().reindex(list(funnel), fill_value=0)
+    adopcion = dividir(unidades.to_numpy(), unidades.get('principal', 0)) * 100
+    return pd.DataFrame({'unidades': unidades.to_numpy(), 'adopcion': adopcion}, index=unidades.index)
+
+# --- HISTORIAL DE TARIFAS CON FECHA DE VIGENCIA ---
+# historial_tarifas guarda, ordenadas por 'desde' (YYYY-MM-DD), las tarifas completas de la oferta
+# (comisión PP, CPA objetivo y el precio de cada elemento del funnel) vigentes a partir de esa
+# fecha. Cada registro se valora con la última entrada cuyo 'desde' no supere su fecha; los
+# anteriores a la primera entrada usan la primera. Sin historial, rigen los valores actuales.
+FECHA_INICIO_TARIFAS = '2000-01-01'
+
+def tarifa_actual(oferta):
+    return {
+        'comision_pp': float(oferta.get('comision_pp', 0.0)), 'cpa_objetivo': float(oferta.get('cpa_objetivo', 0.0)),
+        'precios': {item_id: float(v['precio']) for item_id, v in oferta['funnel'].items()},
+    }
+
+def tarifa_en(oferta, fecha):
+    """Las tarifas vigentes en `fecha` (YYYY-MM-DD), completadas con los valores actuales que falten."""
+    historial = oferta.get('historial_tarifas') or []
+    entrada = next((e for e in reversed(historial) if e['desde'] <= fecha), historial[0] if historial else None)
+    tarifa = tarifa_actual(oferta)
+    if entrada is not None:
+        tarifa['comision_pp'] = entrada.get('comision_pp', tarifa['comision_pp'])
+        tarifa['cpa_objetivo'] = entrada.get('cpa_objetivo', tarifa['cpa_objetivo'])
+        tarifa['precios'].update({k: p for k, p in entrada.get('precios', {}).items() if k in tarifa['precios']})
+    return tarifa
+
+def tabla_tarifas(oferta):
+    """El historial como DataFrame ordenado por 'desde', con la comisión y una columna por elemento del funnel."""
+    actual = tarifa_actual(oferta)
+    historial = oferta.get('historial_tarifas') or [{'desde': FECHA_INICIO_TARIFAS}]
+    tabla = pd.DataFrame([{'desde': e['desde'], 'comision_pp': e.get('comision_pp'), **e.get('precios', {})} for e in historial])
+    tabla = tabla.reindex(columns=['desde', 'comision_pp', *actual['precios']])
+    tabla['desde'] = pd.to_datetime(tabla['desde'])
+    # En float desde el principio: las entradas sin un valor traen None y la columna quedaría en object.
+    tabla[tabla.columns[1:]] = tabla[tabla.columns[1:]].astype(float)
+
+    tabla = tabla.sort_values('desde', kind='stable').reset_index(drop=True)
+    # Un elemento sin precio en una entrada hereda el anterior (o el primero conocido, o el actual).
+    valores_actuales = pd.Series({'comision_pp': actual['comision_pp'], **actual['precios']})
+    tabla[valores_actuales.index] = tabla[valores_actuales.index].ffill().bfill().fillna(valores_actuales)
+    return tabla
+
+def tarifas_vigentes(oferta, fechas):
+    """Unión as-of vectorizada de `fechas` con el historial: (funnel con un precio por fila, comisión por fila)."""
+    tabla = tabla_tarifas(oferta)
+    fechas = pd.to_datetime(pd.Series(fechas)).to_numpy(dtype='datetime64[ns]')
+    posiciones = np.searchsorted(tabla['desde'].to_numpy(dtype='datetime64[ns]'), fechas, side='right') - 1
+    posiciones = np.clip(posiciones, 0, None)
+    funnel = {item_id: dict(v, precio=tabla[item_id].to_numpy(dtype=float)[posiciones]) for item_id, v in oferta['funnel'].items()}
+    return funnel, tabla['comision_pp'].to_numpy(dtype=float)[posiciones]
+
+def registrar_tarifa(oferta, desde, comision_pp=None, cpa_objetivo=None, precios=None):
+    """Anota en el historial tarifas vigentes desde `desde` y deja en la oferta las vigentes hoy.
+
+    Devuelve True si cambia la comisión o algún precio, es decir, si hay que recalcular registros.
+    """
+    historial = oferta.setdefault('historial_tarifas', [])
+    if not historial:
+        historial.append({'desde': FECHA_INICIO_TARIFAS, **tarifa_actual(oferta)})
+    previa = tarifa_en(oferta, desde)
+    entrada = next((e for e in historial if e['desde'] == desde), None)
+    if entrada is None:
+        entrada = dict(previa, desde=desde, precios=dict(previa['precios']))
+        historial.append(entrada)
+        historial.sort(key=lambda e: e['desde'])
+    if comision_pp is not None:
+        entrada['comision_pp'] = comision_pp
+    if cpa_objetivo is not None:
+        entrada['cpa_objetivo'] = cpa_objetivo
+    entrada.setdefault('precios', {}).update(precios or {})
+    vigente = tarifa_en(oferta, datetime.date.today().strftime('%Y-%m-%d'))
+    oferta['comision_pp'] = vigente['comision_pp']
+    oferta['cpa_objetivo'] = vigente['cpa_objetivo']
+    for item_id, precio in vigente['precios'].items():
+        oferta['funnel'][item_id]['precio'] = precio
+    return previa['comision_pp'] != entrada['comision_pp'] or any(previa['precios'].get(k) != p for k, p in entrada['precios'].items())
+
+# Apagar / GANADOR se deciden por la probabilidad de superar el ROAS de break-even (ver el motor de
+# confianza) junto con el ROAS Neto: se apaga si además queda por debajo de roas_apagar, y el ganador
+# debe alcanzar roas_ganador y la racha mínima de días con ventas. Los dos cortes de ROAS colorean
+# también las tablas de rendimiento.
+UMBRALES_SUGERENCIAS = {'prob_apagar': 0.1, 'roas_apagar': 1.2, 'prob_ganador': 0.9, 'roas_ganador': 1.7, 'racha_ganador': 4}
+
+def umbrales_sugerencias(oferta):
+    return {**UMBRALES_SUGERENCIAS, **oferta.get('umbrales_sugerencias', {})}
+
+def metricas_sugerencias(df_testeos):
+    """ROAS Neto acumulado y racha final de días con ventas PP de cada anuncio, para todos a la vez.
+
+    La racha es el número de registros consecutivos con ventas PP al final del historial (ordenado
+    por fecha) de cada anuncio: su tamaño menos la posición del último registro sin ventas.
+    """
+    columna_pp = get_safe_column_name("PP")
+    df = df_testeos[df_testeos['Anuncio'].notna()]
+    df = df.assign(Fecha=pd.to_datetime(df['Fecha'])).sort_values(['Anuncio', 'Fecha'], kind='stable')
+    grupos = df.groupby('Anuncio', sort=True, observed=True)
+    posicion = grupos.cumcount().to_numpy()
+    sin_venta = columna_numerica(df, columna_pp) <= 0
+    ultima_sin_venta = pd.Series(np.where(sin_venta, posicion, -1), index=df.index).groupby(df['Anuncio'], observed=True).max()
+    inversion = pd.Series(columna_numerica(df, 'Inversión'), index=df.index).groupby(df['Anuncio'], observed=True).sum()
+    sumas = pd.DataFrame({
+        'ganancia_neta': columna_numerica(df, 'Ganancia Neta'),
+        'pagos_iniciados': columna_numerica(df, 'Pagos Iniciados'),
+        'ventas_pp': columna_numerica(df, columna_pp),
+    }, index=df.index).groupby(df['Anuncio'], observed=True).sum()
+    ganancia_neta = sumas['ganancia_neta']
+    return pd.DataFrame({
+        'inversion': inversion,
+        'pagos_iniciados': sumas['pagos_iniciados'],
+        'ventas_pp': sumas['ventas_pp'],
+        # Ganancia Neta ya descuenta la comisión vigente en cada día: facturación neta = ganancia + inversión.
+        'roas_neto': dividir(ganancia_neta + inversion, inversion),
+        'racha': (grupos.size() - 1 - ultima_sin_venta).astype(int),
+    })
+
+def analizar_sugerencias_anuncios(id_oferta, df_testeos_global):
+    """Sugerencia por anuncio (apagar / ganador / testeando), memorizada por versión de datos de la oferta."""
     if df_testeos_global.empty: return {}
-    df_testeos_global['Fecha'] = pd.to_datetime(df_testeos_global['Fecha'])
+    oferta = st.session_state.ofertas[id_oferta]
+    umbrales = umbrales_sugerencias(oferta)
+    version = version_oferta(id_oferta)
+    clave = (version, tuple(sorted(umbrales.items())))
+    almacen = almacen_actual()
+    with almacen.lock:
+        memorizada = almacen.sugerencias.get(id_oferta)
+    if version is not None and memorizada is not None and memorizada[0] == clave:
+        return memorizada[1]
+    metricas = metricas_sugerencias(df_testeos_global)
+    # Misma tarifa por día que el motor de confianza, para que etiqueta y tabla de confianza coincidan.
+    filas = df_testeos_global[df_testeos_global['Anuncio'].notna()]
+    funnel, comision_dia = tarifas_vigentes(oferta, filas['Fecha'])
+    precio_pp, comision_pp, _ = tarifa_media_por_grupo(
+        metricas.index.get_indexer(filas['Anuncio']), columna_numerica(filas, get_safe_column_name("PP")),
+        columna_numerica(filas, 'Inversión'), funnel['principal']['precio'], comision_dia)
+    probabilidad = probabilidad_supera_break_even(
+        metricas['inversion'], metricas['pagos_iniciados'], metricas['ventas_pp'], precio_pp, comision_pp)
+    apagar = (probabilidad < umbrales['prob_apagar']) & (metricas['roas_neto'] < umbrales['roas_apagar']) & (metricas['inversion'] > 0)
+    ganador = (probabilidad >= umbrales['prob_ganador']) & (metricas['roas_neto'] >= umbrales['roas_ganador']) & (metricas['racha'] >= umbrales['racha_ganador'])
     sugerencias = {}
-    for anuncio, grupo in df_testeos_global.groupby('Anuncio'):
-        grupo = grupo.sort_values(by='Fecha')
-        inversion_total = grupo['Inversión'].sum()
-        roas_acumulado = grupo['ROAS Neto'].sum() if 'ROAS Neto' in grupo else 0
-        if inversion_total > 0 and 'Facturación Total' in grupo and st.session_state.oferta_seleccionada in st.session_state.ofertas:
-                roas_acumulado = (grupo['Facturación Total'].sum() - (grupo[get_safe_column_name("PP")].sum() * st.session_state.ofertas[st.session_state.oferta_seleccionada].get('comision_pp', 0))) / inversion_total
-
-        racha_ventas = 0
-        grupo_invertido = grupo.iloc[::-1]
-        columna_ventas_pp = get_safe_column_name("PP")
-        for _, row in grupo_invertido.iterrows():
-            if columna_ventas_pp in row and row[columna_ventas_pp] > 0:
-                racha_ventas += 1
-            else: break
-        if roas_acumulado < 1.2 and inversion_total > 0:
-            sugerencias[anuncio] = f"❄️ Apagar (ROAS Neto: {roas_acumulado:.2f})"
-        elif roas_acumulado >= 1.7 and racha_ventas >= 4:
-            sugerencias[anuncio] = f"🏆 GANADOR (ROAS Neto: {roas_acumulado:.2f}, Racha: {racha_ventas})"
+    for anuncio, roas, racha, prob, es_apagar, es_ganador in zip(metricas.index, metricas['roas_neto'], metricas['racha'], probabilidad, apagar, ganador):
+        if es_apagar:
+            sugerencias[anuncio] = f"❄️ Apagar (P>BE: {prob:.0%}, ROAS Neto: {roas:.2f})"
+        elif es_ganador:
+            sugerencias[anuncio] = f"🏆 GANADOR (P>BE: {prob:.0%}, ROAS Neto: {roas:.2f}, Racha: {racha})"
         else:
-            sugerencias[anuncio] = f"🧪 Testeando (ROAS Neto: {roas_acumulado:.2f}, Racha: {racha_ventas})"
+            sugerencias[anuncio] = f"🧪 Testeando (P>BE: {prob:.0%}, ROAS Neto: {roas:.2f}, Racha: {racha})"
+    if version is not None:
+        with almacen.lock:
+            almacen.sugerencias[id_oferta] = (clave, sugerencias)
     return sugerencias
 
+# --- MOTOR DE CONFIANZA ESTADÍSTICA DE ANUNCIOS ---
+# Por anuncio, los pagos iniciados por dólar invertido siguen un modelo Poisson-Gamma y la conversión
+# pago iniciado → venta PP un Beta-Binomial. Las previas se centran en las tasas agregadas del grupo
+# (la oferta) con una fuerza equivalente a FUERZA_PREVIA_INVERSION dólares y FUERZA_PREVIA_PAGOS
+# pagos, así que un anuncio con poco gasto se acerca a la media en vez de juzgarse por ruido.
+# ROAS FE = (pagos/$) · conversión · precio PP, y se estima P(ROAS FE > ROAS de break-even) por
+# Monte Carlo con una matriz anuncios × MUESTRAS_CONFIANZA, por bloques para acotar la memoria.
+MUESTRAS_CONFIANZA = 512
+FUERZA_PREVIA_INVERSION = 20.0
+FUERZA_PREVIA_PAGOS = 10.0
+BLOQUE_ANUNCIOS_CONFIANZA = 2048
+
+def roas_break_even(precio_pp, comision_pp):
+    """ROAS FE mínimo para no perder dinero con la venta PP (infinito si la comisión se come el precio)."""
+    precio_pp, comision_pp = np.broadcast_arrays(np.asarray(precio_pp, dtype=float), np.asarray(comision_pp, dtype=float))
+    margen = precio_pp - comision_pp
+    return np.divide(precio_pp, margen, out=np.full(margen.shape, np.inf), where=margen > 0)
+
+def tarifa_media_por_grupo(grupos, ventas_pp, inversion, precio_dia, comision_dia):
+    """(precio PP, comisión, ingresos PP) de cada grupo a partir de la tarifa vigente el día de cada fila.
+
+    Cada periodo de tarifa pesa por sus propias ventas PP (o por su inversión si el grupo aún no
+    vende), no con la tarifa de hoy. `grupos` son códigos enteros 0..n-1 alineados con las filas.
+    """
+    grupos = np.asarray(grupos, dtype=int)
+    n = grupos.max() + 1 if grupos.size else 0
+    ventas_pp, inversion = np.asarray(ventas_pp, dtype=float), np.asarray(inversion, dtype=float)
+    sumar = lambda pesos: np.bincount(grupos, weights=pesos, minlength=n)
+    ventas, gasto = sumar(ventas_pp), sumar(inversion)
+    ingresos = sumar(ventas_pp * precio_dia)
+    con_ventas = ventas > 0
+    precio = np.where(con_ventas, dividir(ingresos, ventas), dividir(sumar(inversion * precio_dia), gasto))
+    comision = np.where(con_ventas, dividir(sumar(ventas_pp * comision_dia), ventas), dividir(sumar(inversion * comision_dia), gasto))
+    return precio, comision, ingresos
+
+def tasas_por_grupo(numerador, denominador, grupos):
+    """Cociente de las sumas de cada grupo, devuelto alineado con cada elemento (0 si no hay denominador)."""
+    sumas_num = np.bincount(grupos, weights=numerador)
+    sumas_den = np.bincount(grupos, weights=denominador)
+    return dividir(sumas_num, sumas_den)[grupos]
+
+def probabilidad_supera_break_even(inversion, pagos_iniciados, ventas_pp, precio_pp, comision_pp, grupos=None, muestras=MUESTRAS_CONFIANZA, semilla=0):
+    """P(ROAS FE > ROAS de break-even) de cada anuncio; todos los argumentos son vectores alineados o escalares.
+
+    `grupos` (códigos enteros, p. ej. de oferta) decide qué anuncios comparten previa. La semilla fija
+    hace que el resultado no oscile entre recargas.
+    """
+    inversion, pagos, ventas, precio, comision = np.broadcast_arrays(*(np.asarray(x, dtype=float) for x in (inversion, pagos_iniciados, ventas_pp, precio_pp, comision_pp)))
+    if inversion.size == 0:
+        return np.zeros(0)
+    inversion, ventas = np.maximum(inversion, 0.0), np.maximum(ventas, 0.0)
+    # Sin seguimiento de pagos iniciados, cada venta cuenta al menos como un pago.
+    pagos = np.maximum(pagos, ventas)
+    grupos = np.zeros(inversion.size, dtype=int) if grupos is None else np.asarray(grupos, dtype=int)
+    pagos_por_dolar = tasas_por_grupo(pagos, inversion, grupos)
+    conversion = np.clip(tasas_por_grupo(ventas, pagos, grupos), 0.01, 0.99)
+    forma = pagos + FUERZA_PREVIA_INVERSION * pagos_por_dolar
+    escala = 1.0 / (inversion + FUERZA_PREVIA_INVERSION)
+    alfa = ventas + FUERZA_PREVIA_PAGOS * conversion
+    beta = pagos - ventas + FUERZA_PREVIA_PAGOS * (1 - conversion)
+    umbral = roas_break_even(precio, comision) / np.where(precio > 0, precio, np.nan)
+    generador = np.random.default_rng(semilla)
+    probabilidad = np.zeros(inversion.size)
+    for inicio in range(0, inversion.size, BLOQUE_ANUNCIOS_CONFIANZA):
+        bloque = slice(inicio, inicio + BLOQUE_ANUNCIOS_CONFIANZA)
+        n = len(inversion[bloque])
+        # Gammas estándar en float32: la Beta sale de dos de ellas (X / (X + Y)) y el escalado se aplica al umbral.
+        tasa_pagos = generador.standard_gamma(forma[bloque, None], size=(n, muestras), dtype=np.float32)
+        exitos = generador.standard_gamma(alfa[bloque, None], size=(n, muestras), dtype=np.float32)
+        fracasos = generador.standard_gamma(beta[bloque, None], size=(n, muestras), dtype=np.float32)
+        # ROAS FE / precio > ROAS BE / precio evita multiplicar la matriz por el precio.
+        umbral_bloque = (umbral[bloque] / escala[bloque])[:, None]
+        probabilidad[bloque] = (tasa_pagos * exitos > umbral_bloque * (exitos + fracasos)).mean(axis=1)
+    return probabilidad
+
+def confianza_anuncios(ids_ofertas, desde=None, hasta=None):
+    """Probabilidad de superar el break-even de todos los anuncios de testeo de las ofertas, en una sola pasada."""
+    asegurar_rollups(ids_ofertas)
+    almacen = almacen_actual()
+    with almacen.lock:
+        partes = [almacen.rollups[i].df_componentes('testeos').assign(id_oferta=i) for i in ids_ofertas if i in almacen.rollups]
+    partes = [p for p in partes if not p.empty]
+    if not partes:
+        return pd.DataFrame()
+    df = concatenar_registros(partes)
+    if desde is not None:
+        df = df[df['Fecha'] >= pd.Timestamp(desde)]
+    if hasta is not None:
+        df = df[df['Fecha'] <= pd.Timestamp(hasta)]
+    if df.empty:
+        return df.groupby(['id_oferta', 'componente'], as_index=False, observed=True)[['inversion', 'pagos_iniciados', 'ventas_pp']].sum()
+    # Precio y comisión vigentes el día de cada fila.
+    ofertas = st.session_state.ofertas
+    df = df.reset_index(drop=True)
+    precio_dia = np.zeros(len(df))
+    comision_dia = np.zeros(len(df))
+    for id_oferta, filas in df.groupby('id_oferta', sort=False, observed=True).indices.items():
+        funnel, comision = tarifas_vigentes(ofertas[id_oferta], df['Fecha'].to_numpy()[filas])
+        precio_dia[filas] = funnel['principal']['precio']
+        comision_dia[filas] = comision
+    agrupado = df.groupby(['id_oferta', 'componente'], observed=True)
+    precio_pp, comision_pp, ingresos_pp = tarifa_media_por_grupo(
+        agrupado.ngroup().to_numpy(), df['ventas_pp'].to_numpy(), df['inversion'].to_numpy(), precio_dia, comision_dia)
+    df = agrupado[['inversion', 'pagos_iniciados', 'ventas_pp']].sum().reset_index()
+    df['ingresos_pp'] = ingresos_pp
+    df['roas_fe'] = dividir(ingresos_pp, df['inversion'].to_numpy())
+
+    df['roas_break_even'] = roas_break_even(precio_pp, comision_pp)
+    df['probabilidad'] = probabilidad_supera_break_even(
+        df['inversion'], df['pagos_iniciados'], df['ventas_pp'], precio_pp, comision_pp,
+        grupos=pd.factorize(df['id_oferta'])[0])
+    return df
+
 # --- FUNCIONES DE MANEJO DE ESTADO ---
 def crear_nueva_oferta(nombre, tipo_embudo, precio_principal, plantilla_id=None):
     id_oferta = f"oferta_{nombre.replace(' ', '_').lower()}_{int(time.time())}"
@@ -361,7 +2749,9 @@ def crear_nueva_oferta(nombre, tipo_embudo, precio_principal, plantilla_id=None)
         "funnel": {"principal": {"nombre": "Producto Principal", "precio": precio_principal, "alias": "PP", "estado": "🟢 Activo"}},
         "anuncios_testeo": [], "testeos": pd.DataFrame(columns=["Fecha", "Anuncio", "Inversión", "Pagos Iniciados", get_safe_column_name("PP"), "Facturación Total", "Ganancia Bruta", "Ganancia Neta", "ROAS Bruto", "ROAS Neto"]),
         "escala": {},
-        "comision_pp": 0.0, "cpa_objetivo": 0.0
+        "comision_pp": 0.0, "cpa_objetivo": 0.0,
+        "rollups": VERSION_ROLLUPS,
+        "_hidratada": True
     }
     
     if plantilla_id and plantilla_id in st.session_state.plantillas:
@@ -372,6 +2762,7 @@ def crear_nueva_oferta(nombre, tipo_embudo, precio_principal, plantilla_id=None)
         }
 
     st.session_state.ofertas[id_oferta] = oferta_data
+    registrar_cambio('ofertas', id_oferta)
     save_data_to_firestore()
     st.balloons()
     st.success(f"¡Oferta '{nombre}' creada con éxito!")
@@ -379,6 +2770,7 @@ def crear_nueva_oferta(nombre, tipo_embudo, precio_principal, plantilla_id=None)
     st.session_state.vista_actual = 'dashboard'
 
 def seleccionar_oferta(id_oferta):
+    asegurar_ofertas_hidratadas([id_oferta])
     st.session_state.oferta_seleccionada = id_oferta
     st.session_state.vista_actual = 'dashboard'
     st.session_state['anuncio_para_escalar'] = None
@@ -388,6 +2780,7 @@ def seleccionar_oferta(id_oferta):
 
 def cambiar_estado_oferta(id_oferta, nuevo_estado):
     st.session_state.ofertas[id_oferta]['estado'] = nuevo_estado
+    registrar_cambio('ofertas', id_oferta, 'estado')
     save_data_to_firestore()
     st.success(f"El estado de la oferta ha sido actualizado a: {nuevo_estado}")
     
@@ -395,48 +2788,102 @@ def eliminar_oferta(id_oferta):
     if id_oferta in st.session_state.ofertas:
         nombre_oferta = st.session_state.ofertas[id_oferta]['nombre']
         del st.session_state.ofertas[id_oferta]
+        registrar_cambio('ofertas', id_oferta)
         save_data_to_firestore()
         st.session_state.oferta_seleccionada = None
         st.session_state.offer_to_delete = None
         st.success(f"¡Oferta '{nombre_oferta}' eliminada permanentemente!")
 
-def actualizar_configuracion_financiera(id_oferta, comision, cpa):
-    st.session_state.ofertas[id_oferta]['comision_pp'] = comision
-    st.session_state.ofertas[id_oferta]['cpa_objetivo'] = cpa
+def recalcular_oferta(id_oferta):
+    """Recalcula las métricas guardadas de todos los registros de la oferta con las tarifas vigentes en cada fecha.
+
+    Cada segmento (testeos y registros de cada campaña) se recalcula de una vez con
+    `calcular_metricas_df`; los que cambian se compactan, de modo que el snapshot, el borrado de su
+    log y los rollups reconstruidos salen juntos en un único guardado. Devuelve cuántos registros cambiaron.
+    """
+    oferta = st.session_state.ofertas[id_oferta]
+    estaba_hidratada = oferta.get('_hidratada', True)
+    if not estaba_hidratada:
+        hidratar_oferta(id_oferta)
+        oferta = st.session_state.ofertas[id_oferta]
+    cambiados = 0
+    for id_campana, contenedor in [(None, oferta)] + list(oferta.get('escala', {}).items()):
+        clave = clave_registros(id_campana)
+        df = obtener_registros(contenedor, clave)
+        columnas = [col for col in COLUMNAS_METRICAS_DIARIAS if col in df.columns]
+        if df.empty or not columnas:
+            continue
+        recalculado = calcular_metricas_oferta(df, oferta)
+        antes = np.column_stack([columna_numerica(df, col) for col in columnas])
+        despues = recalculado[columnas].to_numpy(dtype=float)
+        filas_cambiadas = int((~np.isclose(antes, despues)).any(axis=1).sum())
+        if not filas_cambiadas:
+            continue
+        df = df.copy()
+        df[columnas] = despues
+        contenedor[clave] = df
+        compactar_registros(id_oferta, id_campana)
+        cambiados += filas_cambiadas
+    if cambiados:
+        # Facturación y Ganancia Neta forman parte de los rollups: se reconstruyen y se guarda todo junto.
+        reconstruir_rollups(id_oferta)
+    if not estaba_hidratada:
+        liberar_oferta(oferta)
+    return cambiados
+
+def actualizar_umbrales_sugerencias(id_oferta, umbrales):
+    st.session_state.ofertas[id_oferta]['umbrales_sugerencias'] = umbrales
+    registrar_cambio('ofertas', id_oferta, 'umbrales_sugerencias')
     save_data_to_firestore()
+    st.success("Umbrales de sugerencias actualizados.")
+
+def registrar_cambio_tarifas(id_oferta):
+    for ruta in (('historial_tarifas',), ('comision_pp',), ('cpa_objetivo',), ('funnel',)):
+        registrar_cambio('ofertas', id_oferta, *ruta)
+
+def actualizar_configuracion_financiera(id_oferta, comision, cpa, desde=None):
+    """Fija la comisión PP y el CPA objetivo vigentes a partir de `desde` (hoy por defecto)."""
+    desde = desde or datetime.date.today().strftime('%Y-%m-%d')
+    requiere_recalculo = registrar_tarifa(st.session_state.ofertas[id_oferta], desde, comision_pp=comision, cpa_objetivo=cpa)
+    registrar_cambio_tarifas(id_oferta)
+    # Se guarda antes de recalcular: si la oferta hay que hidratarla, se toma del almacén ya actualizado.
+    save_data_to_firestore()
+    if requiere_recalculo:
+        recalcular_oferta(id_oferta)
     st.success("Configuración financiera actualizada.")
 
-def eliminar_registro_testeo(id_oferta, index):
-    df = st.session_state.ofertas[id_oferta]['testeos']
-    st.session_state.ofertas[id_oferta]['testeos'] = df.drop(index).reset_index(drop=True)
+def actualizar_precios_funnel(id_oferta, precios, desde=None):
+    """Fija los precios de los elementos del funnel ({item_id: precio}) vigentes a partir de `desde` y recalcula el histórico."""
+    desde = desde or datetime.date.today().strftime('%Y-%m-%d')
+    if not registrar_tarifa(st.session_state.ofertas[id_oferta], desde, precios=precios):
+        return
+    registrar_cambio_tarifas(id_oferta)
+    save_data_to_firestore()
+    recalcular_oferta(id_oferta)
+    st.success("Precios del funnel actualizados y métricas históricas recalculadas.")
+
+def eliminar_registro_testeo(id_oferta, id_registro):
+    borrar_registro(id_oferta, None, id_registro)
     save_data_to_firestore()
     st.success("Registro eliminado con éxito.")
 
-def eliminar_registro_escala(id_oferta, id_campana, index):
-    df = st.session_state.ofertas[id_oferta]['escala'][id_campana]['registros']
-    st.session_state.ofertas[id_oferta]['escala'][id_campana]['registros'] = df.drop(index).reset_index(drop=True)
+def eliminar_registro_escala(id_oferta, id_campana, id_registro):
+    borrar_registro(id_oferta, id_campana, id_registro)
     save_data_to_firestore()
     st.success("Registro de escala eliminado con éxito.")
 
-def actualizar_registro_escala(id_oferta, id_campana, index, nuevo_registro):
+def actualizar_registro_escala(id_oferta, id_campana, id_registro, nuevo_registro):
     oferta = st.session_state.ofertas[id_oferta]
-    campana = oferta['escala'][id_campana]
-    registro_calculado = calcular_metricas_diarias(nuevo_registro, oferta['funnel'], oferta.get('comision_pp', 0.0))
-    df_registro_actualizado = pd.DataFrame([registro_calculado])
-    for col in df_registro_actualizado.columns:
-        if col in campana['registros'].columns:
-            campana['registros'].loc[index, col] = df_registro_actualizado.iloc[0][col]
+    registro_calculado = calcular_metricas_diarias(nuevo_registro, oferta)
+    reemplazar_registro(id_oferta, id_campana, id_registro, registro_calculado)
     save_data_to_firestore()
     st.success("Registro de escala actualizado con éxito.")
     st.session_state['editing_record'] = None
 
-def actualizar_registro_testeo(id_oferta, index, nuevo_registro):
+def actualizar_registro_testeo(id_oferta, id_registro, nuevo_registro):
     oferta = st.session_state.ofertas[id_oferta]
-    registro_calculado = calcular_metricas_diarias(nuevo_registro, oferta['funnel'], oferta.get('comision_pp', 0.0))
-    df_registro_actualizado = pd.DataFrame([registro_calculado])
-    for col in df_registro_actualizado.columns:
-        if col in oferta['testeos'].columns:
-            oferta['testeos'].loc[index, col] = df_registro_actualizado.iloc[0][col]
+    registro_calculado = calcular_metricas_diarias(nuevo_registro, oferta)
+    reemplazar_registro(id_oferta, None, id_registro, registro_calculado)
     save_data_to_firestore()
     st.success("Registro actualizado con éxito.")
     st.session_state['editing_record'] = None
@@ -448,20 +2895,15 @@ def agregar_item_funnel(id_oferta, tipo, nombre, precio):
     alias = f"{alias_map.get(tipo, 'E')}{count}"
     item_id = f"{tipo.lower()}_{count}"
     oferta['funnel'][item_id] = {"nombre": nombre, "precio": precio, "alias": alias, "estado": "🟢 Activo"}
-    col_name = get_safe_column_name(alias)
-    if col_name not in oferta['testeos'].columns:
-        pos = oferta['testeos'].columns.get_loc("Facturación Total")
-        oferta['testeos'].insert(pos, col_name, 0)
-    if col_name not in [c for camp in oferta['escala'].values() for c in camp['registros'].columns]:
-       for camp in oferta['escala'].values():
-            if col_name not in camp['registros'].columns:
-                camp['registros'].insert(pos, col_name, 0)
+    # Sin columna nueva en los registros: aparece con la primera venta del elemento (ver ventas_formato_largo).
+    registrar_cambio('ofertas', id_oferta, 'funnel', item_id)
     save_data_to_firestore()
 
 def agregar_anuncio_testeo(id_oferta, nombre_anuncio):
     anuncios = st.session_state.ofertas[id_oferta]['anuncios_testeo']
     if nombre_anuncio and not any(d['nombre'] == nombre_anuncio for d in anuncios):
         anuncios.append({"nombre": nombre_anuncio, "estado": "🟢 Activo"})
+        registrar_cambio('ofertas', id_oferta, 'anuncios_testeo')
         save_data_to_firestore()
         st.success(f"Anuncio '{nombre_anuncio}' añadido y activado.")
     elif not nombre_anuncio: st.warning("El nombre del anuncio no puede estar vacío.")
@@ -472,23 +2914,27 @@ def toggle_estado_anuncio(id_oferta, nombre_anuncio):
         if ad['nombre'] == nombre_anuncio:
             ad['estado'] = "🔴 Inactivo" if ad['estado'] == "🟢 Activo" else "🟢 Activo"
             break
+    registrar_cambio('ofertas', id_oferta, 'anuncios_testeo')
     save_data_to_firestore()
 
 def toggle_estado_funnel_item(id_oferta, item_id):
     item = st.session_state.ofertas[id_oferta]['funnel'][item_id]
     item['estado'] = "📁 Archivado" if item['estado'] == "🟢 Activo" else "🟢 Activo"
+    registrar_cambio('ofertas', id_oferta, 'funnel', item_id, 'estado')
     save_data_to_firestore()
 
 def toggle_estado_campana_escala(id_oferta, id_campana):
     campana = st.session_state.ofertas[id_oferta]['escala'][id_campana]
     estado_actual = campana.get('estado', '🟢 Activa') 
     campana['estado'] = "🔴 Inactiva" if estado_actual == "🟢 Activa" else "🟢 Activa"
+    registrar_cambio('campanas', (id_oferta, id_campana), 'estado')
     save_data_to_firestore()
 
 def toggle_estado_componente_escala(id_oferta, id_campana, nombre_componente):
     for comp in st.session_state.ofertas[id_oferta]['escala'][id_campana]['componentes']:
         if comp['nombre'] == nombre_componente:
             comp['estado'] = "🔴 Inactivo" if comp['estado'] == "🟢 Activo" else "🟢 Activo"
+            registrar_cambio('campanas', (id_oferta, id_campana), 'componentes')
             save_data_to_firestore()
             st.success(f"Estado de '{nombre_componente}' actualizado.")
             break
@@ -513,6 +2959,7 @@ def crear_campana_escala(id_oferta, nombre_campana, anuncio_ganador, estrategia,
         "registros": pd.DataFrame(columns=columnas_escala), "componentes": componentes,
         "estado": "🟢 Activa"
     }
+    registrar_cambio('campanas', (id_oferta, id_campana))
     save_data_to_firestore()
     st.balloons()
     st.success(f"¡Campaña de escala '{nombre_campana}' creada con éxito!")
@@ -526,6 +2973,7 @@ def agregar_componente_a_campana(id_oferta, id_campana, nombre_componente):
     st.session_state.ofertas[id_oferta]['escala'][id_campana]['componentes'].append({
         "nombre": nombre_componente, "estado": "🟢 Activo"
     })
+    registrar_cambio('campanas', (id_oferta, id_campana), 'componentes')
     save_data_to_firestore()
     st.success(f"'{nombre_componente}' añadido a la campaña '{st.session_state.ofertas[id_oferta]['escala'][id_campana]['nombre_campana']}'")
     st.session_state['anuncio_para_escalar'] = None
@@ -533,18 +2981,247 @@ def agregar_componente_a_campana(id_oferta, id_campana, nombre_componente):
 
 def agregar_registro_escala(id_oferta, id_campana, nuevo_registro):
     oferta = st.session_state.ofertas[id_oferta]
-    campana = oferta['escala'][id_campana]
-    
-    registro_calculado = calcular_metricas_diarias(nuevo_registro, oferta['funnel'], oferta.get('comision_pp', 0.0))
-    df_nuevo = pd.DataFrame([registro_calculado])
-    
-    campana['registros'] = pd.concat([campana['registros'], df_nuevo], ignore_index=True)
+    registro_calculado = calcular_metricas_diarias(nuevo_registro, oferta)
+    anexar_registro(id_oferta, id_campana, registro_calculado)
     save_data_to_firestore()
     st.success("Registro de escala guardado con éxito.")
 
+# --- IMPORTACIÓN MASIVA DE EXPORTACIONES DIARIAS ---
+# Las exportaciones de las plataformas de anuncios (CSV o Parquet) se leen por lotes y cada lote se
+# reduce enseguida a una fila por (Fecha, Anuncio/Componente): la memoria depende de días × anuncios,
+# no del tamaño del archivo. Importar es un upsert sobre esa clave (la fila existente conserva su
+# id_registro y su posición), así que reimportar el mismo archivo no duplica nada. Las métricas se
+# calculan de una vez con calcular_metricas_oferta y, como en recalcular_oferta, el segmento se
+# compacta y los rollups se reconstruyen para que todo salga en un único guardado de la oferta.
+FILAS_POR_LOTE_IMPORTACION = 100_000
+SINONIMOS_IMPORTACION = {
+    'Fecha': ('fecha', 'date', 'day', 'dia', 'reporting starts', 'inicio del informe'),
+    'Anuncio': ('anuncio', 'ad', 'ad name', 'nombre del anuncio'),
+    'Componente': ('componente', 'ad set name', 'conjunto de anuncios', 'nombre del conjunto de anuncios'),
+    'Inversión': ('inversion', 'spend', 'cost', 'gasto', 'amount spent', 'amount spent (usd)', 'importe gastado', 'importe gastado (usd)'),
+    'Pagos Iniciados': ('pagos iniciados', 'checkouts initiated', 'initiate checkout', 'pagos iniciados en el sitio web'),
+}
+
+def columna_clave_importacion(id_campana=None):
+    return 'Anuncio' if id_campana is None else 'Componente'
+
+def objetivos_importacion(funnel, columna_clave):
+    """Columnas del registro diario que se pueden rellenar desde una exportación."""
+    return ['Fecha', columna_clave, 'Inversión', 'Pagos Iniciados'] + list(columnas_ventas_funnel(funnel))
+
+def sugerir_mapeo_importacion(columnas, funnel, columna_clave):
+    """{columna del registro: columna del archivo} para los nombres que se reconocen sin ambigüedad."""
+    sinonimos = {objetivo: SINONIMOS_IMPORTACION.get(objetivo, ()) for objetivo in objetivos_importacion(funnel, columna_clave)}
+    for col, item in columnas_ventas_funnel(funnel).items():
+        sinonimos[col] = (normalizar_busqueda(col), normalizar_busqueda(funnel[item]['alias']), normalizar_busqueda(funnel[item]['nombre']))
+    por_nombre = {normalizar_busqueda(col).strip(): col for col in columnas}
+    mapeo = {}
+    for objetivo, nombres in sinonimos.items():
+        origen = next((por_nombre[n] for n in nombres if n in por_nombre), None)
+        if origen is not None and origen not in mapeo.values():
+            mapeo[objetivo] = origen
+    return mapeo
+
+def validar_mapeo_importacion(columnas, mapeo, funnel, columna_clave):
+    """Errores que impiden importar con `mapeo`; una lista vacía si se puede importar."""
+    errores = [f"Falta asignar la columna '{objetivo}'." for objetivo in ('Fecha', columna_clave) if objetivo not in mapeo]
+    repetidas = sorted({c for c in mapeo.values() if list(mapeo.values()).count(c) > 1})
+    if repetidas:
+        errores.append(f"Cada columna del archivo sólo puede asignarse una vez: {', '.join(repetidas)}.")
+    # Una columna de ventas que no corresponde a ningún elemento del funnel se perdería sin avisar.
+    sin_funnel = [c for c in columnas if normalizar_busqueda(c).startswith('ventas:') and c not in mapeo.values()]
+    if sin_funnel:
+        errores.append(f"Estas columnas de ventas no corresponden a ningún elemento del funnel: {', '.join(sin_funnel)}. Añádelos al funnel o asígnalas.")
+    return errores
+
+def formato_csv(archivo):
+    """(separador, decimal) de un CSV: los exportados con configuración regional española usan ';' y ','."""
+    primera = archivo.readline()
+    archivo.seek(0)
+    if isinstance(primera, bytes):
+        primera = primera.decode('utf-8-sig', errors='ignore')
+    return (';', ',') if primera.count(';') > primera.count(',') else (',', '.')
+
+def es_parquet(archivo):
+    return str(getattr(archivo, 'name', '')).lower().endswith('.parquet')
+
+def columnas_exportacion(archivo):
+    """Los nombres de columna de la exportación, sin leer sus filas."""
+    if es_parquet(archivo):
+        columnas = pq.ParquetFile(archivo).schema_arrow.names
+    else:
+        separador, _ = formato_csv(archivo)
+        columnas = list(pd.read_csv(archivo, sep=separador, nrows=0, encoding='utf-8-sig').columns)
+    archivo.seek(0)
+    return columnas
+
+def leer_exportacion_por_lotes(archivo, columnas):
+    """Genera DataFrames de hasta FILAS_POR_LOTE_IMPORTACION filas con sólo las `columnas` indicadas."""
+    if es_parquet(archivo):
+        for lote in pq.ParquetFile(archivo).iter_batches(batch_size=FILAS_POR_LOTE_IMPORTACION, columns=columnas):
+            yield lote.to_pandas()
+    else:
+        separador, decimal = formato_csv(archivo)
+        yield from pd.read_csv(archivo, sep=separador, decimal=decimal, usecols=columnas, encoding='utf-8-sig', chunksize=FILAS_POR_LOTE_IMPORTACION)
+    archivo.seek(0)
+
+def fechas_importacion(serie):
+    """Fechas ISO (AAAA-MM-DD) y, las que no lo sean, con el día primero (DD/MM/AAAA); NaT si no se entienden."""
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        fechas = serie
+    else:
+        fechas = pd.to_datetime(serie, errors='coerce', format='ISO8601')
+        faltan = fechas.isna() & serie.notna()
+        if faltan.any():
+            fechas = fechas.where(~faltan, pd.to_datetime(serie[faltan], errors='coerce', dayfirst=True))
+    if getattr(fechas.dt, 'tz', None) is not None:
+        fechas = fechas.dt.tz_localize(None)
+    return fechas
+
+def reducir_lote_importacion(lote, mapeo, columna_clave):
+    """Normaliza un lote y lo agrega por (Fecha, clave). Devuelve (agregado, filas rechazadas).
+
+    Se rechazan las filas sin fecha o sin clave válidas y las que traen valores negativos.
+    """
+    lote = lote.rename(columns={origen: objetivo for objetivo, origen in mapeo.items()})[list(mapeo)]
+    fechas = fechas_importacion(lote['Fecha'])
+    claves = lote[columna_clave].astype('string').str.strip()
+    numericas = lote.drop(columns=['Fecha', columna_clave]).apply(pd.to_numeric, errors='coerce')
+    validas = (fechas.notna() & claves.fillna('').ne('') & ~(numericas < 0).any(axis=1)).to_numpy()
+    reducido = numericas[validas].assign(Fecha=fechas[validas].dt.normalize().astype('datetime64[ns]'), **{columna_clave: claves[validas].astype(object)})
+    agregado = reducido.groupby(['Fecha', columna_clave], sort=False).sum()
+    return agregado, int((~validas).sum())
+
+def leer_importacion(archivo, mapeo, columna_clave):
+    """Lee la exportación completa por lotes: (una fila por Fecha y clave, filas leídas, filas rechazadas)."""
+    parciales, leidas, rechazadas = [], 0, 0
+    for lote in leer_exportacion_por_lotes(archivo, list(mapeo.values())):
+        agregado, rechazadas_lote = reducir_lote_importacion(lote, mapeo, columna_clave)
+        parciales.append(agregado)
+        leidas += len(lote)
+        rechazadas += rechazadas_lote
+    if not parciales:
+        return pd.DataFrame(columns=list(mapeo)), leidas, rechazadas
+    # Un mismo día y anuncio puede repartirse entre lotes (o venir desglosado por ubicación): se suma.
+    importado = pd.concat(parciales).groupby(level=[0, 1], sort=False).sum().reset_index()
+    for col in importado.columns:
+        if col == 'Pagos Iniciados' or col.startswith('Ventas: '):
+            importado[col] = importado[col].round().astype('int64')
+    return importado, leidas, rechazadas
+
+def combinar_importacion(df, importado, columna_clave, oferta):
+    """Upsert de `importado` (una fila por Fecha y clave) sobre los registros `df` de un segmento.
+
+    La primera fila existente de cada clave conserva su posición y su id_registro y recibe las
+    columnas importadas y sus métricas recalculadas; el resto de filas con esa clave se eliminan.
+    Las claves nuevas se añaden al final. Devuelve (registros, nº de actualizados, nº de nuevos).
+    """
+    claves_importadas = pd.MultiIndex.from_frame(importado[['Fecha', columna_clave]])
+    if df.empty:
+        coincide, destino = np.zeros(len(df), dtype=bool), np.full(len(importado), -1)
+    else:
+        fechas = pd.to_datetime(df['Fecha']).dt.normalize().astype('datetime64[ns]')
+        claves = pd.MultiIndex.from_arrays([fechas, df[columna_clave].astype(object).astype(str)])
+        coincide = claves.isin(claves_importadas)
+        primeras = np.flatnonzero(coincide & ~claves.duplicated())
+        destino = pd.Series(primeras, index=claves[primeras]).reindex(claves_importadas).fillna(-1).to_numpy(dtype=int)
+    existe = destino >= 0
+    actualizadas = df.iloc[destino[existe]].copy()
+    nuevas = pd.DataFrame({COLUMNA_ID_REGISTRO: [nuevo_id_registro() for _ in range(int((~existe).sum()))]})
+    for col in importado.columns:
+        valores = importado[col].to_numpy()
+        actualizadas[col] = valores[existe]
+        nuevas[col] = valores[~existe]
+    tocadas = concatenar_registros([actualizadas, nuevas])
+    calculadas = calcular_metricas_oferta(tocadas, oferta)
+    tocadas = tocadas.assign(**{col: calculadas[col].to_numpy() for col in COLUMNAS_METRICAS_DIARIAS})
+    conservadas = np.flatnonzero(~coincide)
+    combinado = concatenar_registros([df.iloc[conservadas], tocadas])
+    orden = np.concatenate([conservadas, destino[existe], len(df) + np.arange(len(nuevas))])
+    return combinado.iloc[np.argsort(orden, kind='stable')].reset_index(drop=True), int(existe.sum()), len(nuevas)
+
+def importar_registros(id_oferta, id_campana, importado, alta_nuevos=True):
+    """Aplica una importación ya leída sobre los testeos (o una campaña) y lo guarda todo de una vez.
+
+    Los anuncios/componentes que la oferta aún no tiene se dan de alta con `alta_nuevos`; si no,
+    sus filas se descartan. Devuelve un resumen con los registros actualizados, nuevos y descartados.
+    """
+    oferta = st.session_state.ofertas[id_oferta]
+    contenedor = contenedor_registros(id_oferta, id_campana)
+    columna = columna_clave_importacion(id_campana)
+    lista = oferta['anuncios_testeo'] if id_campana is None else contenedor.setdefault('componentes', [])
+    desconocidos = sorted(set(importado[columna]) - {d['nombre'] for d in lista})
+    resumen = {'actualizados': 0, 'nuevos': 0, 'descartados': 0, 'altas': 0}
+    if desconocidos and alta_nuevos:
+        lista.extend({"nombre": nombre, "estado": "🟢 Activo"} for nombre in desconocidos)
+        if id_campana is None:
+            registrar_cambio('ofertas', id_oferta, 'anuncios_testeo')
+        else:
+            registrar_cambio('campanas', (id_oferta, id_campana), 'componentes')
+        resumen['altas'] = len(desconocidos)
+    elif desconocidos:
+        descartar = importado[columna].isin(desconocidos)
+        resumen['descartados'] = int(descartar.sum())
+        importado = importado[~descartar]
+    if importado.empty:
+        if resumen['altas']:
+            save_data_to_firestore()
+        return resumen
+    clave = clave_registros(id_campana)
+    contenedor[clave], resumen['actualizados'], resumen['nuevos'] = combinar_importacion(obtener_registros(contenedor, clave), importado, columna, oferta)
+    compactar_registros(id_oferta, id_campana)
+    # reconstruir_rollups guarda: snapshot, borrado del log, altas y rollups salen en el mismo guardado.
+    reconstruir_rollups(id_oferta)
+    return resumen
+
+def mostrar_importador_registros(id_oferta, id_campana=None):
+    """Subida de una exportación, asignación de columnas e importación sobre los testeos o una campaña."""
+    sufijo = f"{id_oferta}_{id_campana or 'testeos'}"
+    resumen = st.session_state.pop(f'_resumen_importacion_{sufijo}', None)
+    if resumen:
+        st.success(resumen)
+    archivo = st.file_uploader("Exportación diaria (CSV o Parquet)", type=['csv', 'parquet'], key=f"archivo_importacion_{sufijo}")
+    if archivo is None:
+        return
+    funnel = st.session_state.ofertas[id_oferta]['funnel']
+    columna = columna_clave_importacion(id_campana)
+    try:
+        columnas = columnas_exportacion(archivo)
+    except Exception as e:
+        st.error(f"No se pudo leer el archivo: {e}")
+        return
+    sugerido = sugerir_mapeo_importacion(columnas, funnel, columna)
+    st.caption("Asigna a cada columna del registro la columna del archivo de la que se toma.")
+    opciones = [None] + columnas
+    cols_mapeo = st.columns(4)
+    mapeo = {}
+    for i, objetivo in enumerate(objetivos_importacion(funnel, columna)):
+        origen = cols_mapeo[i % 4].selectbox(
+            objetivo, options=opciones, index=opciones.index(sugerido.get(objetivo)),
+            format_func=lambda c: "— Sin asignar —" if c is None else c, key=f"mapeo_{sufijo}_{archivo.file_id}_{objetivo}")
+        if origen is not None:
+            mapeo[objetivo] = origen
+    errores = validar_mapeo_importacion(columnas, mapeo, funnel, columna)
+    for error in errores:
+        st.error(error)
+    alta_nuevos = st.checkbox(f"Dar de alta los {'anuncios' if id_campana is None else 'componentes'} que aún no existan", value=True, key=f"alta_importacion_{sufijo}")
+    if st.button("📥 Importar", disabled=bool(errores), use_container_width=True, key=f"boton_importacion_{sufijo}"):
+        with st.spinner("Importando registros..."):
+            try:
+                importado, leidas, rechazadas = leer_importacion(archivo, mapeo, columna)
+            except Exception as e:
+                st.error(f"No se pudo importar el archivo: {e}")
+                return
+            r = importar_registros(id_oferta, id_campana, importado, alta_nuevos)
+        st.session_state[f'_resumen_importacion_{sufijo}'] = (
+            f"{leidas} filas leídas: {r['nuevos']} registros nuevos y {r['actualizados']} actualizados. "
+            f"Rechazadas por datos no válidos: {rechazadas}. Descartados por {columna.lower()} desconocido: {r['descartados']}. Altas: {r['altas']}.")
+        st.rerun()
+
 
 # --- FLUJO PRINCIPAL DE LA APLICACIÓN ---
 def main_app():
+    sincronizar_sesion_con_almacen()
     with st.sidebar:
         st.image("Mujer Bio Poderosa (1).png", use_container_width=True) 
         st.title("Panel de Control INFINITY")
@@ -557,6 +3234,12 @@ def main_app():
         st.write(f"Conectado como: **{st.session_state.user_email}**")
         
         if st.button("Cerrar Sesión", use_container_width=True, type="secondary"):
+            save_data_to_firestore()
+            with st.spinner("Guardando los últimos cambios..."):
+                cola = obtener_cola_escritura(st.secrets["team_config"]["workspace_id"])
+                if not cola.vaciar() or cola.operaciones_fallidas:
+                    st.error("No se pudieron confirmar todos los cambios pendientes. Reinténtalos desde la barra lateral antes de salir.")
+                    st.stop()
             st.session_state.logged_in = False
             st.session_state.user_id = None
             st.session_state.user_email = None
@@ -583,7 +3266,7 @@ def main_app():
             st.rerun()
 
         st.divider()
-        st.info("Los datos del equipo se guardan automáticamente en la nube.")
+        render_estado_sincronizacion()
 
         if st.session_state.vista_actual == 'dashboard':
             with st.expander("➕ CREAR NUEVA OFERTA", expanded=True):
@@ -616,6 +3299,9 @@ def main_app():
                         if st.button(f"{detalles['estado']} {detalles['nombre']}", key=f"btn_{id_oferta}", use_container_width=True):
                             seleccionar_oferta(id_oferta)
 
+    if st.session_state.oferta_seleccionada in st.session_state.get('ofertas', {}):
+        asegurar_ofertas_hidratadas([st.session_state.oferta_seleccionada])
+
     if st.session_state.vista_actual == 'plantillas':
         # ... (código de la vista de plantillas sin cambios) ...
         st.title("✅ Administrador de Plantillas de Proyectos")
@@ -657,6 +3343,7 @@ def main_app():
                                         "nombre": nombre_plantilla,
                                         "checklist_raw": checklist_texto
                                     }
+                                    registrar_cambio('plantillas', id_plantilla)
                                     save_data_to_firestore()
                                     st.success(f"¡Plantilla '{nombre_plantilla}' guardada con éxito!")
                         else:
@@ -682,6 +3369,7 @@ def main_app():
                         st.rerun()
                     if col2.button("🗑️ Eliminar", key=f"del_{id_plantilla}", use_container_width=True):
                         del st.session_state.plantillas[id_plantilla]
+                        registrar_cambio('plantillas', id_plantilla)
                         save_data_to_firestore()
                         st.rerun()
     elif st.session_state.vista_actual == 'boveda':
@@ -691,7 +3379,7 @@ def main_app():
         
         for entrada in st.session_state.boveda:
             if 'estatus' not in entrada:
-                entrada['estatus'] = '💡 Idea'
+                entrada['estatus'] = ESTATUS_BOVEDA_POR_DEFECTO
 
         editing_id = st.session_state.get('editing_boveda_id', None)
         entry_to_edit = next((item for item in st.session_state.boveda if item['id'] == editing_id), None) if editing_id else None
@@ -738,6 +3426,7 @@ def main_app():
                                 st.session_state.editing_boveda_id = None
                             else:
                                 st.session_state.boveda.insert(0, datos_entrada)
+                                registrar_cambio('boveda', datos_entrada['id'])
                                 save_data_to_firestore()
                                 st.success(f"¡Oferta '{nombre}' guardada!")
                             st.rerun()
@@ -751,140 +3440,110 @@ def main_app():
         st.divider()
         st.header("📚 Tablero de Inteligencia")
         
-        st.markdown("##### Filtros del Tablero")
-        f_col1, f_col2, f_col3 = st.columns([2, 2, 1])
-        with f_col1:
-            tipos_unicos = sorted(list(set(o['tipo_oferta'] for o in st.session_state.boveda if 'tipo_oferta' in o)))
-            filtro_tipo = st.multiselect("Filtrar por Tipo:", options=tipos_unicos, placeholder="Todos los tipos")
-        with f_col2:
-            estatus_unicos = ['💡 Idea', '⚙️ Modelando', '🧪 En Pruebas', '🗄️ Archivada']
-            filtro_estatus = st.multiselect("Filtrar por Estatus:", options=estatus_unicos, placeholder="Todos los estatus")
-        with f_col3:
-            st.write("") 
-            ocultar_archivadas = st.checkbox("Ocultar archivadas", value=True)
-        view_options = ['🖼️ Tarjetas', '📋 Tabla']
-        st.session_state.boveda_view_mode = st.radio("Ver como:", view_options, horizontal=True, key="boveda_view_selector")
-        ofertas_a_mostrar = st.session_state.boveda
-        if ocultar_archivadas:
-            ofertas_a_mostrar = [o for o in ofertas_a_mostrar if o.get('estatus') != '🗄️ Archivada']
-        if filtro_tipo:
-            ofertas_a_mostrar = [o for o in ofertas_a_mostrar if o.get('tipo_oferta') in filtro_tipo]
-        if filtro_estatus:
-            ofertas_a_mostrar = [o for o in ofertas_a_mostrar if o.get('estatus') in filtro_estatus]
-        if not ofertas_a_mostrar:
-            st.info("Tu bóveda está vacía o ninguna oferta coincide con los filtros actuales.")
-        else:
-            tipo_map = { "VSL": {"color": "#007bff", "emoji": "🟦"}, "QUIZ": {"color": "#6f42c1", "emoji": "🟪"}, "TSL": {"color": "#28a745", "emoji": "🟩"} }
-            
-            if st.session_state.boveda_view_mode == '🖼️ Tarjetas':
-                num_columnas = 3
-                columnas = st.columns(num_columnas)
-                for index, entrada in enumerate(ofertas_a_mostrar):
-                    columna_actual = columnas[index % num_columnas]
-                    with columna_actual:
-                        tipo_info = tipo_map.get(entrada['tipo_oferta'], {"color": "#6c757d", "emoji": "❔"})
-                        with st.container():
-                            estatus_actual = entrada.get('estatus', '💡 Idea')
-                            extra_class = ''
-                            if estatus_actual == '⚙️ Modelando':
-                                extra_class = 'glow-modelando'
-                            elif estatus_actual == '🧪 En Pruebas':
-                                extra_class = 'glow-pruebas'
-                            elif estatus_actual == '🗄️ Archivada':
-                                extra_class = 'fade-archivada'
-
-                            st.markdown(f"""
-                            <div class="card-boveda {extra_class}" style="border-left: 5px solid {tipo_info['color']};">
-                                <h4 style="color: black;">{entrada['nombre']} <span style="font-size: 1.2em;">{render_rating_stars(entrada['calificacion'])}</span></h4>
-                                <p class="fecha-registro">Registrado el: {entrada['fecha_registro']}</p>
-                                <hr>
-                                <div class="card-body">
-                                    <div class="card-col">
-                                        <p><strong>{tipo_info['emoji']} Tipo:</strong> {entrada['tipo_oferta']}</p>
-                                        <p><strong>🎯 Nicho:</strong> {entrada.get('nicho', 'N/A')}</p>
-                                        <p><strong>🌎 Idioma:</strong> {entrada.get('idioma', 'N/A')}</p>
-                                    </div>
-                                    <div class="card-col">
-                                        <p><strong>📊 Ads Activos:</strong> {entrada.get('num_anuncios', 'N/A')}</p>
-                                        <p><strong>💡 ¿Testear?:</strong> {entrada.get('testear', 'N/A')}</p>
-                                    </div>
-                                </div>
-                                <div class="card-footer">
-                                    <strong>🔗 Links:</strong>
-                                    {'<a href="' + entrada["link_anuncios"] + '" target="_blank">Ver Anuncios</a>' if entrada.get("link_anuncios") else ''}
-                                    {' | <a href="' + entrada["link_oferta"] + '" target="_blank">Ver Oferta</a>' if entrada.get("link_oferta") else ''}
-                                    <details>
-                                        <summary>Ver Comentarios</summary>
-                                        <p class="comentarios">
-                                            {entrada.get('comentarios') if entrada.get('comentarios') else 'Sin comentarios.'}
-                                        </p>
-                                    </details>
-                                </div>
-                            </div>
-                            """, unsafe_allow_html=True)
+        @st.fragment
+        def fragmento_tablero_boveda():
+            # Filtros y cambios de estatus de las tarjetas sólo redibujan el tablero.
+            st.markdown("##### Filtros del Tablero")
+            b_col1, b_col2 = st.columns([4, 1])
+            texto_busqueda = b_col1.text_input("🔎 Buscar:", placeholder="Nombre, nicho, idioma o comentarios", key="boveda_busqueda")
+            with b_col2:
+                st.write("")
+                ocultar_archivadas = st.checkbox("Ocultar archivadas", value=True)
+            # Búsqueda, filtros y recuentos salen del índice del almacén: no se recorre la Bóveda entera.
+            # El recuento de cada faceta aplica la búsqueda y las demás facetas, pero no la propia.
+            filtros = {campo: st.session_state.get(f"boveda_faceta_{campo}", []) for campo in FACETAS_BOVEDA}
+            almacen = almacen_actual()
+            with almacen.lock:
+                indice = almacen.indice_boveda
+                filtros = {campo: [v for v in valores if v in indice.facetas[campo]] for campo, valores in filtros.items()}
+                ids_busqueda = indice.buscar(texto_busqueda)
+                if ocultar_archivadas:
+                    ids_busqueda -= indice.facetas['estatus'].get('🗄️ Archivada', set())
+                conteos = {campo: indice.conteos(campo, indice.filtrar(ids_busqueda, {c: v for c, v in filtros.items() if c != campo})) for campo in FACETAS_BOVEDA}
+                ids_visibles = indice.filtrar(ids_busqueda, filtros)
+            columnas_facetas = st.columns(len(FACETAS_BOVEDA))
+            for columna, (campo, etiqueta) in zip(columnas_facetas, FACETAS_BOVEDA.items()):
+                opciones = sorted(conteos[campo], key=str, reverse=campo == 'calificacion')
+                clave_faceta = f"boveda_faceta_{campo}"
+                if clave_faceta in st.session_state:
+                    st.session_state[clave_faceta] = filtros[campo]
+                columna.multiselect(
+                    f"{etiqueta}:",
+                    options=opciones,
+                    format_func=lambda valor, campo=campo: f"{render_rating_stars(valor) if campo == 'calificacion' else valor} ({conteos[campo][valor]})",
+                    placeholder="Todos",
+                    key=clave_faceta
+                )
+            view_options = ['🖼️ Tarjetas', '📋 Tabla']
+            st.session_state.boveda_view_mode = st.radio("Ver como:", view_options, horizontal=True, key="boveda_view_selector")
+            ofertas_a_mostrar = [o for o in st.session_state.boveda if o['id'] in ids_visibles]
+            if not ofertas_a_mostrar:
+                st.info("Tu bóveda está vacía o ninguna oferta coincide con los filtros actuales.")
+            else:
+                if st.session_state.boveda_view_mode == '🖼️ Tarjetas':
+                    # Sólo se dibuja una página de tarjetas: el número de widgets queda acotado por el tamaño de página.
+                    p_col1, p_col2, p_col3 = st.columns([1, 1, 3])
+                    tamano_pagina = p_col1.selectbox("Tarjetas por página", options=TAMANOS_PAGINA_BOVEDA, key="boveda_tamano_pagina")
+                    total_paginas = max(1, math.ceil(len(ofertas_a_mostrar) / tamano_pagina))
+                    if st.session_state.get('boveda_pagina', 1) > total_paginas:
+                        st.session_state['boveda_pagina'] = total_paginas
+                    pagina = p_col2.number_input("Página", min_value=1, max_value=total_paginas, step=1, key="boveda_pagina")
+                    p_col3.caption(f"{len(ofertas_a_mostrar)} ofertas · página {pagina} de {total_paginas}")
+                    num_columnas = 3
+                    columnas = st.columns(num_columnas)
+                    estatus_opciones = ['💡 Idea', '⚙️ Modelando', '🧪 En Pruebas', '🗄️ Archivada']
+                    for index, entrada in enumerate(ofertas_a_mostrar[(pagina - 1) * tamano_pagina:pagina * tamano_pagina]):
+                        columna_actual = columnas[index % num_columnas]
+                        with columna_actual:
+                            with st.container():
+                                st.markdown(html_tarjeta_boveda(entrada), unsafe_allow_html=True)
                             
-                            estatus_opciones = ['💡 Idea', '⚙️ Modelando', '🧪 En Pruebas', '🗄️ Archivada']
-                            indice_actual = estatus_opciones.index(estatus_actual) if estatus_actual in estatus_opciones else 0
-                            key = f"status_select_{entrada['id']}"
+                                estatus_actual = entrada.get('estatus', ESTATUS_BOVEDA_POR_DEFECTO)
+                                indice_actual = estatus_opciones.index(estatus_actual) if estatus_actual in estatus_opciones else 0
+                                key = f"status_select_{entrada['id']}"
                             
-                            st.selectbox(
-                                "Estatus:",
-                                options=estatus_opciones,
-                                index=indice_actual,
-                                key=key,
-                                on_change=update_boveda_status,
-                                args=(entrada['id'], key)
-                            )
+                                st.selectbox(
+                                    "Estatus:",
+                                    options=estatus_opciones,
+                                    index=indice_actual,
+                                    key=key,
+                                    on_change=update_boveda_status,
+                                    args=(entrada['id'], key)
+                                )
                             
-                            btn_col1, btn_col2 = st.columns(2)
-                            if btn_col1.button("✏️ Editar", key=f"edit_boveda_{entrada['id']}", use_container_width=True):
-                                st.session_state.editing_boveda_id = entrada['id']
-                                st.rerun()
-                            if btn_col2.button("🗑️ Eliminar", key=f"del_boveda_{entrada['id']}", use_container_width=True):
-                                eliminar_entrada_boveda(entrada['id'])
-                                st.rerun()
+                                btn_col1, btn_col2 = st.columns(2)
+                                if btn_col1.button("✏️ Editar", key=f"edit_boveda_{entrada['id']}", use_container_width=True):
+                                    st.session_state.editing_boveda_id = entrada['id']
+                                    st.rerun()
+                                if btn_col2.button("🗑️ Eliminar", key=f"del_boveda_{entrada['id']}", use_container_width=True):
+                                    eliminar_entrada_boveda(entrada['id'])
+                                    st.rerun()
 
-            elif st.session_state.boveda_view_mode == '📋 Tabla':
-                df_boveda = pd.DataFrame(ofertas_a_mostrar)
-                if not df_boveda.empty:
-                    df_display = df_boveda[['nombre', 'tipo_oferta', 'nicho', 'estatus', 'calificacion', 'testear', 'fecha_registro']].copy()
-                    df_display.rename(columns={'nombre': 'Nombre', 'tipo_oferta': 'Tipo', 'nicho': 'Nicho', 'estatus': 'Estatus', 'calificacion': 'Calificación', 'testear': 'Testear?', 'fecha_registro': 'Fecha'}, inplace=True)
-                    st.dataframe(df_display, use_container_width=True)
-                else:
-                    st.info("No hay datos para mostrar en la tabla con los filtros actuales.")
-                st.markdown("---")
-                st.subheader("Acciones en Tabla")
-                if not st.session_state.boveda:
-                    st.info("No hay ofertas para seleccionar.")
-                else:
-                    nombres_ofertas = {entry['id']: entry['nombre'] for entry in st.session_state.boveda}
-                    id_seleccionado = st.selectbox("Selecciona una oferta para realizar una acción", options=nombres_ofertas.keys(), format_func=lambda x: nombres_ofertas[x])
+                elif st.session_state.boveda_view_mode == '📋 Tabla':
+                    df_boveda = pd.DataFrame(ofertas_a_mostrar)
+                    if not df_boveda.empty:
+                        df_display = df_boveda[['nombre', 'tipo_oferta', 'nicho', 'estatus', 'calificacion', 'testear', 'fecha_registro']].copy()
+                        df_display.rename(columns={'nombre': 'Nombre', 'tipo_oferta': 'Tipo', 'nicho': 'Nicho', 'estatus': 'Estatus', 'calificacion': 'Calificación', 'testear': 'Testear?', 'fecha_registro': 'Fecha'}, inplace=True)
+                        st.dataframe(df_display, use_container_width=True)
+                    else:
+                        st.info("No hay datos para mostrar en la tabla con los filtros actuales.")
+                    st.markdown("---")
+                    st.subheader("Acciones en Tabla")
+                    if not st.session_state.boveda:
+                        st.info("No hay ofertas para seleccionar.")
+                    else:
+                        nombres_ofertas = {entry['id']: entry['nombre'] for entry in st.session_state.boveda}
+                        id_seleccionado = st.selectbox("Selecciona una oferta para realizar una acción", options=nombres_ofertas.keys(), format_func=lambda x: nombres_ofertas[x])
                     
-                    if id_seleccionado:
-                        action_col1, action_col2 = st.columns(2)
-                        if action_col1.button("✏️ Editar Oferta Seleccionada", use_container_width=True):
-                            st.session_state.editing_boveda_id = id_seleccionado
-                            st.rerun()
-                        if action_col2.button("🗑️ Eliminar Oferta Seleccionada", use_container_width=True):
-                            eliminar_entrada_boveda(id_seleccionado)
-                            st.rerun()
-        st.markdown("""
-        <style>
-            .card-boveda { border-radius: 5px; padding: 15px; margin-bottom: 10px; background-color: #f8f9fa; color: #333; height: 100%; display: flex; flex-direction: column; justify-content: space-between; transition: all 0.3s ease-in-out;}
-            .card-boveda:hover { transform: translateY(-5px); box-shadow: 0 4px 12px rgba(0,0,0,0.1); }
-            .glow-modelando { box-shadow: 0 0 25px 8px #ffc107aa; }
-            .glow-pruebas { box-shadow: 0 0 25px 8px #28a745aa; }
-            .fade-archivada { opacity: 0.6; }
-            .fecha-registro { margin: 0; font-size: 0.9em; color: #6c757d; }
-            .card-body { display: flex; justify-content: space-between; }
-            .card-col { flex: 1; }
-            .card-col:first-child { padding-right: 5px; }
-            .card-col:last-child { padding-left: 5px; }
-            .card-footer { margin-top: 15px; }
-            .card-footer details summary { cursor: pointer; font-size: 0.9em; margin-top: 10px; }
-            .comentarios { background-color: #e9ecef; padding: 10px; border-radius: 5px; margin-top: 5px; color: black; }
-        </style>
-        """, unsafe_allow_html=True)
+                        if id_seleccionado:
+                            action_col1, action_col2 = st.columns(2)
+                            if action_col1.button("✏️ Editar Oferta Seleccionada", use_container_width=True):
+                                st.session_state.editing_boveda_id = id_seleccionado
+                                st.rerun()
+                            if action_col2.button("🗑️ Eliminar Oferta Seleccionada", use_container_width=True):
+                                eliminar_entrada_boveda(id_seleccionado)
+                                st.rerun()
+        fragmento_tablero_boveda()
 
     elif not st.session_state.oferta_seleccionada:
         st.title("📈 Dashboard Principal del Equipo")
@@ -892,80 +3551,96 @@ def main_app():
         if not st.session_state.ofertas:
             st.info("Crea la primera oferta en la barra lateral para empezar a ver datos aquí.")
         else:
-            all_dfs = []
-            for id_oferta, oferta_data in st.session_state.ofertas.items():
-                if oferta_data['estado'] in ["🧪 En Testeo", "✅ Validada"]:
-                    df_testeo = oferta_data['testeos'].copy()
-                    if not df_testeo.empty:
-                        df_testeo['Oferta'] = oferta_data['nombre']
-                        df_testeo['Comision PP'] = oferta_data.get('comision_pp', 0.0)
-                        all_dfs.append(df_testeo)
-                    
-                    for camp_id, camp_data in oferta_data.get('escala', {}).items():
-                        df_escala = camp_data['registros'].copy()
-                        if not df_escala.empty:
-                            df_escala['Oferta'] = oferta_data['nombre']
-                            df_escala['Comision PP'] = oferta_data.get('comision_pp', 0.0)
-                            all_dfs.append(df_escala)
+            # El dashboard trabaja sobre los rollups diarios: no necesita hidratar ninguna oferta.
+            ids_activas = [oid for oid, o in st.session_state.ofertas.items() if o['estado'] in ["🧪 En Testeo", "✅ Validada"]]
+            df_global = df_diario_rollups(ids_activas)
             
-            if not all_dfs:
+            if df_global.empty:
                 st.warning("No hay datos registrados en ninguna de las ofertas activas.")
             else:
-                df_global = pd.concat(all_dfs, ignore_index=True)
-                df_global['Fecha'] = pd.to_datetime(df_global['Fecha'])
-
-                st.divider()
-                col1, col2 = st.columns(2)
-                min_date = df_global['Fecha'].min().date()
-                max_date = df_global['Fecha'].max().date()
-                start_date_global = col1.date_input("Fecha de Inicio", min_date, min_value=min_date, max_value=max_date, key="global_start")
-                end_date_global = col2.date_input("Fecha de Fin", max_date, min_value=min_date, max_value=max_date, key="global_end")
-                df_filtrado = df_global[(df_global['Fecha'].dt.date >= start_date_global) & (df_global['Fecha'].dt.date <= end_date_global)]
-
-                if df_filtrado.empty:
-                    st.warning("No hay datos en el rango de fechas seleccionado.")
-                else:
-                    total_inversion = df_filtrado['Inversión'].sum()
-                    total_facturacion_bruta = df_filtrado['Facturación Total'].sum()
-                    
-                    ventas_pp_col = get_safe_column_name("PP")
-                    df_filtrado['Comisiones'] = df_filtrado.apply(lambda row: row.get(ventas_pp_col, 0) * row.get('Comision PP', 0), axis=1)
-                    total_comisiones = df_filtrado['Comisiones'].sum()
-                    total_ganancia_neta = total_facturacion_bruta - total_inversion - total_comisiones
-                    roas_neto_global = (total_facturacion_bruta - total_comisiones) / total_inversion if total_inversion > 0 else 0
+                ventas_pp_col = get_safe_column_name("PP")
+                df_global = df_global.rename(columns={'inversion': 'Inversión', 'facturacion': 'Facturación Total', 'ganancia_neta': 'Ganancia Neta', 'ventas_pp': ventas_pp_col})
+                df_global['Oferta'] = df_global['id_oferta'].map(lambda oid: st.session_state.ofertas[oid]['nombre'])
 
+                @st.fragment
+                def fragmento_rango_dashboard():
+                    # El rango de fechas sólo redibuja los KPIs y desgloses del dashboard.
                     st.divider()
-                    kpi1, kpi2, kpi3, kpi4 = st.columns(4)
-                    kpi1.metric("💵 Inversión Total", f"${total_inversion:,.2f}")
-                    kpi2.metric("📈 Facturación Bruta Total", f"${total_facturacion_bruta:,.2f}")
+                    col1, col2 = st.columns(2)
+                    min_date = df_global['Fecha'].min().date()
+                    max_date = df_global['Fecha'].max().date()
+                    start_date_global = col1.date_input("Fecha de Inicio", min_date, min_value=min_date, max_value=max_date, key="global_start")
+                    end_date_global = col2.date_input("Fecha de Fin", max_date, min_value=min_date, max_value=max_date, key="global_end")
+                    df_filtrado = filtrar_por_fechas(df_global, start_date_global, end_date_global)
+
+                    if df_filtrado.empty:
+                        st.warning("No hay datos en el rango de fechas seleccionado.")
+                    else:
+                        cubo_ofertas = memorizar_por_version(('dashboard', tuple(ids_activas)), version_rollups(ids_activas), lambda: CuboAcumulado.desde_df(df_global, ['Inversión', 'Facturación Total', 'Ganancia Neta'], clave='id_oferta'))
+                        df_rango_ofertas = cubo_ofertas.rango(start_date_global, end_date_global)
+                        total_inversion = df_rango_ofertas['Inversión'].sum()
+                        total_facturacion_bruta = df_rango_ofertas['Facturación Total'].sum()
+                        # Las comisiones salen de la Ganancia Neta de los rollups, valorada con las tarifas de cada día.
+                        total_ganancia_neta = df_rango_ofertas['Ganancia Neta'].sum()
+                        total_comisiones = total_facturacion_bruta - total_inversion - total_ganancia_neta
+                        roas_neto_global = (total_facturacion_bruta - total_comisiones) / total_inversion if total_inversion > 0 else 0
+
+                        st.divider()
+                        kpi1, kpi2, kpi3, kpi4 = st.columns(4)
+                        kpi1.metric("💵 Inversión Total", f"${total_inversion:,.2f}")
+                        kpi2.metric("📈 Facturación Bruta Total", f"${total_facturacion_bruta:,.2f}")
                     
-                    with kpi3:
-                        st.write("💰 Ganancia Neta Total")
-                        ganancia_color = "#33ff99" if total_ganancia_neta >= 0 else "#ff3366"
-                        st.markdown(f"<p style='font-size: 1.75rem; font-weight: 600; color: {ganancia_color};'>${total_ganancia_neta:,.2f}</p>", unsafe_allow_html=True)
+                        with kpi3:
+                            st.write("💰 Ganancia Neta Total")
+                            ganancia_color = "#33ff99" if total_ganancia_neta >= 0 else "#ff3366"
+                            st.markdown(f"<p style='font-size: 1.75rem; font-weight: 600; color: {ganancia_color};'>${total_ganancia_neta:,.2f}</p>", unsafe_allow_html=True)
 
-                    with kpi4:
-                        st.metric("🎯 ROAS Neto General", f"{roas_neto_global:.2f}")
+                        with kpi4:
+                            st.metric("🎯 ROAS Neto General", f"{roas_neto_global:.2f}")
 
 
-                    st.divider()
-                    st.subheader("Desglose de Rendimiento por Oferta")
+                        st.divider()
+                        st.subheader("Desglose de Rendimiento por Oferta")
                     
-                    df_por_oferta = df_filtrado.groupby('Oferta').agg({'Inversión': 'sum', 'Facturación Total': 'sum', 'Ganancia Neta': 'sum'}).reset_index()
-                    st.dataframe(df_por_oferta.style.format({'Inversión': "${:,.2f}", 'Facturación Total': "${:,.2f}", 'Ganancia Neta': "${:,.2f}"}), use_container_width=True)
-                    st.bar_chart(df_por_oferta.set_index('Oferta'), y='Ganancia Neta')
-                    st.divider()
-                    with st.expander("📅 Análisis de Rendimiento por Día de la Semana"):
-                        st.markdown("Descubre qué días son los más rentables para tu operación en el período seleccionado.")
-                        df_analisis_dia = df_filtrado.copy()
-                        df_analisis_dia['Día de la Semana'] = df_analisis_dia['Fecha'].dt.day_name().str.capitalize()
-                        dias_ordenados = ['Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo']
-                        df_analisis_dia['Día de la Semana'] = pd.Categorical(df_analisis_dia['Día de la Semana'], categories=dias_ordenados, ordered=True)
-                        df_por_dia = df_analisis_dia.groupby('Día de la Semana', observed=False).agg({'Inversión': 'sum', 'Ganancia Neta': 'sum'}).reset_index()
-                        st.subheader("Ganancia Neta por Día")
-                        st.bar_chart(df_por_dia.set_index('Día de la Semana'), y='Ganancia Neta')
-                        st.subheader("Datos Agregados por Día")
-                        st.dataframe(df_por_dia.style.format({'Inversión': "${:,.2f}", 'Ganancia Neta': "${:,.2f}"}).apply(lambda row: ['background-color: #e6ffed; color: black;' if row['Ganancia Neta'] > 0 else 'background-color: #ffe6e6; color: black;' for i in row], axis=1), use_container_width=True)
+                        df_por_oferta = df_rango_ofertas.rename(index=lambda oid: st.session_state.ofertas[oid]['nombre']).rename_axis('Oferta').groupby(level=0).sum().reset_index()
+                        st.dataframe(df_por_oferta.style.format({'Inversión': "${:,.2f}", 'Facturación Total': "${:,.2f}", 'Ganancia Neta': "${:,.2f}"}), use_container_width=True)
+                        st.bar_chart(df_por_oferta.set_index('Oferta'), y='Ganancia Neta')
+                        st.divider()
+                        with st.expander("🎯 Confianza de Anuncios en Testeo", key="exp_confianza_dashboard", on_change="rerun") as desplegable:
+                            if desplegable.open:
+                                st.markdown("Probabilidad de que cada anuncio supere el ROAS de Break-Even de su oferta, teniendo en cuenta cuánto se ha invertido en él.")
+                                df_confianza = confianza_anuncios(ids_activas, start_date_global, end_date_global)
+                                if df_confianza.empty:
+                                    st.info("No hay anuncios de testeo en el rango de fechas seleccionado.")
+                                else:
+                                    df_confianza['Oferta'] = df_confianza['id_oferta'].map(lambda oid: st.session_state.ofertas[oid]['nombre'])
+                                    df_confianza = df_confianza.rename(columns={'componente': 'Anuncio', 'inversion': 'Inversión', 'pagos_iniciados': 'Pagos Iniciados', 'ventas_pp': 'Ventas PP', 'roas_fe': 'ROAS FE', 'roas_break_even': 'ROAS Break-Even', 'probabilidad': 'P(ROAS FE > BE)'})
+                                    columnas_confianza = ['Oferta', 'Anuncio', 'Inversión', 'Pagos Iniciados', 'Ventas PP', 'ROAS FE', 'ROAS Break-Even', 'P(ROAS FE > BE)']
+                                    st.dataframe(df_confianza.sort_values('P(ROAS FE > BE)', ascending=False)[columnas_confianza].style.format({'Inversión': "${:,.2f}", 'Pagos Iniciados': "{:,.0f}", 'Ventas PP': "{:,.0f}", 'ROAS FE': "{:.2f}", 'ROAS Break-Even': "{:.2f}", 'P(ROAS FE > BE)': "{:.0%}"}), use_container_width=True, hide_index=True)
+                        with st.expander("🔎 Registros Diarios del Rango", key="exp_registros_dashboard", on_change="rerun") as desplegable:
+                            if desplegable.open:
+                                # Consulta por rango al backend: no hace falta hidratar la oferta.
+                                c1, c2 = st.columns(2)
+                                id_consulta = c1.selectbox("Oferta", ids_activas, format_func=lambda oid: st.session_state.ofertas[oid]['nombre'], key="registros_rango_oferta")
+                                anuncio_consulta = c2.selectbox("Anuncio / Componente", ["Todos"] + componentes_rollups(id_consulta), key="registros_rango_anuncio")
+                                df_registros_rango = registros_en_rango(id_consulta, start_date_global, end_date_global, None if anuncio_consulta == "Todos" else anuncio_consulta)
+                                if df_registros_rango.empty:
+                                    st.info("No hay registros de esta oferta en el rango de fechas seleccionado.")
+                                else:
+                                    df_registros_rango = df_registros_rango.drop(columns=[COLUMNA_ID_REGISTRO], errors='ignore')
+                                    df_registros_rango['segmento'] = np.where(df_registros_rango['segmento'] == 'testeos', '🧪 Testeo', '🚀 Escala')
+                                    st.dataframe(df_registros_rango.rename(columns={'segmento': 'Fase'}), use_container_width=True, hide_index=True)
+                        with st.expander("📅 Análisis de Rendimiento por Día de la Semana", key="exp_dia_semana_dashboard", on_change="rerun") as desplegable:
+                            if desplegable.open:
+                                st.markdown("Descubre qué días son los más rentables para tu operación en el período seleccionado.")
+                                df_analisis_dia = df_filtrado.copy()
+                                df_analisis_dia['Día de la Semana'] = pd.Categorical(nombres_dia_semana(df_analisis_dia['Fecha']), categories=DIAS_SEMANA, ordered=True)
+                                df_por_dia = df_analisis_dia.groupby('Día de la Semana', observed=False).agg({'Inversión': 'sum', 'Ganancia Neta': 'sum'}).reset_index()
+                                st.subheader("Ganancia Neta por Día")
+                                st.bar_chart(df_por_dia.set_index('Día de la Semana'), y='Ganancia Neta')
+                                st.subheader("Datos Agregados por Día")
+                                st.dataframe(df_por_dia.style.format({'Inversión': "${:,.2f}", 'Ganancia Neta': "${:,.2f}"}).apply(lambda row: ['background-color: #e6ffed; color: black;' if row['Ganancia Neta'] > 0 else 'background-color: #ffe6e6; color: black;' for i in row], axis=1), use_container_width=True)
+                fragmento_rango_dashboard()
 
     elif st.session_state.get('editing_record') is not None:
         # ... (código de edición de registros sin cambios) ...
@@ -975,15 +3650,11 @@ def main_app():
         is_test_record = editing_info.get('type') == 'testeo'
         
         try:
-            if is_test_record:
-                record_index = editing_info['index']
-                registro_a_editar = oferta_actual['testeos'].loc[record_index].to_dict()
-                componente_nombre = registro_a_editar['Anuncio']
-            else:
-                id_campana = editing_info['campaign_id']
-                record_index = editing_info['index']
-                registro_a_editar = oferta_actual['escala'][id_campana]['registros'].loc[record_index].to_dict()
-                componente_nombre = registro_a_editar['Componente']
+            id_campana = None if is_test_record else editing_info['campaign_id']
+            record_id = editing_info['id']
+            df_registros = obtener_registros(contenedor_registros(id_actual, id_campana), clave_registros(id_campana))
+            registro_a_editar = completar_ventas_funnel(df_registros[df_registros[COLUMNA_ID_REGISTRO] == record_id], oferta_actual['funnel']).iloc[0].to_dict()
+            componente_nombre = registro_a_editar['Anuncio' if is_test_record else 'Componente']
 
             st.header(f"✏️ Editando Registro ({'Testeo' if is_test_record else 'Escala'})")
             st.info(f"Fecha: {registro_a_editar['Fecha'].strftime('%Y-%m-%d')} | {'Anuncio' if is_test_record else 'Componente'}: {componente_nombre}")
@@ -1005,10 +3676,10 @@ def main_app():
                     registro_actualizado = {"Fecha": registro_a_editar['Fecha'], "Inversión": nuevo_inversion, **nuevas_ventas}
                     if is_test_record:
                         registro_actualizado["Anuncio"] = componente_nombre
-                        actualizar_registro_testeo(id_actual, record_index, registro_actualizado)
+                        actualizar_registro_testeo(id_actual, record_id, registro_actualizado)
                     else:
                         registro_actualizado["Componente"] = componente_nombre
-                        actualizar_registro_escala(id_actual, id_campana, record_index, registro_actualizado)
+                        actualizar_registro_escala(id_actual, id_campana, record_id, registro_actualizado)
                     st.rerun()
                 if col_cancel.form_submit_button("❌ Cancelar", type="secondary", use_container_width=True):
                     st.session_state['editing_record'] = None
@@ -1065,43 +3736,27 @@ def main_app():
     else:
         id_actual = st.session_state.oferta_seleccionada
         oferta_actual = st.session_state.ofertas[id_actual]
-        df_testeos_global = oferta_actual['testeos'].copy()
-        if not df_testeos_global.empty:
-            df_testeos_global['Fecha'] = pd.to_datetime(df_testeos_global['Fecha'])
         st.header(f"Laboratorio de Oferta: {oferta_actual['nombre']} | {oferta_actual.get('tipo_embudo', 'N/A')}")
         comision_pp = oferta_actual.get('comision_pp', 0.0)
-        inversion_testeo = df_testeos_global['Inversión'].sum()
-        facturacion_bruta_testeo = df_testeos_global['Facturación Total'].sum()
-        ventas_pp_testeo = df_testeos_global[get_safe_column_name("PP")].sum() if get_safe_column_name("PP") in df_testeos_global else 0
-        comisiones_testeo = ventas_pp_testeo * comision_pp
-        ganancia_neta_testeo = facturacion_bruta_testeo - inversion_testeo - comisiones_testeo
+        # Los KPIs salen de los rollups diarios: no se recorre el histórico de registros.
+        resumen = resumen_rollups(id_actual)
+        inversion_testeo = resumen['testeo']['inversion']
+        facturacion_bruta_testeo = resumen['testeo']['facturacion']
+        # La Ganancia Neta acumulada ya descuenta la comisión vigente en cada día.
+        ganancia_neta_testeo = resumen['testeo']['ganancia_neta']
+        comisiones_testeo = facturacion_bruta_testeo - inversion_testeo - ganancia_neta_testeo
         roas_neto_testeo = (facturacion_bruta_testeo - comisiones_testeo) / inversion_testeo if inversion_testeo > 0 else 0
-        inversion_escala = 0
-        facturacion_bruta_escala = 0
-        ventas_pp_escala = 0
-        todos_los_registros_escala = []
-        campanas_escala_global = oferta_actual.get('escala', {})
-        for campana_details in campanas_escala_global.values():
-            if 'registros' in campana_details and not campana_details['registros'].empty:
-                registros_campana = campana_details['registros']
-                inversion_escala += registros_campana['Inversión'].sum()
-                facturacion_bruta_escala += registros_campana['Facturación Total'].sum()
-                ventas_pp_escala += registros_campana[get_safe_column_name("PP")].sum() if get_safe_column_name("PP") in registros_campana else 0
-                todos_los_registros_escala.append(registros_campana)
-        comisiones_escala = ventas_pp_escala * comision_pp
-        ganancia_neta_escala = facturacion_bruta_escala - inversion_escala - comisiones_escala
+        inversion_escala = resumen['escala']['inversion']
+        facturacion_bruta_escala = resumen['escala']['facturacion']
+        ganancia_neta_escala = resumen['escala']['ganancia_neta']
+        comisiones_escala = facturacion_bruta_escala - inversion_escala - ganancia_neta_escala
         roas_neto_escala = (facturacion_bruta_escala - comisiones_escala) / inversion_escala if inversion_escala > 0 else 0
         total_inversion_global = inversion_testeo + inversion_escala
         total_facturacion_bruta_global = facturacion_bruta_testeo + facturacion_bruta_escala
         total_ganancia_neta_global = ganancia_neta_testeo + ganancia_neta_escala
         roas_neto_global = (total_facturacion_bruta_global - (comisiones_testeo + comisiones_escala)) / total_inversion_global if total_inversion_global > 0 else 0
-        dias_transcurridos_testeo = (df_testeos_global['Fecha'].max() - df_testeos_global['Fecha'].min()).days + 1 if not df_testeos_global.empty else 0
-        dias_transcurridos_escala = 0
-        if todos_los_registros_escala:
-            df_escala_completo = pd.concat(todos_los_registros_escala, ignore_index=True)
-            if not df_escala_completo.empty:
-                df_escala_completo['Fecha'] = pd.to_datetime(df_escala_completo['Fecha'])
-                dias_transcurridos_escala = (df_escala_completo['Fecha'].max() - df_escala_completo['Fecha'].min()).days + 1
+        dias_transcurridos_testeo = resumen['dias_testeo']
+        dias_transcurridos_escala = resumen['dias_escala']
         c1, c2, c3, c4, c5, c6, c7 = st.columns(7)
         c1.metric("🗓️ Días (Testeo)", f"{dias_transcurridos_testeo}")
         if dias_transcurridos_escala > 0: c2.metric("🗓️ Días (Escala)", f"{dias_transcurridos_escala}")
@@ -1114,602 +3769,669 @@ def main_app():
         c7.metric("📊 Estado", oferta_actual['estado'])
         st.divider()
 
-        tab_resumen, tab_lanzamiento, tab_funnel, tab_campanas = st.tabs(["📊 Resumen", "✅ Lanzamiento", "🛠️ Funnel", "⚔️ Campañas"])
+        # Pestañas y desplegables perezosos: con `key` + on_change="rerun" Streamlit guarda en session_state cuál
+        # está abierto y expone `.open`; sólo se construye el contenido visible, las pestañas ocultas no calculan nada.
+        tab_resumen, tab_lanzamiento, tab_funnel, tab_campanas = st.tabs(["📊 Resumen", "✅ Lanzamiento", "🛠️ Funnel", "⚔️ Campañas"], key="pestana_oferta", on_change="rerun")
         with tab_resumen:
-            # ... (código del tab resumen sin cambios) ...
-            st.subheader("Análisis General de la Oferta")
-            with st.container(border=True):
-                col_test, col_escala = st.columns(2)
-                with col_test:
-                    st.subheader("🧪 Fase de Testeo")
-                    st.metric("💵 Inversión", f"${inversion_testeo:,.2f}")
-                    st.metric("📈 Facturación Bruta", f"${facturacion_bruta_testeo:,.2f}")
-                    ganancia_color_test = "#33ff99" if ganancia_neta_testeo >= 0 else "#ff3366"
-                    st.markdown(f"**💰 Ganancia Neta**")
-                    st.markdown(f"<p style='font-size: 1.5rem; font-weight: 600; color: {ganancia_color_test};'>${ganancia_neta_testeo:,.2f}</p>", unsafe_allow_html=True)
-                    st.metric("🎯 ROAS Neto", f"{roas_neto_testeo:.2f}")
-                with col_escala:
-                    st.subheader("🚀 Fase de Escala")
-                    st.metric("💵 Inversión", f"${inversion_escala:,.2f}")
-                    st.metric("📈 Facturación Bruta", f"${facturacion_bruta_escala:,.2f}")
-                    ganancia_color_escala = "#33ff99" if ganancia_neta_escala >= 0 else "#ff3366"
-                    st.markdown(f"**💰 Ganancia Neta**")
-                    st.markdown(f"<p style='font-size: 1.5rem; font-weight: 600; color: {ganancia_color_escala};'>${ganancia_neta_escala:,.2f}</p>", unsafe_allow_html=True)
-                    st.metric("🎯 ROAS Neto", f"{roas_neto_escala:.2f}")
-            st.subheader("Configuración de la Oferta")
-            with st.container(border=True):
-                sub_tab_estado, sub_tab_config = st.tabs(["Estado de la Oferta", "Configuración Financiera"])
-                with sub_tab_estado:
-                    num_anuncios_testeados = len(oferta_actual.get('anuncios_testeo', []))
-                    if num_anuncios_testeados > 10 and roas_neto_global > 1.2 and oferta_actual['estado'] == '🧪 En Testeo':
-                        st.success(f"🎉 **Sugerencia:** ¡Esta oferta cumple los criterios para ser validada! Se han testeado {num_anuncios_testeados} anuncios y el ROAS neto global es de {roas_neto_global:.2f}.")
-                    col1, col2 = st.columns([2,1])
-                    with col1:
-                        estados_posibles = ['🧪 En Testeo', '✅ Validada', '🗄️ Archivada']
-                        estado_actual_idx = estados_posibles.index(oferta_actual['estado']) if oferta_actual['estado'] in estados_posibles else 0
-                        nuevo_estado = st.selectbox("Cambiar estado de la oferta:", options=estados_posibles, index=estado_actual_idx)
-                    if col2.button("Actualizar Estado", use_container_width=True):
-                        if nuevo_estado != oferta_actual['estado']:
-                            cambiar_estado_oferta(id_actual, nuevo_estado); st.rerun()
-                    st.divider()
-                    st.markdown("##### ⚠️ Zona de Peligro")
-                    if st.session_state.get('offer_to_delete') != id_actual:
-                        if st.button("🗑️ Eliminar Oferta Permanentemente", type="secondary", use_container_width=True):
-                            st.session_state.offer_to_delete = id_actual
-                            st.rerun()
-                    else:
-                        st.warning(f"**¿Estás seguro?** Esta acción no se puede deshacer. Se borrará toda la información de la oferta **'{oferta_actual['nombre']}'**.", icon="🚨")
-                        col_confirm, col_cancel = st.columns(2)
-                        with col_confirm:
-                            if st.button("🔴 Sí, eliminar ahora", use_container_width=True):
-                                eliminar_oferta(id_actual)
-                                st.rerun()
-                        with col_cancel:
-                            if st.button("✅ No, cancelar", use_container_width=True):
-                                st.session_state.offer_to_delete = None
-                                st.rerun()
-                with sub_tab_config:
-                    with st.form("config_financiera_form"):
-                        st.markdown("##### Define tus costos y objetivos")
-                        c1, c2, c3 = st.columns(3)
-                        comision_actual = oferta_actual.get('comision_pp', 0.0)
-                        cpa_actual = oferta_actual.get('cpa_objetivo', 0.0)
-                        nueva_comision = c1.number_input("Comisión por Venta PP ($)", value=comision_actual, min_value=0.0, format="%.2f")
-                        nuevo_cpa = c2.number_input("CPA Objetivo ($)", value=cpa_actual, min_value=0.0, format="%.2f")
-                        precio_pp = oferta_actual['funnel']['principal']['precio']
-                        ganancia_neta_pp = precio_pp - nueva_comision
-                        roas_be = precio_pp / ganancia_neta_pp if ganancia_neta_pp > 0 else 0
-                        with c3:
-                            st.write("ROAS de Break-Even")
-                            st.markdown(f"<p style='font-size: 1.75rem; font-weight: 600; color: #666;'>{roas_be:.2f}</p>", unsafe_allow_html=True)
-                        if st.form_submit_button("Guardar Configuración", use_container_width=True):
-                            actualizar_configuracion_financiera(id_actual, nueva_comision, nuevo_cpa)
-                            st.rerun()
+            if tab_resumen.open:
+                # ... (código del tab resumen sin cambios) ...
+                st.subheader("Análisis General de la Oferta")
+                with st.container(border=True):
+                    col_test, col_escala = st.columns(2)
+                    with col_test:
+                        st.subheader("🧪 Fase de Testeo")
+                        st.metric("💵 Inversión", f"${inversion_testeo:,.2f}")
+                        st.metric("📈 Facturación Bruta", f"${facturacion_bruta_testeo:,.2f}")
+                        ganancia_color_test = "#33ff99" if ganancia_neta_testeo >= 0 else "#ff3366"
+                        st.markdown(f"**💰 Ganancia Neta**")
+                        st.markdown(f"<p style='font-size: 1.5rem; font-weight: 600; color: {ganancia_color_test};'>${ganancia_neta_testeo:,.2f}</p>", unsafe_allow_html=True)
+                        st.metric("🎯 ROAS Neto", f"{roas_neto_testeo:.2f}")
+                    with col_escala:
+                        st.subheader("🚀 Fase de Escala")
+                        st.metric("💵 Inversión", f"${inversion_escala:,.2f}")
+                        st.metric("📈 Facturación Bruta", f"${facturacion_bruta_escala:,.2f}")
+                        ganancia_color_escala = "#33ff99" if ganancia_neta_escala >= 0 else "#ff3366"
+                        st.markdown(f"**💰 Ganancia Neta**")
+                        st.markdown(f"<p style='font-size: 1.5rem; font-weight: 600; color: {ganancia_color_escala};'>${ganancia_neta_escala:,.2f}</p>", unsafe_allow_html=True)
+                        st.metric("🎯 ROAS Neto", f"{roas_neto_escala:.2f}")
+                st.subheader("Configuración de la Oferta")
+                with st.container(border=True):
+                    sub_tab_estado, sub_tab_config = st.tabs(["Estado de la Oferta", "Configuración Financiera"], key="pestana_resumen_oferta", on_change="rerun")
+                    with sub_tab_estado:
+                        if sub_tab_estado.open:
+                            num_anuncios_testeados = len(oferta_actual.get('anuncios_testeo', []))
+                            if num_anuncios_testeados > 10 and roas_neto_global > 1.2 and oferta_actual['estado'] == '🧪 En Testeo':
+                                st.success(f"🎉 **Sugerencia:** ¡Esta oferta cumple los criterios para ser validada! Se han testeado {num_anuncios_testeados} anuncios y el ROAS neto global es de {roas_neto_global:.2f}.")
+                            col1, col2 = st.columns([2,1])
+                            with col1:
+                                estados_posibles = ['🧪 En Testeo', '✅ Validada', '🗄️ Archivada']
+                                estado_actual_idx = estados_posibles.index(oferta_actual['estado']) if oferta_actual['estado'] in estados_posibles else 0
+                                nuevo_estado = st.selectbox("Cambiar estado de la oferta:", options=estados_posibles, index=estado_actual_idx)
+                            if col2.button("Actualizar Estado", use_container_width=True):
+                                if nuevo_estado != oferta_actual['estado']:
+                                    cambiar_estado_oferta(id_actual, nuevo_estado); st.rerun()
+                            st.divider()
+                            st.markdown("##### ⚠️ Zona de Peligro")
+                            if st.session_state.get('offer_to_delete') != id_actual:
+                                if st.button("🗑️ Eliminar Oferta Permanentemente", type="secondary", use_container_width=True):
+                                    st.session_state.offer_to_delete = id_actual
+                                    st.rerun()
+                            else:
+                                st.warning(f"**¿Estás seguro?** Esta acción no se puede deshacer. Se borrará toda la información de la oferta **'{oferta_actual['nombre']}'**.", icon="🚨")
+                                col_confirm, col_cancel = st.columns(2)
+                                with col_confirm:
+                                    if st.button("🔴 Sí, eliminar ahora", use_container_width=True):
+                                        eliminar_oferta(id_actual)
+                                        st.rerun()
+                                with col_cancel:
+                                    if st.button("✅ No, cancelar", use_container_width=True):
+                                        st.session_state.offer_to_delete = None
+                                        st.rerun()
+                    with sub_tab_config:
+                        if sub_tab_config.open:
+                            with st.form("config_financiera_form"):
+                                st.markdown("##### Define tus costos y objetivos")
+                                c1, c2, c3 = st.columns(3)
+                                comision_actual = oferta_actual.get('comision_pp', 0.0)
+                                cpa_actual = oferta_actual.get('cpa_objetivo', 0.0)
+                                nueva_comision = c1.number_input("Comisión por Venta PP ($)", value=comision_actual, min_value=0.0, format="%.2f")
+                                nuevo_cpa = c2.number_input("CPA Objetivo ($)", value=cpa_actual, min_value=0.0, format="%.2f")
+                                precio_pp = oferta_actual['funnel']['principal']['precio']
+                                ganancia_neta_pp = precio_pp - nueva_comision
+                                roas_be = precio_pp / ganancia_neta_pp if ganancia_neta_pp > 0 else 0
+                                with c3:
+                                    st.write("ROAS de Break-Even")
+                                    st.markdown(f"<p style='font-size: 1.75rem; font-weight: 600; color: #666;'>{roas_be:.2f}</p>", unsafe_allow_html=True)
+                                vigente_desde = st.date_input("Vigente desde", datetime.date.today(), key="config_vigente_desde", help="Los registros a partir de esta fecha se valoran con la nueva comisión.")
+                                if st.form_submit_button("Guardar Configuración", use_container_width=True):
+                                    actualizar_configuracion_financiera(id_actual, nueva_comision, nuevo_cpa, vigente_desde.strftime('%Y-%m-%d'))
+                                    st.rerun()
+                            historial_tarifas = oferta_actual.get('historial_tarifas') or []
+                            if historial_tarifas:
+                                st.markdown("##### Historial de Tarifas")
+                                aliases = {item_id: v['alias'] for item_id, v in oferta_actual['funnel'].items()}
+                                st.dataframe(pd.DataFrame([
+                                    {'Vigente desde': e['desde'], 'Comisión PP': e.get('comision_pp'), 'CPA Objetivo': e.get('cpa_objetivo'),
+                                     **{f"Precio {aliases[k]}": p for k, p in e.get('precios', {}).items() if k in aliases}}
+                                    for e in historial_tarifas]), use_container_width=True, hide_index=True)
+                            with st.form("umbrales_sugerencias_form"):
+                                st.markdown("##### Umbrales de Sugerencias de Anuncios")
+                                umbrales = umbrales_sugerencias(oferta_actual)
+                                st.caption("P>BE es la probabilidad estimada de que el anuncio supere el ROAS de Break-Even, según su inversión, pagos iniciados y ventas PP.")
+                                u1, u2, u3, u4, u5 = st.columns(5)
+                                prob_apagar = u1.number_input("Apagar si P>BE <", value=float(umbrales['prob_apagar']), min_value=0.0, max_value=1.0, format="%.2f")
+                                roas_apagar = u2.number_input("...y ROAS Neto <", value=float(umbrales['roas_apagar']), min_value=0.0, format="%.2f")
+                                prob_ganador = u3.number_input("Ganador si P>BE ≥", value=float(umbrales['prob_ganador']), min_value=0.0, max_value=1.0, format="%.2f")
+                                roas_ganador = u4.number_input("...y ROAS Neto ≥", value=float(umbrales['roas_ganador']), min_value=0.0, format="%.2f")
+                                racha_ganador = u5.number_input("...y racha de días con venta ≥", value=int(umbrales['racha_ganador']), min_value=1, step=1)
+                                if st.form_submit_button("Guardar Umbrales", use_container_width=True):
+                                    actualizar_umbrales_sugerencias(id_actual, {'prob_apagar': prob_apagar, 'roas_apagar': roas_apagar, 'prob_ganador': prob_ganador, 'roas_ganador': roas_ganador, 'racha_ganador': int(racha_ganador)})
+                                    st.rerun()
+                            if st.button("🔄 Recalcular métricas históricas", help="Vuelve a calcular Facturación, Ganancia y ROAS de todos los registros con las tarifas vigentes en cada fecha."):
+                                cambiados = recalcular_oferta(id_actual)
+                                st.success(f"Métricas recalculadas: {cambiados} registros actualizados.")
         with tab_lanzamiento:
-            # ... (código del tab lanzamiento sin cambios) ...
-            editing_checklist = st.session_state.get('editing_checklist_oferta_id') == id_actual
-            checklist_data = oferta_actual.get('checklist')
+            if tab_lanzamiento.open:
+                # ... (código del tab lanzamiento sin cambios) ...
+                @st.fragment
+                def fragmento_checklist():
+                    # Marcar una tarea sólo redibuja el checklist.
+                    oferta_actual = st.session_state.ofertas[id_actual]
+                    editing_checklist = st.session_state.get('editing_checklist_oferta_id') == id_actual
+                    checklist_data = oferta_actual.get('checklist')
 
-            if not checklist_data:
-                st.subheader("Asignar un Plan de Lanzamiento")
-                st.info("Esta oferta aún no tiene un checklist. Selecciona una de tus plantillas guardadas para asignarle un plan de acción.")
+                    if not checklist_data:
+                        st.subheader("Asignar un Plan de Lanzamiento")
+                        st.info("Esta oferta aún no tiene un checklist. Selecciona una de tus plantillas guardadas para asignarle un plan de acción.")
                 
-                plantillas_disponibles = {"ninguna": "Selecciona una plantilla..."}
-                for pid, pdata in st.session_state.plantillas.items():
-                    plantillas_disponibles[pid] = pdata['nombre']
+                        plantillas_disponibles = {"ninguna": "Selecciona una plantilla..."}
+                        for pid, pdata in st.session_state.plantillas.items():
+                            plantillas_disponibles[pid] = pdata['nombre']
                 
-                if len(plantillas_disponibles) > 1:
-                    plantilla_a_asignar = st.selectbox("Plantillas Disponibles", options=list(plantillas_disponibles.keys()), format_func=lambda x: plantillas_disponibles[x])
-                    if st.button("Asignar Plantilla a esta Oferta", use_container_width=True, type="primary"):
-                        if plantilla_a_asignar != "ninguna":
-                            plantilla = st.session_state.plantillas[plantilla_a_asignar]
-                            st.session_state.ofertas[id_actual]['checklist'] = {
-                                "plantilla_nombre": plantilla['nombre'],
-                                "tareas": parse_checklist(plantilla['checklist_raw'])
-                            }
-                            save_data_to_firestore()
-                            st.success("¡Checklist asignado con éxito!")
-                            st.rerun()
+                        if len(plantillas_disponibles) > 1:
+                            plantilla_a_asignar = st.selectbox("Plantillas Disponibles", options=list(plantillas_disponibles.keys()), format_func=lambda x: plantillas_disponibles[x])
+                            if st.button("Asignar Plantilla a esta Oferta", use_container_width=True, type="primary"):
+                                if plantilla_a_asignar != "ninguna":
+                                    plantilla = st.session_state.plantillas[plantilla_a_asignar]
+                                    st.session_state.ofertas[id_actual]['checklist'] = {
+                                        "plantilla_nombre": plantilla['nombre'],
+                                        "tareas": parse_checklist(plantilla['checklist_raw'])
+                                    }
+                                    registrar_cambio('ofertas', id_actual, 'checklist')
+                                    save_data_to_firestore()
+                                    st.success("¡Checklist asignado con éxito!")
+                                    st.rerun()
+                                else:
+                                    st.warning("Por favor, selecciona una plantilla válida.")
                         else:
-                            st.warning("Por favor, selecciona una plantilla válida.")
-                else:
-                    st.warning("No has creado ninguna plantilla de lanzamiento. Ve a '✅ Plantillas de Proyectos' en la barra lateral para crear tu primera plantilla.")
+                            st.warning("No has creado ninguna plantilla de lanzamiento. Ve a '✅ Plantillas de Proyectos' en la barra lateral para crear tu primera plantilla.")
             
-            elif editing_checklist:
-                st.subheader(f"✏️ Editando Checklist: {checklist_data['plantilla_nombre']}")
-                with st.form("form_edit_checklist"):
-                    current_raw_text = unparse_checklist(checklist_data['tareas'])
-                    new_raw_text = st.text_area("Fases y Tareas", value=current_raw_text, height=300)
-                    edit_btn_col1, edit_btn_col2 = st.columns(2)
-                    if edit_btn_col1.form_submit_button("💾 Guardar Cambios", use_container_width=True):
-                        new_tasks = merge_checklists(checklist_data['tareas'], new_raw_text)
-                        st.session_state.ofertas[id_actual]['checklist']['tareas'] = new_tasks
-                        save_data_to_firestore()
-                        st.session_state.editing_checklist_oferta_id = None
-                        st.success("Checklist actualizado.")
-                        st.rerun()
-                    if edit_btn_col2.form_submit_button("❌ Cancelar", use_container_width=True, type="secondary"):
-                        st.session_state.editing_checklist_oferta_id = None
-                        st.rerun()
-            else: # Vista normal del checklist
-                st.subheader(f"Progreso del Lanzamiento: {checklist_data['plantilla_nombre']}")
-                tareas = checklist_data.get('tareas', [])
-                total_tasks = sum(1 for item in tareas if item['type'] == 'task')
-                completed_tasks = sum(1 for item in tareas if item['type'] == 'task' and item['completed'])
-                progress = (completed_tasks / total_tasks) if total_tasks > 0 else 0
-                st.progress(progress)
-                st.metric("Progreso Total", f"{completed_tasks} / {total_tasks} Tareas Completadas", f"{progress:.0%}")
-                st.button("✏️ Editar Checklist", on_click=lambda: st.session_state.update(editing_checklist_oferta_id=id_actual))
-                st.divider()
-                for i, item in enumerate(tareas):
-                    if item['type'] == 'phase':
-                        st.subheader(item['text'], divider='rainbow')
-                    elif item['type'] == 'task':
-                        is_checked = st.checkbox(item['text'], value=item['completed'], key=f"task_{id_actual}_{i}")
-                        if is_checked != item['completed']:
-                            st.session_state.ofertas[id_actual]['checklist']['tareas'][i]['completed'] = is_checked
-                            save_data_to_firestore()
-                            st.rerun()
-        with tab_funnel:
-            # ... (código del tab funnel sin cambios) ...
-            st.subheader("Añadir Nuevos Elementos al Funnel")
-            c1, c2, c3 = st.columns(3)
-            with c1:
-                with st.form(f"form_bump_{id_actual}", clear_on_submit=True):
-                    st.markdown("**Añadir Order Bump**"); nombre = st.text_input("Nombre")
-                    precio = st.number_input("Precio ($)", min_value=0.01, format="%.2f")
-                    if st.form_submit_button("Añadir Bump"):
-                        if nombre and precio: agregar_item_funnel(id_actual, "Bump", nombre, precio); st.rerun()
-            with c2:
-                with st.form(f"form_upsell_{id_actual}", clear_on_submit=True):
-                    st.markdown("**Añadir Upsell**"); nombre = st.text_input("Nombre")
-                    precio = st.number_input("Precio ($)", min_value=0.01, format="%.2f")
-                    if st.form_submit_button("Añadir Upsell"):
-                        if nombre and precio: agregar_item_funnel(id_actual, "Upsell", nombre, precio); st.rerun()
-            with c3:
-                with st.form(f"form_downsell_{id_actual}", clear_on_submit=True):
-                    st.markdown("**Añadir Downsell**"); nombre = st.text_input("Nombre")
-                    precio = st.number_input("Precio ($)", min_value=0.01, format="%.2f")
-                    if st.form_submit_button("Añadir Downsell"):
-                        if nombre and precio: agregar_item_funnel(id_actual, "Downsell", nombre, precio); st.rerun()
-            st.divider()
-            st.subheader("Gestionar Elementos del Funnel")
-            for item_id, item_details in oferta_actual['funnel'].items():
-                if item_id == 'principal': continue
-                col1, col2 = st.columns([3, 1])
-                col1.text(f"{item_details['estado']} {item_details['alias']} - {item_details['nombre']}: ${item_details['precio']:.2f}")
-                button_text = "📁 Archivar" if item_details['estado'] == "🟢 Activo" else "✅ Activar"
-                if col2.button(button_text, key=f"btn_toggle_{item_id}"):
-                    toggle_estado_funnel_item(id_actual, item_id); st.rerun()
-        with tab_campanas:
-            # ... (código del tab campañas con las mejoras) ...
-            sub_tab_test, sub_tab_escala, sub_tab_analisis = st.tabs(["🧪 Fase de Testeo", "🚀 Fase de Escala", "🔬 Análisis Global del Funnel"])
-            with sub_tab_test:
-                # ... (código de sub_tab_test sin cambios) ...
-                st.subheader("1. Registro de Datos de Testeo")
-                col1, col2 = st.columns(2)
-                with col1:
-                    with st.form(f"form_add_anuncio_{id_actual}", clear_on_submit=True):
-                        nombre_anuncio = st.text_input("Nombre del Anuncio (Ej: V1-CopyA-CreativoB)")
-                        if st.form_submit_button("Añadir Anuncio"): 
-                            agregar_anuncio_testeo(id_actual, nombre_anuncio)
-                with col2:
-                    anuncios_activos = [ad['nombre'] for ad in oferta_actual['anuncios_testeo'] if ad['estado'] == "🟢 Activo"]
-                    if not anuncios_activos: st.info("Añade un anuncio para registrar datos.")
-                    else:
-                        with st.form(f"form_log_data_{id_actual}", clear_on_submit=True):
-                            fecha = st.date_input("Fecha", datetime.date.today())
-                            anuncio_sel = st.selectbox("Anuncio (Sólo Activos)", options=anuncios_activos)
-                            inversion = st.number_input("Inversión ($)", min_value=0.0, format="%.2f")
-                            st.markdown("**Resultados de Ventas**")
-                            funnel_activo = {k: v for k, v in oferta_actual['funnel'].items() if v['estado'] == "🟢 Activo"}
-                            form_cols = st.columns(len(funnel_activo) + 1)
-                            ventas_data = {}
-                            ventas_data['Pagos Iniciados'] = form_cols[0].number_input("Pagos Iniciados", min_value=0, step=1)
-                            i=1
-                            for item_details in funnel_activo.values():
-                                col_name = get_safe_column_name(item_details['alias'])
-                                ventas_data[col_name] = form_cols[i].number_input(item_details['alias'], min_value=0, step=1)
-                                i+=1
-                            if st.form_submit_button("💾 Guardar Registro Diario", use_container_width=True):
-                                nuevo_registro = {"Fecha": fecha, "Anuncio": anuncio_sel, "Inversión": inversion, **ventas_data}
-                                registro_calculado = calcular_metricas_diarias(nuevo_registro, oferta_actual['funnel'], oferta_actual.get('comision_pp', 0.0))
-                                df_nuevo = pd.DataFrame([registro_calculado])
-                                oferta_actual['testeos'] = pd.concat([oferta_actual['testeos'], df_nuevo], ignore_index=True)
+                    elif editing_checklist:
+                        st.subheader(f"✏️ Editando Checklist: {checklist_data['plantilla_nombre']}")
+                        with st.form("form_edit_checklist"):
+                            current_raw_text = unparse_checklist(checklist_data['tareas'])
+                            new_raw_text = st.text_area("Fases y Tareas", value=current_raw_text, height=300)
+                            edit_btn_col1, edit_btn_col2 = st.columns(2)
+                            if edit_btn_col1.form_submit_button("💾 Guardar Cambios", use_container_width=True):
+                                new_tasks = merge_checklists(checklist_data['tareas'], new_raw_text)
+                                st.session_state.ofertas[id_actual]['checklist']['tareas'] = new_tasks
+                                registrar_cambio('ofertas', id_actual, 'checklist', 'tareas')
                                 save_data_to_firestore()
+                                st.session_state.editing_checklist_oferta_id = None
+                                st.success("Checklist actualizado.")
+                                st.rerun()
+                            if edit_btn_col2.form_submit_button("❌ Cancelar", use_container_width=True, type="secondary"):
+                                st.session_state.editing_checklist_oferta_id = None
                                 st.rerun()
+                    else: # Vista normal del checklist
+                        st.subheader(f"Progreso del Lanzamiento: {checklist_data['plantilla_nombre']}")
+                        tareas = items_checklist(checklist_data.get('tareas', []))
+                        total_tasks = sum(1 for _, item in tareas if item['type'] == 'task')
+                        completed_tasks = sum(1 for _, item in tareas if item['type'] == 'task' and item['completed'])
+                        progress = (completed_tasks / total_tasks) if total_tasks > 0 else 0
+                        st.progress(progress)
+                        st.metric("Progreso Total", f"{completed_tasks} / {total_tasks} Tareas Completadas", f"{progress:.0%}")
+                        st.button("✏️ Editar Checklist", on_click=lambda: st.session_state.update(editing_checklist_oferta_id=id_actual))
+                        st.divider()
+                        for id_tarea, item in tareas:
+                            if item['type'] == 'phase':
+                                st.subheader(item['text'], divider='rainbow')
+                            elif item['type'] == 'task':
+                                key = f"task_{id_actual}_{id_tarea}"
+                                st.checkbox(item['text'], value=item['completed'], key=key, on_change=update_tarea_checklist, args=(id_actual, id_tarea, key))
+
+                fragmento_checklist()
+        with tab_funnel:
+            if tab_funnel.open:
+                # ... (código del tab funnel sin cambios) ...
+                st.subheader("Añadir Nuevos Elementos al Funnel")
+                c1, c2, c3 = st.columns(3)
+                with c1:
+                    with st.form(f"form_bump_{id_actual}", clear_on_submit=True):
+                        st.markdown("**Añadir Order Bump**"); nombre = st.text_input("Nombre")
+                        precio = st.number_input("Precio ($)", min_value=0.01, format="%.2f")
+                        if st.form_submit_button("Añadir Bump"):
+                            if nombre and precio: agregar_item_funnel(id_actual, "Bump", nombre, precio); st.rerun()
+                with c2:
+                    with st.form(f"form_upsell_{id_actual}", clear_on_submit=True):
+                        st.markdown("**Añadir Upsell**"); nombre = st.text_input("Nombre")
+                        precio = st.number_input("Precio ($)", min_value=0.01, format="%.2f")
+                        if st.form_submit_button("Añadir Upsell"):
+                            if nombre and precio: agregar_item_funnel(id_actual, "Upsell", nombre, precio); st.rerun()
+                with c3:
+                    with st.form(f"form_downsell_{id_actual}", clear_on_submit=True):
+                        st.markdown("**Añadir Downsell**"); nombre = st.text_input("Nombre")
+                        precio = st.number_input("Precio ($)", min_value=0.01, format="%.2f")
+                        if st.form_submit_button("Añadir Downsell"):
+                            if nombre and precio: agregar_item_funnel(id_actual, "Downsell", nombre, precio); st.rerun()
                 st.divider()
-                st.subheader("2. Panel de Rendimiento por Anuncio")
-                if df_testeos_global.empty: st.info("Aún no hay datos para analizar.")
-                else:
-                    c1, c2 = st.columns(2)
-                    start_date = c1.date_input("Fecha Inicio", df_testeos_global['Fecha'].min().date(), key="start_analisis")
-                    end_date = c2.date_input("Fecha Fin", df_testeos_global['Fecha'].max().date(), key="end_analisis")
-                    df_filtrado_diario = df_testeos_global[(df_testeos_global['Fecha'].dt.date >= start_date) & (df_testeos_global['Fecha'].dt.date <= end_date)]
-                    if not df_filtrado_diario.empty:
-                        df_agrupado = df_filtrado_diario.groupby("Anuncio").agg({'Inversión': 'sum', 'Pagos Iniciados': 'sum', 'Facturación Total': 'sum', 'Ganancia Neta': 'sum', **{get_safe_column_name(v['alias']): 'sum' for v in oferta_actual['funnel'].values() if get_safe_column_name(v['alias']) in df_filtrado_diario}}).reset_index()
-                        precio_pp = oferta_actual['funnel']['principal']['precio']
-                        ventas_pp_col = get_safe_column_name("PP")
-                        df_agrupado['CPA'] = df_agrupado.apply(lambda row: row['Inversión'] / row[ventas_pp_col] if ventas_pp_col in row and row[ventas_pp_col] > 0 else 0, axis=1)
-                        df_agrupado['Facturación FE'] = df_agrupado.apply(lambda row: row[ventas_pp_col] * precio_pp if ventas_pp_col in row else 0, axis=1)
-                        df_agrupado['ROAS FE'] = df_agrupado.apply(lambda row: row['Facturación FE'] / row['Inversión'] if 'Facturación FE' in row and row['Inversión'] > 0 else 0, axis=1)
-                        df_agrupado['ROAS Total (Neto)'] = df_agrupado.apply(lambda row: (row['Facturación Total'] - (row[ventas_pp_col] * comision_pp)) / row['Inversión'] if row['Inversión'] > 0 else 0, axis=1)
+                st.subheader("Gestionar Elementos del Funnel")
+                for item_id, item_details in oferta_actual['funnel'].items():
+                    if item_id == 'principal': continue
+                    col1, col2 = st.columns([3, 1])
+                    col1.text(f"{item_details['estado']} {item_details['alias']} - {item_details['nombre']}: ${item_details['precio']:.2f}")
+                    button_text = "📁 Archivar" if item_details['estado'] == "🟢 Activo" else "✅ Activar"
+                    if col2.button(button_text, key=f"btn_toggle_{item_id}"):
+                        toggle_estado_funnel_item(id_actual, item_id); st.rerun()
+                st.divider()
+                st.subheader("Editar Precios")
+                with st.form(f"form_precios_{id_actual}"):
+                    st.caption("Los nuevos precios se aplican a los registros desde la fecha indicada; al guardar se recalculan las métricas afectadas.")
+                    items_funnel = list(oferta_actual['funnel'].items())
+                    cols_precios = st.columns(min(len(items_funnel), 4))
+                    nuevos_precios = {}
+                    for i, (item_id, item_details) in enumerate(items_funnel):
+                        nuevos_precios[item_id] = cols_precios[i % len(cols_precios)].number_input(
+                            f"{item_details['alias']} - {item_details['nombre']} ($)", value=float(item_details['precio']),
+                            min_value=0.01, format="%.2f", key=f"precio_{id_actual}_{item_id}")
+                    precios_desde = st.date_input("Vigente desde", datetime.date.today(), key=f"precios_desde_{id_actual}")
+                    if st.form_submit_button("Guardar Precios", use_container_width=True):
+                        actualizar_precios_funnel(id_actual, nuevos_precios, precios_desde.strftime('%Y-%m-%d'))
+                        st.rerun()
+        with tab_campanas:
+            if tab_campanas.open:
+                # Sólo esta pestaña usa los testeos. Ordenada una vez por fecha, los filtros de rango de
+                # cada panel son búsquedas binarias; ni aplicar_esquema ni ordenar_por_fecha copian si no hace falta.
+                df_testeos_global = ordenar_por_fecha(aplicar_esquema(obtener_registros(oferta_actual, 'testeos')))
+                # ... (código del tab campañas con las mejoras) ...
+                sub_tab_test, sub_tab_escala, sub_tab_analisis = st.tabs(["🧪 Fase de Testeo", "🚀 Fase de Escala", "🔬 Análisis Global del Funnel"], key="pestana_campanas_oferta", on_change="rerun")
+                with sub_tab_test:
+                    if sub_tab_test.open:
+                        # ... (código de sub_tab_test sin cambios) ...
+                        st.subheader("1. Registro de Datos de Testeo")
+                        col1, col2 = st.columns(2)
+                        with col1:
+                            with st.form(f"form_add_anuncio_{id_actual}", clear_on_submit=True):
+                                nombre_anuncio = st.text_input("Nombre del Anuncio (Ej: V1-CopyA-CreativoB)")
+                                if st.form_submit_button("Añadir Anuncio"): 
+                                    agregar_anuncio_testeo(id_actual, nombre_anuncio)
+                        with col2:
+                            anuncios_activos = [ad['nombre'] for ad in oferta_actual['anuncios_testeo'] if ad['estado'] == "🟢 Activo"]
+                            if not anuncios_activos: st.info("Añade un anuncio para registrar datos.")
+                            else:
+                                with st.form(f"form_log_data_{id_actual}", clear_on_submit=True):
+                                    fecha = st.date_input("Fecha", datetime.date.today())
+                                    anuncio_sel = st.selectbox("Anuncio (Sólo Activos)", options=anuncios_activos)
+                                    inversion = st.number_input("Inversión ($)", min_value=0.0, format="%.2f")
+                                    st.markdown("**Resultados de Ventas**")
+                                    funnel_activo = {k: v for k, v in oferta_actual['funnel'].items() if v['estado'] == "🟢 Activo"}
+                                    form_cols = st.columns(len(funnel_activo) + 1)
+                                    ventas_data = {}
+                                    ventas_data['Pagos Iniciados'] = form_cols[0].number_input("Pagos Iniciados", min_value=0, step=1)
+                                    i=1
+                                    for item_details in funnel_activo.values():
+                                        col_name = get_safe_column_name(item_details['alias'])
+                                        ventas_data[col_name] = form_cols[i].number_input(item_details['alias'], min_value=0, step=1)
+                                        i+=1
+                                    if st.form_submit_button("💾 Guardar Registro Diario", use_container_width=True):
+                                        nuevo_registro = {"Fecha": fecha, "Anuncio": anuncio_sel, "Inversión": inversion, **ventas_data}
+                                        registro_calculado = calcular_metricas_diarias(nuevo_registro, oferta_actual)
+                                        anexar_registro(id_actual, None, registro_calculado)
+                                        save_data_to_firestore()
+                                        st.rerun()
+                        with st.expander("📥 Importación masiva de exportaciones (CSV / Parquet)", key="exp_importacion_testeo", on_change="rerun") as desplegable:
+                            if desplegable.open:
+                                mostrar_importador_registros(id_actual)
+                        st.divider()
+                        @st.fragment
+                        def fragmento_panel_anuncios():
+                            # Cambiar fechas o filtros del panel no vuelve a calcular la cabecera ni el resto de pestañas.
+                            st.subheader("2. Panel de Rendimiento por Anuncio")
+                            if df_testeos_global.empty: st.info("Aún no hay datos para analizar.")
+                            else:
+                                c1, c2 = st.columns(2)
+                                start_date = c1.date_input("Fecha Inicio", df_testeos_global['Fecha'].min().date(), key="start_analisis")
+                                end_date = c2.date_input("Fecha Fin", df_testeos_global['Fecha'].max().date(), key="end_analisis")
+                                df_filtrado_diario = filtrar_por_fechas(df_testeos_global, start_date, end_date)
+                                if not df_filtrado_diario.empty:
+                                    metricas_panel = ['Inversión', 'Pagos Iniciados', 'Facturación Total', 'Ganancia Neta', 'Facturación FE'] + [get_safe_column_name(v['alias']) for v in oferta_actual['funnel'].values()]
+                                    cubo_anuncios = memorizar_por_version((id_actual, 'anuncios'), version_oferta(id_actual), lambda: CuboAcumulado.desde_df(df_testeos_global.assign(**{'Facturación FE': facturacion_fe(df_testeos_global, oferta_actual)}), metricas_panel, clave='Anuncio'))
+                                    df_agrupado = cubo_anuncios.rango(start_date, end_date).rename_axis('Anuncio').reset_index()
+                                    ventas_pp_col = get_safe_column_name("PP")
+                                    df_agrupado = calcular_metricas_df(df_agrupado, oferta_actual['funnel'], comision_pp, diarias=False)
                         
-                        mapa_estados = {ad['nombre']: ad['estado'] for ad in oferta_actual['anuncios_testeo']}
-                        df_agrupado['Estado'] = df_agrupado['Anuncio'].map(mapa_estados)
-                        sugerencias_globales = analizar_sugerencias_anuncios(df_testeos_global)
-                        df_agrupado['Sugerencia'] = df_agrupado['Anuncio'].map(sugerencias_globales)
-                        st.markdown("##### Rendimiento Agregado del Período")
-                        mostrar_solo_activos = st.checkbox("Mostrar solo anuncios activos", value=True, key="cb_testeo_activos")
-                        df_para_mostrar = df_agrupado.copy()
-                        if mostrar_solo_activos:
-                            df_para_mostrar = df_para_mostrar[df_para_mostrar['Estado'] == "🟢 Activo"]
-                        def color_roas(val):
-                            color = 'inherit'
-                            if val >= 1.7: color = '#33ff99'
-                            elif val < 1.2: color = '#ff3366'
-                            return f'color: {color}'
-                        def color_ganancia(val):
-                            color = 'inherit'
-                            if val > 0: color = '#33ff99'
-                            elif val < 0: color = '#ff3366'
-                            return f'color: {color}'
+                                    mapa_estados = {ad['nombre']: ad['estado'] for ad in oferta_actual['anuncios_testeo']}
+                                    df_agrupado['Estado'] = df_agrupado['Anuncio'].map(mapa_estados)
+                                    sugerencias_globales = analizar_sugerencias_anuncios(id_actual, df_testeos_global)
+                                    df_agrupado['Sugerencia'] = df_agrupado['Anuncio'].map(sugerencias_globales)
+                                    st.markdown("##### Rendimiento Agregado del Período")
+                                    mostrar_solo_activos = st.checkbox("Mostrar solo anuncios activos", value=True, key="cb_testeo_activos")
+                                    df_para_mostrar = df_agrupado.copy()
+                                    if mostrar_solo_activos:
+                                        df_para_mostrar = df_para_mostrar[df_para_mostrar['Estado'] == "🟢 Activo"]
+                                    umbrales_color = umbrales_sugerencias(oferta_actual)
+                                    def color_roas(val):
+                                        color = 'inherit'
+                                        if val >= umbrales_color['roas_ganador']: color = '#33ff99'
+                                        elif val < umbrales_color['roas_apagar']: color = '#ff3366'
+                                        return f'color: {color}'
+                                    def color_ganancia(val):
+                                        color = 'inherit'
+                                        if val > 0: color = '#33ff99'
+                                        elif val < 0: color = '#ff3366'
+                                        return f'color: {color}'
                         
-                        cols_display_order = ['Anuncio', 'Estado', 'Inversión', 'Ganancia Neta', ventas_pp_col]
-                        cols_rename_map = {ventas_pp_col: 'Ventas PP', 'Ganancia Neta': 'Ganancia Neta'}
-                        for alias in [v['alias'] for k, v in oferta_actual['funnel'].items() if k != 'principal']:
-                            col_name = get_safe_column_name(alias)
-                            if col_name in df_para_mostrar.columns:
-                                cols_display_order.append(col_name); cols_rename_map[col_name] = f"Ventas {alias}"
-                        cols_display_order.extend(['CPA', 'ROAS FE', 'ROAS Total (Neto)', 'Sugerencia'])
-                        final_cols_to_show = [col for col in cols_display_order if col in df_para_mostrar.columns]
+                                    cols_display_order = ['Anuncio', 'Estado', 'Inversión', 'Ganancia Neta', ventas_pp_col]
+                                    cols_rename_map = {ventas_pp_col: 'Ventas PP', 'Ganancia Neta': 'Ganancia Neta'}
+                                    for alias in [v['alias'] for k, v in oferta_actual['funnel'].items() if k != 'principal']:
+                                        col_name = get_safe_column_name(alias)
+                                        if col_name in df_para_mostrar.columns:
+                                            cols_display_order.append(col_name); cols_rename_map[col_name] = f"Ventas {alias}"
+                                    cols_display_order.extend(['CPA', 'ROAS FE', 'ROAS Total (Neto)', 'Sugerencia'])
+                                    final_cols_to_show = [col for col in cols_display_order if col in df_para_mostrar.columns]
                         
-                        if df_para_mostrar.empty:
-                            st.info("No hay anuncios que cumplan con el filtro actual. Desmarca la casilla para ver todos.")
-                        else:
-                            df_display = df_para_mostrar[final_cols_to_show].rename(columns=cols_rename_map)
-                            st.dataframe(df_display.style.apply(lambda x: x.map(color_roas), subset=['ROAS FE', 'ROAS Total (Neto)']).apply(lambda x: x.map(color_ganancia), subset=['Ganancia Neta']).format({'Inversión': "${:,.2f}", 'Ganancia Neta': "${:,.2f}", 'CPA': "${:,.2f}", 'ROAS FE': "{:.2f}", 'ROAS Total (Neto)': "{:.2f}"}), use_container_width=True)
+                                    if df_para_mostrar.empty:
+                                        st.info("No hay anuncios que cumplan con el filtro actual. Desmarca la casilla para ver todos.")
+                                    else:
+                                        df_display = df_para_mostrar[final_cols_to_show].rename(columns=cols_rename_map)
+                                        st.dataframe(df_display.style.apply(lambda x: x.map(color_roas), subset=['ROAS FE', 'ROAS Total (Neto)']).apply(lambda x: x.map(color_ganancia), subset=['Ganancia Neta']).format({'Inversión': "${:,.2f}", 'Ganancia Neta': "${:,.2f}", 'CPA': "${:,.2f}", 'ROAS FE': "{:.2f}", 'ROAS Total (Neto)': "{:.2f}"}), use_container_width=True)
                         
-                        st.markdown("---")
-                        st.subheader("3. Acciones y Desglose")
-                        c1, c2 = st.columns(2)
-                        with c1:
-                            st.markdown("**Gestión de Estado de Anuncios**")
-                            anuncio_a_gestionar = st.selectbox("Seleccionar Anuncio", options=[ad['nombre'] for ad in oferta_actual['anuncios_testeo']], key="sb_gestionar_anuncio")
-                            if st.button(f"Cambiar Estado de '{anuncio_a_gestionar}'"): toggle_estado_anuncio(id_actual, anuncio_a_gestionar); st.rerun()
-                        with c2:
-                            st.markdown("**Ver Desglose Diario**")
-                            anuncio_a_desglosar = st.selectbox("Seleccionar Anuncio", options=df_agrupado['Anuncio'].unique(), key="sb_desglosar_anuncio")
-                            if anuncio_a_desglosar:
-                                with st.expander(f"Desglose para '{anuncio_a_desglosar}'"):
-                                    df_desglose = df_filtrado_diario[df_filtrado_diario['Anuncio'] == anuncio_a_desglosar].copy().reset_index()
-                                    for idx, row in df_desglose.iterrows():
-                                        st.write(f"**Fecha:** {row['Fecha'].strftime('%Y-%m-%d')} | **Inversión:** ${row['Inversión']:.2f} | **Ganancia Neta:** ${row['Ganancia Neta']:.2f} | **ROAS Neto:** {row['ROAS Neto']:.2f}")
-                                        action_col1, action_col2 = st.columns([1,1])
-                                        if action_col1.button("✏️ Editar", key=f"edit_{row['index']}"):
-                                            st.session_state['editing_record'] = {'type': 'testeo', 'index': row['index']}
-                                            st.rerun()
-                                        if action_col2.button("🗑️ Eliminar", key=f"del_{row['index']}"):
-                                            eliminar_registro_testeo(id_actual, row['index'])
-                                            st.rerun()
-                                        st.divider()
-                        st.markdown("---")
-                        st.subheader("4. Acciones de Escala")
-                        ganadores = df_agrupado[df_agrupado['Sugerencia'].str.contains("GANADOR", na=False)]['Anuncio'].tolist()
-                        if not ganadores:
-                            st.info("Aún no hay anuncios con la categoría de 'GANADOR' para escalar.")
-                        else:
-                            anuncio_a_escalar = st.selectbox("Selecciona un anuncio GANADOR para escalar", options=ganadores, index=None, placeholder="Elige un anuncio...")
-                            if anuncio_a_escalar:
-                                col1, col2 = st.columns(2)
-                                if col1.button("➕ Crear Nueva Campaña de Escala", use_container_width=True):
-                                    st.session_state['anuncio_para_escalar'] = anuncio_a_escalar; st.session_state['accion_de_escala'] = 'crear_nueva'; st.rerun()
-                                if col2.button("📥 Añadir a Campaña Existente", use_container_width=True):
-                                    st.session_state['anuncio_para_escalar'] = anuncio_a_escalar; st.session_state['accion_de_escala'] = 'añadir_existente'; st.rerun()
+                                    st.markdown("---")
+                                    st.subheader("3. Acciones y Desglose")
+                                    c1, c2 = st.columns(2)
+                                    with c1:
+                                        st.markdown("**Gestión de Estado de Anuncios**")
+                                        anuncio_a_gestionar = st.selectbox("Seleccionar Anuncio", options=[ad['nombre'] for ad in oferta_actual['anuncios_testeo']], key="sb_gestionar_anuncio")
+                                        if st.button(f"Cambiar Estado de '{anuncio_a_gestionar}'"): toggle_estado_anuncio(id_actual, anuncio_a_gestionar); st.rerun()
+                                    with c2:
+                                        st.markdown("**Ver Desglose Diario**")
+                                        anuncio_a_desglosar = st.selectbox("Seleccionar Anuncio", options=df_agrupado['Anuncio'].unique(), key="sb_desglosar_anuncio")
+                                        if anuncio_a_desglosar:
+                                            with st.expander(f"Desglose para '{anuncio_a_desglosar}'", key="exp_desglose_anuncio", on_change="rerun") as desplegable:
+                                                if desplegable.open:
+                                                    df_desglose = df_filtrado_diario[df_filtrado_diario['Anuncio'] == anuncio_a_desglosar]
+                                                    for idx, row in df_desglose.iterrows():
+                                                        st.write(f"**Fecha:** {row['Fecha'].strftime('%Y-%m-%d')} | **Inversión:** ${row['Inversión']:.2f} | **Ganancia Neta:** ${row['Ganancia Neta']:.2f} | **ROAS Neto:** {row['ROAS Neto']:.2f}")
+                                                        action_col1, action_col2 = st.columns([1,1])
+                                                        if action_col1.button("✏️ Editar", key=f"edit_{row[COLUMNA_ID_REGISTRO]}"):
+                                                            st.session_state['editing_record'] = {'type': 'testeo', 'id': row[COLUMNA_ID_REGISTRO]}
+                                                            st.rerun()
+                                                        if action_col2.button("🗑️ Eliminar", key=f"del_{row[COLUMNA_ID_REGISTRO]}"):
+                                                            eliminar_registro_testeo(id_actual, row[COLUMNA_ID_REGISTRO])
+                                                            st.rerun()
+                                                        st.divider()
+                                    st.markdown("---")
+                                    st.subheader("4. Acciones de Escala")
+                                    ganadores = df_agrupado[df_agrupado['Sugerencia'].str.contains("GANADOR", na=False)]['Anuncio'].tolist()
+                                    if not ganadores:
+                                        st.info("Aún no hay anuncios con la categoría de 'GANADOR' para escalar.")
+                                    else:
+                                        anuncio_a_escalar = st.selectbox("Selecciona un anuncio GANADOR para escalar", options=ganadores, index=None, placeholder="Elige un anuncio...")
+                                        if anuncio_a_escalar:
+                                            col1, col2 = st.columns(2)
+                                            if col1.button("➕ Crear Nueva Campaña de Escala", use_container_width=True):
+                                                st.session_state['anuncio_para_escalar'] = anuncio_a_escalar; st.session_state['accion_de_escala'] = 'crear_nueva'; st.rerun()
+                                            if col2.button("📥 Añadir a Campaña Existente", use_container_width=True):
+                                                st.session_state['anuncio_para_escalar'] = anuncio_a_escalar; st.session_state['accion_de_escala'] = 'añadir_existente'; st.rerun()
                         
-                        with st.container(border=True):
-                            st.subheader("🚀 Lanzamiento Directo a Escala")
-                            st.info("Usa esta opción si ya tienes un anuncio validado y quieres escalarlo sin esperar la sugerencia automática del sistema.", icon="💡")
-                            anuncios_activos_para_escala = [ad['nombre'] for ad in oferta_actual.get('anuncios_testeo', []) if ad['estado'] == "🟢 Activo"]
-                            if not anuncios_activos_para_escala:
-                                st.warning("Primero debes añadir un anuncio y asegurarte de que esté 'Activo' para poder lanzarlo a escala manualmente.")
-                            else:
-                                anuncio_manual_a_escalar = st.selectbox("Selecciona cualquier anuncio ACTIVO para escalar", options=anuncios_activos_para_escala, index=None, placeholder="Elige un anuncio para el lanzamiento directo...", key="lanzamiento_directo_sb")
-                                if anuncio_manual_a_escalar:
-                                    col1_manual, col2_manual = st.columns(2)
-                                    if col1_manual.button("➕ Crear Nueva Campaña (Directo)", use_container_width=True, key="crear_directo"):
-                                        st.session_state['anuncio_para_escalar'] = anuncio_manual_a_escalar
-                                        st.session_state['accion_de_escala'] = 'crear_nueva'
-                                        st.rerun()
-                                    if col2_manual.button("📥 Añadir a Campaña (Directo)", use_container_width=True, key="anadir_directo"):
-                                        st.session_state['anuncio_para_escalar'] = anuncio_manual_a_escalar
-                                        st.session_state['accion_de_escala'] = 'añadir_existente'
-                                        st.rerun()
-                    else: st.warning("No hay datos en el rango de fechas seleccionado.")
-
-                with st.expander("Ver Análisis Gráfico"):
-                    if not df_testeos_global.empty:
-                        df_filtrado_visual = df_testeos_global.copy()
-                        st.markdown("#### 📈 Gráfico de Batalla: ROAS Neto vs. CPA")
-                        anuncios_disponibles = df_filtrado_visual['Anuncio'].unique()
-                        anuncios_a_mostrar = st.multiselect("Selecciona anuncios para comparar", options=anuncios_disponibles, default=list(anuncios_disponibles[:3]))
-                        if anuncios_a_mostrar:
-                            df_tendencia = df_filtrado_visual[df_filtrado_visual['Anuncio'].isin(anuncios_a_mostrar)].copy()
-                            precio_pp = oferta_actual['funnel']['principal']['precio']
-                            ventas_pp_col = get_safe_column_name("PP")
-                            df_tendencia['CPA'] = df_tendencia.apply(lambda row: row['Inversión'] / row[ventas_pp_col] if ventas_pp_col in row and row[ventas_pp_col] > 0 else 0, axis=1)
-                            st.line_chart(df_tendencia, x='Fecha', y=['ROAS Neto', 'CPA'], color='Anuncio')
-                        st.markdown("---"); st.markdown("#### 📊 Gráfico de Volumen: Total Ventas PP")
-                        df_volumen = df_filtrado_visual.groupby('Anuncio')[get_safe_column_name("PP")].sum().sort_values(ascending=False)
-                        df_volumen.name = "Total Ventas PP"
-                        st.bar_chart(df_volumen)
-                        st.markdown("---"); st.markdown("#### 🗓️ Calendario de Consistencia (Últimos 7 días)")
-                        df_consistencia = df_filtrado_visual.copy()
-                        dias_a_mostrar = sorted(df_consistencia['Fecha'].dt.date.unique())[-7:]
-                        df_consistencia = df_consistencia[df_consistencia['Fecha'].dt.date.isin(dias_a_mostrar)]
-                        if not df_consistencia.empty:
-                            df_pivot = df_consistencia.pivot_table(index='Anuncio', columns=df_consistencia['Fecha'].dt.strftime('%Y-%m-%d'), values=get_safe_column_name("PP"), aggfunc='sum').fillna(0)
-                            df_visual_consistencia = df_pivot.applymap(lambda x: "✅" if x > 0 else "❌")
-                            st.dataframe(df_visual_consistencia)
-            with sub_tab_escala:
-                st.header("📊 Panel de Control de Campañas de Escala")
-                campanas_escala = oferta_actual.get('escala', {})
-                st.markdown("---")
+                                    with st.container(border=True):
+                                        st.subheader("🚀 Lanzamiento Directo a Escala")
+                                        st.info("Usa esta opción si ya tienes un anuncio validado y quieres escalarlo sin esperar la sugerencia automática del sistema.", icon="💡")
+                                        anuncios_activos_para_escala = [ad['nombre'] for ad in oferta_actual.get('anuncios_testeo', []) if ad['estado'] == "🟢 Activo"]
+                                        if not anuncios_activos_para_escala:
+                                            st.warning("Primero debes añadir un anuncio y asegurarte de que esté 'Activo' para poder lanzarlo a escala manualmente.")
+                                        else:
+                                            anuncio_manual_a_escalar = st.selectbox("Selecciona cualquier anuncio ACTIVO para escalar", options=anuncios_activos_para_escala, index=None, placeholder="Elige un anuncio para el lanzamiento directo...", key="lanzamiento_directo_sb")
+                                            if anuncio_manual_a_escalar:
+                                                col1_manual, col2_manual = st.columns(2)
+                                                if col1_manual.button("➕ Crear Nueva Campaña (Directo)", use_container_width=True, key="crear_directo"):
+                                                    st.session_state['anuncio_para_escalar'] = anuncio_manual_a_escalar
+                                                    st.session_state['accion_de_escala'] = 'crear_nueva'
+                                                    st.rerun()
+                                                if col2_manual.button("📥 Añadir a Campaña (Directo)", use_container_width=True, key="anadir_directo"):
+                                                    st.session_state['anuncio_para_escalar'] = anuncio_manual_a_escalar
+                                                    st.session_state['accion_de_escala'] = 'añadir_existente'
+                                                    st.rerun()
+                                else: st.warning("No hay datos en el rango de fechas seleccionado.")
+                        fragmento_panel_anuncios()
+
+                        with st.expander("Ver Análisis Gráfico", key="exp_analisis_grafico", on_change="rerun") as desplegable:
+                            if desplegable.open:
+                                if not df_testeos_global.empty:
+                                    df_filtrado_visual = df_testeos_global.copy()
+                                    st.markdown("#### 📈 Gráfico de Batalla: ROAS Neto vs. CPA")
+                                    anuncios_disponibles = df_filtrado_visual['Anuncio'].unique()
+                                    anuncios_a_mostrar = st.multiselect("Selecciona anuncios para comparar", options=anuncios_disponibles, default=list(anuncios_disponibles[:3]))
+                                    if anuncios_a_mostrar:
+                                        df_tendencia = df_filtrado_visual[df_filtrado_visual['Anuncio'].isin(anuncios_a_mostrar)].copy()
+                                        df_tendencia = calcular_metricas_oferta(df_tendencia, oferta_actual, diarias=False)
+                                        st.line_chart(df_tendencia, x='Fecha', y=['ROAS Neto', 'CPA'], color='Anuncio')
+                                    st.markdown("---"); st.markdown("#### 📊 Gráfico de Volumen: Total Ventas PP")
+                                    df_volumen = df_filtrado_visual.groupby('Anuncio', observed=True)[get_safe_column_name("PP")].sum().sort_values(ascending=False)
+                                    df_volumen.name = "Total Ventas PP"
+                                    st.bar_chart(df_volumen)
+                                    st.markdown("---"); st.markdown("#### 🗓️ Calendario de Consistencia (Últimos 7 días)")
+                                    df_consistencia = ordenar_por_fecha(df_filtrado_visual)
+                                    dias_con_datos = np.unique(df_consistencia['Fecha'].to_numpy(dtype='datetime64[D]'))
+                                    if len(dias_con_datos):
+                                        df_consistencia = filtrar_por_fechas(df_consistencia, dias_con_datos[-7:][0])
+                                    if not df_consistencia.empty:
+                                        df_pivot = df_consistencia.pivot_table(index='Anuncio', columns=df_consistencia['Fecha'].dt.strftime('%Y-%m-%d'), values=get_safe_column_name("PP"), aggfunc='sum', observed=True).fillna(0)
+                                        df_visual_consistencia = df_pivot.applymap(lambda x: "✅" if x > 0 else "❌")
+                                        st.dataframe(df_visual_consistencia)
+                with sub_tab_escala:
+                    if sub_tab_escala.open:
+                        st.header("📊 Panel de Control de Campañas de Escala")
+                        campanas_escala = oferta_actual.get('escala', {})
+                        st.markdown("---")
                 
-                # MEJORA 1: Filtro para campañas activas/inactivas
-                mostrar_inactivas = st.checkbox("Mostrar campañas inactivas", value=False)
+                        # MEJORA 1: Filtro para campañas activas/inactivas
+                        mostrar_inactivas = st.checkbox("Mostrar campañas inactivas", value=False)
                 
-                st.subheader("✍️ Registrar Datos Diarios de Escala")
-                if not campanas_escala:
-                    st.info("Crea tu primera campaña de escala desde la 'Fase de Testeo' para poder registrar datos.")
-                else:
-                    opciones_campana = {cid: cdetails['nombre_campana'] for cid, cdetails in campanas_escala.items()}
-                    id_campana_sel = st.selectbox("1. Selecciona la Campaña para registrar datos", options=list(opciones_campana.keys()), format_func=lambda x: opciones_campana[x], index=None, placeholder="Elige una campaña...", key="selector_campana_registro_escala")
-                    if id_campana_sel:
-                        with st.form("form_log_data_escala", clear_on_submit=True):
-                            st.markdown(f"**Registrando para la campaña: __{opciones_campana[id_campana_sel]}__**")
-                            componentes_activos = [comp['nombre'] for comp in campanas_escala[id_campana_sel].get('componentes', []) if comp['estado'] == '🟢 Activo']
-                            c1, c2, c3 = st.columns(3)
-                            componente_sel = c1.selectbox("2. Selecciona el Componente", options=componentes_activos, key="sel_comp_escala")
-                            fecha_escala = c2.date_input("Fecha", datetime.date.today(), key="date_escala")
-                            inversion_escala = c3.number_input("Inversión ($)", min_value=0.0, format="%.2f", key="inv_escala")
-                            st.markdown("**Resultados de Ventas**")
-                            funnel_activo = {k: v for k, v in oferta_actual['funnel'].items() if v['estado'] == "🟢 Activo"}
-                            form_cols_escala = st.columns(len(funnel_activo) + 1)
-                            ventas_data_escala = {}
-                            ventas_data_escala['Pagos Iniciados'] = form_cols_escala[0].number_input("Pagos Iniciados", min_value=0, step=1, key="pi_escala")
-                            i=1
-                            for item_details in funnel_activo.values():
-                                col_name = get_safe_column_name(item_details['alias'])
-                                ventas_data_escala[col_name] = form_cols_escala[i].number_input(item_details['alias'], min_value=0, step=1, key=f"venta_{item_details['alias']}_escala")
-                                i+=1
-                            if st.form_submit_button("💾 Guardar Registro de Escala", use_container_width=True):
-                                if componente_sel:
-                                    nuevo_registro = {"Fecha": fecha_escala, "Componente": componente_sel, "Inversión": inversion_escala, **ventas_data_escala}
-                                    agregar_registro_escala(id_actual, id_campana_sel, nuevo_registro); st.rerun()
-                                else: st.warning("Asegúrate de seleccionar un componente.")
-                st.markdown("---")
+                        st.subheader("✍️ Registrar Datos Diarios de Escala")
+                        if not campanas_escala:
+                            st.info("Crea tu primera campaña de escala desde la 'Fase de Testeo' para poder registrar datos.")
+                        else:
+                            opciones_campana = {cid: cdetails['nombre_campana'] for cid, cdetails in campanas_escala.items()}
+                            id_campana_sel = st.selectbox("1. Selecciona la Campaña para registrar datos", options=list(opciones_campana.keys()), format_func=lambda x: opciones_campana[x], index=None, placeholder="Elige una campaña...", key="selector_campana_registro_escala")
+                            if id_campana_sel:
+                                with st.form("form_log_data_escala", clear_on_submit=True):
+                                    st.markdown(f"**Registrando para la campaña: __{opciones_campana[id_campana_sel]}__**")
+                                    componentes_activos = [comp['nombre'] for comp in campanas_escala[id_campana_sel].get('componentes', []) if comp['estado'] == '🟢 Activo']
+                                    c1, c2, c3 = st.columns(3)
+                                    componente_sel = c1.selectbox("2. Selecciona el Componente", options=componentes_activos, key="sel_comp_escala")
+                                    fecha_escala = c2.date_input("Fecha", datetime.date.today(), key="date_escala")
+                                    inversion_escala = c3.number_input("Inversión ($)", min_value=0.0, format="%.2f", key="inv_escala")
+                                    st.markdown("**Resultados de Ventas**")
+                                    funnel_activo = {k: v for k, v in oferta_actual['funnel'].items() if v['estado'] == "🟢 Activo"}
+                                    form_cols_escala = st.columns(len(funnel_activo) + 1)
+                                    ventas_data_escala = {}
+                                    ventas_data_escala['Pagos Iniciados'] = form_cols_escala[0].number_input("Pagos Iniciados", min_value=0, step=1, key="pi_escala")
+                                    i=1
+                                    for item_details in funnel_activo.values():
+                                        col_name = get_safe_column_name(item_details['alias'])
+                                        ventas_data_escala[col_name] = form_cols_escala[i].number_input(item_details['alias'], min_value=0, step=1, key=f"venta_{item_details['alias']}_escala")
+                                        i+=1
+                                    if st.form_submit_button("💾 Guardar Registro de Escala", use_container_width=True):
+                                        if componente_sel:
+                                            nuevo_registro = {"Fecha": fecha_escala, "Componente": componente_sel, "Inversión": inversion_escala, **ventas_data_escala}
+                                            agregar_registro_escala(id_actual, id_campana_sel, nuevo_registro); st.rerun()
+                                        else: st.warning("Asegúrate de seleccionar un componente.")
+                                with st.expander("📥 Importación masiva de exportaciones (CSV / Parquet)", key="exp_importacion_escala", on_change="rerun") as desplegable:
+                                    if desplegable.open:
+                                        mostrar_importador_registros(id_actual, id_campana_sel)
+                        st.markdown("---")
                 
-                campanas_a_mostrar = campanas_escala
-                if not mostrar_inactivas:
-                    campanas_a_mostrar = {cid: cdetails for cid, cdetails in campanas_escala.items() if cdetails.get("estado", "🟢 Activa") == "🟢 Activa"}
+                        campanas_a_mostrar = campanas_escala
+                        if not mostrar_inactivas:
+                            campanas_a_mostrar = {cid: cdetails for cid, cdetails in campanas_escala.items() if cdetails.get("estado", "🟢 Activa") == "🟢 Activa"}
 
-                if not campanas_a_mostrar:
-                    st.info("No hay campañas de escala activas. Marca la casilla de arriba para ver las inactivas.")
-                else:
-                    def color_roas(val):
-                        color = 'inherit'
-                        if val >= 1.7: color = '#33ff99'
-                        elif val < 1.2: color = '#ff3366'
-                        return f'color: {color}'
-                    def color_ganancia(val):
-                        color = 'inherit'
-                        if val > 0: color = '#33ff99'
-                        elif val < 0: color = '#ff3366'
-                        return f'color: {color}'
+                        if not campanas_a_mostrar:
+                            st.info("No hay campañas de escala activas. Marca la casilla de arriba para ver las inactivas.")
+                        else:
+                            umbrales_color = umbrales_sugerencias(oferta_actual)
+                            def color_roas(val):
+                                color = 'inherit'
+                                if val >= umbrales_color['roas_ganador']: color = '#33ff99'
+                                elif val < umbrales_color['roas_apagar']: color = '#ff3366'
+
+                                return f'color: {color}'
+                            def color_ganancia(val):
+                                color = 'inherit'
+                                if val > 0: color = '#33ff99'
+                                elif val < 0: color = '#ff3366'
+                                return f'color: {color}'
                     
-                    for cid, cdetails in campanas_a_mostrar.items():
-                        ganancia_neta_campana_header = 0
-                        if 'registros' in cdetails and not cdetails['registros'].empty:
-                            ganancia_neta_campana_header = cdetails['registros']['Ganancia Neta'].sum()
-                        estado_campana = cdetails.get("estado", "🟢 Activa")
-                        expander_title = f"**{cdetails['nombre_campana']}** (Estrategia: {cdetails['estrategia']}) | Estado: {estado_campana} | Ganancia Neta: ${ganancia_neta_campana_header:,.2f}"
-                        
-                        # MEJORA 2: Expanders minimizados por defecto
-                        with st.expander(expander_title, expanded=False):
-                            df_escala_raw = cdetails['registros'].copy()
-                            c1, c2, c3 = st.columns([2,2,1])
-                            if c3.button("🔴 Apagar Campaña" if estado_campana == "🟢 Activa" else "✅ Activar Campaña", key=f"toggle_camp_{cid}"):
-                                toggle_estado_campana_escala(id_actual, cid); st.rerun()
-                            if df_escala_raw.empty:
-                                st.info("Aún no hay datos registrados para esta campaña.");
-                            if not df_escala_raw.empty:
-                                df_escala_raw['Fecha'] = pd.to_datetime(df_escala_raw['Fecha'])
-                            with c1:
-                                start_date_escala = st.date_input("Fecha Inicio", df_escala_raw['Fecha'].min().date() if not df_escala_raw.empty else datetime.date.today(), key=f"start_escala_{cid}")
-                            with c2:
-                                end_date_escala = st.date_input("Fecha Fin", df_escala_raw['Fecha'].max().date() if not df_escala_raw.empty else datetime.date.today(), key=f"end_escala_{cid}")
-                            st.markdown("---")
-                            st.markdown("##### ⚙️ Gestión de Componentes")
-                            col_gest_1, col_gest_2 = st.columns([2,1])
-                            with col_gest_1:
-                                componentes_totales = [comp['nombre'] for comp in cdetails.get('componentes', [])]
-                                if not componentes_totales:
-                                    st.info("No hay componentes en esta campaña.")
-                                else:
-                                    componente_a_gestionar = st.selectbox("Seleccionar componente para cambiar estado", options=componentes_totales, key=f"sb_gest_comp_{cid}")
-                            with col_gest_2:
-                                if componentes_totales:
-                                    st.write(" ") 
-                                    if st.button("Activar/Desactivar Componente", key=f"btn_gest_comp_{cid}", use_container_width=True):
-                                        toggle_estado_componente_escala(id_actual, cid, componente_a_gestionar)
-                                        st.rerun()
-                            if df_escala_raw.empty: continue
-                            df_filtrado_escala = df_escala_raw[(df_escala_raw['Fecha'].dt.date >= start_date_escala) & (df_escala_raw['Fecha'].dt.date <= end_date_escala)]
-                            if not df_filtrado_escala.empty:
-                                df_agrupado_escala = df_filtrado_escala.groupby("Componente").agg({'Inversión': 'sum', 'Pagos Iniciados': 'sum', 'Facturación Total': 'sum', 'Ganancia Neta': 'sum', **{get_safe_column_name(v['alias']): 'sum' for v in oferta_actual['funnel'].values() if get_safe_column_name(v['alias']) in df_filtrado_escala}}).reset_index()
-                                precio_pp = oferta_actual['funnel']['principal']['precio']
-                                ventas_pp_col = get_safe_column_name("PP")
-                                df_agrupado_escala['CPA'] = df_agrupado_escala.apply(lambda row: row['Inversión'] / row[ventas_pp_col] if ventas_pp_col in row and row[ventas_pp_col] > 0 else 0, axis=1)
-                                df_agrupado_escala['Facturación FE'] = df_agrupado_escala.apply(lambda row: row[ventas_pp_col] * precio_pp if ventas_pp_col in row else 0, axis=1)
-                                df_agrupado_escala['ROAS FE'] = df_agrupado_escala.apply(lambda row: row['Facturación FE'] / row['Inversión'] if 'Facturación FE' in row and row['Inversión'] > 0 else 0, axis=1)
-                                df_agrupado_escala['ROAS Total (Neto)'] = df_agrupado_escala.apply(lambda row: (row['Facturación Total'] - (row[ventas_pp_col] * comision_pp)) / row['Inversión'] if row['Inversión'] > 0 else 0, axis=1)
-                                mapa_estados_escala = {comp['nombre']: comp['estado'] for comp in cdetails.get('componentes', [])}
-                                df_agrupado_escala['Estado'] = df_agrupado_escala['Componente'].map(mapa_estados_escala)
-                                st.markdown("##### Rendimiento por Componente")
-                                mostrar_solo_activos_escala = st.checkbox("Mostrar solo componentes activos", value=True, key=f"cb_escala_activos_{cid}")
-                                df_para_mostrar_escala = df_agrupado_escala.copy()
-                                if mostrar_solo_activos_escala:
-                                    df_para_mostrar_escala = df_para_mostrar_escala[df_para_mostrar_escala['Estado'] == "🟢 Activo"]
-                                cols_display_order = ['Componente', 'Estado', 'Inversión', 'Ganancia Neta', ventas_pp_col]
-                                cols_rename_map = {ventas_pp_col: 'Ventas PP', 'Componente': 'Conjunto/Anuncio'}
-                                for alias in [v['alias'] for k, v in oferta_actual['funnel'].items() if k != 'principal']:
-                                    col_name = get_safe_column_name(alias)
-                                    if col_name in df_para_mostrar_escala.columns:
-                                        cols_display_order.append(col_name); cols_rename_map[col_name] = f"Ventas {alias}"
-                                cols_display_order.extend(['CPA', 'ROAS FE', 'ROAS Total (Neto)'])
-                                final_cols_to_show = [col for col in cols_display_order if col in df_para_mostrar_escala.columns]
+                            @st.fragment
+                            def fragmento_campana_escala(cid):
+                                # Cada campaña se redibuja por separado: sus fechas, filtros y componentes no recalculan el resto de la oferta.
+                                cdetails = st.session_state.ofertas[id_actual]['escala'][cid]
+                                estado_campana = cdetails.get("estado", "🟢 Activa")
+                                df_escala_raw = ordenar_por_fecha(obtener_registros(cdetails, 'registros').copy())
+                                c1, c2, c3 = st.columns([2,2,1])
+                                if c3.button("🔴 Apagar Campaña" if estado_campana == "🟢 Activa" else "✅ Activar Campaña", key=f"toggle_camp_{cid}"):
+                                    toggle_estado_campana_escala(id_actual, cid); st.rerun()
+                                if df_escala_raw.empty:
+                                    st.info("Aún no hay datos registrados para esta campaña.");
+                                if not df_escala_raw.empty:
+                                    df_escala_raw['Fecha'] = pd.to_datetime(df_escala_raw['Fecha'])
+                                with c1:
+                                    start_date_escala = st.date_input("Fecha Inicio", df_escala_raw['Fecha'].min().date() if not df_escala_raw.empty else datetime.date.today(), key=f"start_escala_{cid}")
+                                with c2:
+                                    end_date_escala = st.date_input("Fecha Fin", df_escala_raw['Fecha'].max().date() if not df_escala_raw.empty else datetime.date.today(), key=f"end_escala_{cid}")
+                                st.markdown("---")
+                                st.markdown("##### ⚙️ Gestión de Componentes")
+                                col_gest_1, col_gest_2 = st.columns([2,1])
+                                with col_gest_1:
+                                    componentes_totales = [comp['nombre'] for comp in cdetails.get('componentes', [])]
+                                    if not componentes_totales:
+                                        st.info("No hay componentes en esta campaña.")
+                                    else:
+                                        componente_a_gestionar = st.selectbox("Seleccionar componente para cambiar estado", options=componentes_totales, key=f"sb_gest_comp_{cid}")
+                                with col_gest_2:
+                                    if componentes_totales:
+                                        st.write(" ") 
+                                        if st.button("Activar/Desactivar Componente", key=f"btn_gest_comp_{cid}", use_container_width=True):
+                                            # El resto del fragmento se dibuja después, ya con el nuevo estado: no hace falta otro rerun.
+                                            toggle_estado_componente_escala(id_actual, cid, componente_a_gestionar)
+                                if df_escala_raw.empty: return
+                                df_filtrado_escala = filtrar_por_fechas(df_escala_raw, start_date_escala, end_date_escala)
+                                if not df_filtrado_escala.empty:
+                                    metricas_componentes = ['Inversión', 'Pagos Iniciados', 'Facturación Total', 'Ganancia Neta', 'Facturación FE'] + list(columnas_ventas_funnel(oferta_actual['funnel']))
+                                    cubo_componentes = memorizar_por_version((id_actual, 'componentes', cid), version_oferta(id_actual), lambda: CuboAcumulado.desde_df(df_escala_raw.assign(**{'Facturación FE': facturacion_fe(df_escala_raw, oferta_actual)}), metricas_componentes, clave='Componente'))
+                                    df_agrupado_escala = cubo_componentes.rango(start_date_escala, end_date_escala).rename_axis('Componente').reset_index()
+                                    ventas_pp_col = get_safe_column_name("PP")
+                                    df_agrupado_escala = calcular_metricas_df(df_agrupado_escala, oferta_actual['funnel'], comision_pp, diarias=False)
+                                    mapa_estados_escala = {comp['nombre']: comp['estado'] for comp in cdetails.get('componentes', [])}
+                                    df_agrupado_escala['Estado'] = df_agrupado_escala['Componente'].map(mapa_estados_escala)
+                                    st.markdown("##### Rendimiento por Componente")
+                                    mostrar_solo_activos_escala = st.checkbox("Mostrar solo componentes activos", value=True, key=f"cb_escala_activos_{cid}")
+                                    df_para_mostrar_escala = df_agrupado_escala.copy()
+                                    if mostrar_solo_activos_escala:
+                                        df_para_mostrar_escala = df_para_mostrar_escala[df_para_mostrar_escala['Estado'] == "🟢 Activo"]
+                                    cols_display_order = ['Componente', 'Estado', 'Inversión', 'Ganancia Neta', ventas_pp_col]
+                                    cols_rename_map = {ventas_pp_col: 'Ventas PP', 'Componente': 'Conjunto/Anuncio'}
+                                    for alias in [v['alias'] for k, v in oferta_actual['funnel'].items() if k != 'principal']:
+                                        col_name = get_safe_column_name(alias)
+                                        if col_name in df_para_mostrar_escala.columns:
+                                            cols_display_order.append(col_name); cols_rename_map[col_name] = f"Ventas {alias}"
+                                    cols_display_order.extend(['CPA', 'ROAS FE', 'ROAS Total (Neto)'])
+                                    final_cols_to_show = [col for col in cols_display_order if col in df_para_mostrar_escala.columns]
                                 
-                                if df_para_mostrar_escala.empty:
-                                    st.info("No hay componentes que cumplan con el filtro actual. Desmarca la casilla para ver todos.")
-                                else:
-                                    df_display_escala = df_para_mostrar_escala[final_cols_to_show].rename(columns=cols_rename_map)
-                                    st.dataframe(df_display_escala.style.apply(lambda x: x.map(color_roas), subset=['ROAS FE', 'ROAS Total (Neto)']).apply(lambda x: x.map(color_ganancia), subset=['Ganancia Neta']).format({'Inversión': "${:,.2f}", 'Ganancia Neta': "${:,.2f}", 'CPA': "${:,.2f}", 'ROAS FE': "{:.2f}", 'ROAS Total (Neto)': "{:.2f}"}), use_container_width=True)
+                                    if df_para_mostrar_escala.empty:
+                                        st.info("No hay componentes que cumplan con el filtro actual. Desmarca la casilla para ver todos.")
+                                    else:
+                                        df_display_escala = df_para_mostrar_escala[final_cols_to_show].rename(columns=cols_rename_map)
+                                        st.dataframe(df_display_escala.style.apply(lambda x: x.map(color_roas), subset=['ROAS FE', 'ROAS Total (Neto)']).apply(lambda x: x.map(color_ganancia), subset=['Ganancia Neta']).format({'Inversión': "${:,.2f}", 'Ganancia Neta': "${:,.2f}", 'CPA': "${:,.2f}", 'ROAS FE': "{:.2f}", 'ROAS Total (Neto)': "{:.2f}"}), use_container_width=True)
                                 
-                                st.markdown("##### Totales de la Campaña (Período Seleccionado)")
-                                total_inversion_campana = df_agrupado_escala['Inversión'].sum()
-                                total_ganancia_neta_campana = df_agrupado_escala['Ganancia Neta'].sum()
-                                total_facturacion_bruta_campana = df_agrupado_escala['Facturación Total'].sum()
-                                roas_neto_campana = (total_facturacion_bruta_campana - (df_agrupado_escala.get(ventas_pp_col, 0).sum() * comision_pp)) / total_inversion_campana if total_inversion_campana > 0 else 0
+                                    st.markdown("##### Totales de la Campaña (Período Seleccionado)")
+                                    total_inversion_campana = df_agrupado_escala['Inversión'].sum()
+                                    total_ganancia_neta_campana = df_agrupado_escala['Ganancia Neta'].sum()
+                                    total_facturacion_bruta_campana = df_agrupado_escala['Facturación Total'].sum()
+                                    roas_neto_campana = (total_facturacion_bruta_campana - df_agrupado_escala['Comisiones'].sum()) / total_inversion_campana if total_inversion_campana > 0 else 0
                                 
-                                kpi1, kpi2, kpi3, kpi4 = st.columns(4)
-                                kpi1.metric("Inversión Total", f"${total_inversion_campana:,.2f}")
-                                kpi2.metric("Facturación Bruta", f"${total_facturacion_bruta_campana:,.2f}")
-                                kpi3.metric("Ganancia Neta", f"${total_ganancia_neta_campana:,.2f}")
-                                kpi4.metric("ROAS Neto", f"{roas_neto_campana:.2f}")
-                                st.markdown("---")
-                                st.subheader("Desglose y Acciones por Componente")
-                                componentes_con_datos = df_filtrado_escala['Componente'].unique()
+                                    kpi1, kpi2, kpi3, kpi4 = st.columns(4)
+                                    kpi1.metric("Inversión Total", f"${total_inversion_campana:,.2f}")
+                                    kpi2.metric("Facturación Bruta", f"${total_facturacion_bruta_campana:,.2f}")
+                                    kpi3.metric("Ganancia Neta", f"${total_ganancia_neta_campana:,.2f}")
+                                    kpi4.metric("ROAS Neto", f"{roas_neto_campana:.2f}")
+                                    st.markdown("---")
+                                    st.subheader("Desglose y Acciones por Componente")
+                                    componentes_con_datos = df_filtrado_escala['Componente'].unique()
                                 
-                                if len(componentes_con_datos) == 0:
-                                    st.info("No hay componentes con datos en el período seleccionado.")
+                                    if len(componentes_con_datos) == 0:
+                                        st.info("No hay componentes con datos en el período seleccionado.")
+                                    else:
+                                        componente_a_desglosar = st.selectbox("Selecciona un Componente para ver su desglose diario", options=componentes_con_datos, key=f"sb_desglose_escala_{cid}")
+                                        if componente_a_desglosar:
+                                            with st.expander(f"Desglose para '{componente_a_desglosar}'", key=f"exp_desglose_componente_{cid}", on_change="rerun") as desplegable:
+                                                if desplegable.open:
+                                                    df_desglose_escala = df_filtrado_escala[df_filtrado_escala['Componente'] == componente_a_desglosar]
+                                                    for idx, row in df_desglose_escala.iterrows():
+                                                        st.write(f"**Fecha:** {row['Fecha'].strftime('%Y-%m-%d')} | **Inversión:** ${row['Inversión']:.2f} | **Ganancia Neta:** ${row['Ganancia Neta']:.2f} | **ROAS Neto:** {row['ROAS Neto']:.2f}")
+                                                        action_col1, action_col2 = st.columns([1,1])
+                                                        if action_col1.button("✏️ Editar", key=f"edit_escala_{row[COLUMNA_ID_REGISTRO]}_{cid}"):
+                                                            st.session_state['editing_record'] = {'type': 'escala', 'campaign_id': cid, 'id': row[COLUMNA_ID_REGISTRO]}
+                                                            st.rerun()
+                                                        if action_col2.button("🗑️ Eliminar", key=f"del_escala_{row[COLUMNA_ID_REGISTRO]}_{cid}"):
+                                                            eliminar_registro_escala(id_actual, cid, row[COLUMNA_ID_REGISTRO])
+                                                            st.rerun()
+                                                        st.divider()
                                 else:
-                                    componente_a_desglosar = st.selectbox("Selecciona un Componente para ver su desglose diario", options=componentes_con_datos, key=f"sb_desglose_escala_{cid}")
-                                    if componente_a_desglosar:
-                                        with st.expander(f"Desglose para '{componente_a_desglosar}'"):
-                                            df_desglose_escala = df_filtrado_escala[df_filtrado_escala['Componente'] == componente_a_desglosar].copy().reset_index()
-                                            for idx, row in df_desglose_escala.iterrows():
-                                                st.write(f"**Fecha:** {row['Fecha'].strftime('%Y-%m-%d')} | **Inversión:** ${row['Inversión']:.2f} | **Ganancia Neta:** ${row['Ganancia Neta']:.2f} | **ROAS Neto:** {row['ROAS Neto']:.2f}")
-                                                action_col1, action_col2 = st.columns([1,1])
-                                                if action_col1.button("✏️ Editar", key=f"edit_escala_{row['index']}_{cid}"):
-                                                    st.session_state['editing_record'] = {'type': 'escala', 'campaign_id': cid, 'index': row['index']}
-                                                    st.rerun()
-                                                if action_col2.button("🗑️ Eliminar", key=f"del_escala_{row['index']}_{cid}"):
-                                                    eliminar_registro_escala(id_actual, cid, row['index'])
-                                                    st.rerun()
-                                                st.divider()
-                            else:
-                                st.warning("No hay datos en el rango de fechas seleccionado para esta campaña.")
-            with sub_tab_analisis:
-                # ... (código del tab analisis sin cambios) ...
-                st.subheader("🔬 Monitor de Signos Vitales del Embudo (Global)")
-                df_funnel_completo = [df_testeos_global.copy()]
-                for camp_details in oferta_actual.get('escala', {}).values():
-                    if 'registros' in camp_details and not camp_details['registros'].empty:
-                        registros_escala = camp_details['registros'].copy()
-                        registros_escala['Fecha'] = pd.to_datetime(registros_escala['Fecha'])
-                        df_funnel_completo.append(registros_escala)
-                
-                df_consolidado_funnel = pd.concat(df_funnel_completo, ignore_index=True)
+                                    st.warning("No hay datos en el rango de fechas seleccionado para esta campaña.")
+                            for cid, cdetails in campanas_a_mostrar.items():
+                                ganancia_neta_campana_header = resumen['campanas'].get(cid, {}).get('ganancia_neta', 0)
+                                estado_campana = cdetails.get("estado", "🟢 Activa")
+                                expander_title = f"**{cdetails['nombre_campana']}** (Estrategia: {cdetails['estrategia']}) | Estado: {estado_campana} | Ganancia Neta: ${ganancia_neta_campana_header:,.2f}"
+                        
+                                # MEJORA 2: Expanders minimizados por defecto
+                                with st.expander(expander_title, expanded=False, key=f"exp_campana_{cid}", on_change="rerun") as desplegable:
+                                    if desplegable.open:
+                                        fragmento_campana_escala(cid)
+                with sub_tab_analisis:
+                    if sub_tab_analisis.open:
+                        # ... (código del tab analisis sin cambios) ...
+                        @st.fragment
+                        def fragmento_monitor_embudo():
+                            # Las fechas y la agrupación del monitor sólo redibujan este panel.
+                            st.subheader("🔬 Monitor de Signos Vitales del Embudo (Global)")
+                            def consolidar_funnel():
+                                df_funnel_completo = [df_testeos_global]
+                                for camp_details in oferta_actual.get('escala', {}).values():
+                                    if 'registros' in camp_details and not obtener_registros(camp_details, 'registros').empty:
+                                        df_funnel_completo.append(camp_details['registros'])
+                                return ordenar_por_fecha(concatenar_registros(df_funnel_completo))
+                            # La consolidación de todas las fases sólo se rehace cuando cambian los datos de la oferta.
+                            df_consolidado_funnel = memorizar_por_version((id_actual, 'funnel_consolidado'), version_oferta(id_actual), consolidar_funnel)
 
-                if df_consolidado_funnel.empty:
-                    st.info("Aún no hay datos registrados en ninguna fase para analizar el funnel.")
-                else:
-                    df_consolidado_funnel['Fecha'] = pd.to_datetime(df_consolidado_funnel['Fecha'])
-                    c1, c2 = st.columns(2)
-                    start_date_f = c1.date_input("Fecha Inicio", df_consolidado_funnel['Fecha'].min().date(), key="start_funnel_total")
-                    end_date_f = c2.date_input("Fecha Fin", df_consolidado_funnel['Fecha'].max().date(), key="end_funnel_total")
+                            if df_consolidado_funnel.empty:
+                                st.info("Aún no hay datos registrados en ninguna fase para analizar el funnel.")
+                            else:
+                                c1, c2 = st.columns(2)
+                                start_date_f = c1.date_input("Fecha Inicio", df_consolidado_funnel['Fecha'].min().date(), key="start_funnel_total")
+                                end_date_f = c2.date_input("Fecha Fin", df_consolidado_funnel['Fecha'].max().date(), key="end_funnel_total")
                     
-                    df_filtrado_funnel = df_consolidado_funnel[(df_consolidado_funnel['Fecha'].dt.date >= start_date_f) & (df_consolidado_funnel['Fecha'].dt.date <= end_date_f)]
+                                df_filtrado_funnel = filtrar_por_fechas(df_consolidado_funnel, start_date_f, end_date_f)
 
-                    if not df_filtrado_funnel.empty:
-                        st.markdown("---")
-                        st.markdown("#### Tasas de Conversión y Adopción del Backend (Global)")
-                        total_pagos_iniciados = df_filtrado_funnel['Pagos Iniciados'].sum()
-                        ventas_pp_col = get_safe_column_name("PP")
-                        total_ventas_pp = df_filtrado_funnel[ventas_pp_col].sum() if ventas_pp_col in df_filtrado_funnel else 0
+                                if not df_filtrado_funnel.empty:
+                                    st.markdown("---")
+                                    st.markdown("#### Tasas de Conversión y Adopción del Backend (Global)")
+                                    cubo_embudo = memorizar_por_version((id_actual, 'embudo'), version_oferta(id_actual), lambda: CuboAcumulado.desde_df(df_consolidado_funnel, ['Pagos Iniciados']))
+                                    total_pagos_iniciados = cubo_embudo.total(start_date_f, end_date_f).get('Pagos Iniciados', 0)
+                                    # Las ventas de todos los elementos del funnel salen de un único groupby sobre la tabla larga.
+                                    ventas_largas = memorizar_por_version((id_actual, 'ventas_largas'), version_oferta(id_actual), lambda: ventas_formato_largo(df_consolidado_funnel, oferta_actual['funnel']))
+                                    adopcion_funnel = tasas_adopcion_funnel(filtrar_por_fechas(ventas_largas, start_date_f, end_date_f), oferta_actual['funnel'])
+                                    total_ventas_pp = adopcion_funnel.loc['principal', 'unidades']
                         
-                        checkout_cr = (total_ventas_pp / total_pagos_iniciados) * 100 if total_pagos_iniciados > 0 else 0
+                                    checkout_cr = (total_ventas_pp / total_pagos_iniciados) * 100 if total_pagos_iniciados > 0 else 0
                         
-                        progress_value_checkout = min(checkout_cr, 100)
-                        st.metric(label="Tasa de Conversión (Pagos Iniciados a Ventas PP)", value=f"{checkout_cr:.2f}%")
-                        st.progress(int(progress_value_checkout)); st.caption(f"Pagos Iniciados: {int(total_pagos_iniciados)} | Ventas PP: {int(total_ventas_pp)}")
+                                    progress_value_checkout = min(checkout_cr, 100)
+                                    st.metric(label="Tasa de Conversión (Pagos Iniciados a Ventas PP)", value=f"{checkout_cr:.2f}%")
+                                    st.progress(int(progress_value_checkout)); st.caption(f"Pagos Iniciados: {int(total_pagos_iniciados)} | Ventas PP: {int(total_ventas_pp)}")
                         
-                        funnel_items = [v for k, v in oferta_actual['funnel'].items() if k != 'principal']
-                        if funnel_items:
-                            cols = st.columns(len(funnel_items))
-                            i = 0
-                            for item in funnel_items:
-                                alias = item['alias']; col_name = get_safe_column_name(alias)
-                                if col_name in df_filtrado_funnel.columns:
-                                    total_ventas_item = df_filtrado_funnel[col_name].sum()
-                                    item_cr = (total_ventas_item / total_ventas_pp) * 100 if total_ventas_pp > 0 else 0
-                                    
-                                    progress_value_item = min(item_cr, 100)
-                                    with cols[i]:
-                                        st.metric(label=f"Adopción de {alias} ({item['nombre']})", value=f"{item_cr:.2f}%")
-                                        st.progress(int(progress_value_item)); st.caption(f"Ventas {alias}: {int(total_ventas_item)}")
-                                    i+=1
+                                    funnel_items = [(k, v) for k, v in oferta_actual['funnel'].items() if k != 'principal']
+                                    if funnel_items:
+                                        cols = st.columns(len(funnel_items))
+                                        for i, (item_id, item) in enumerate(funnel_items):
+                                            alias = item['alias']
+                                            total_ventas_item, item_cr = adopcion_funnel.loc[item_id, 'unidades'], adopcion_funnel.loc[item_id, 'adopcion']
+                                
+                                            progress_value_item = min(item_cr, 100)
+                                            with cols[i]:
+                                                st.metric(label=f"Adopción de {alias} ({item['nombre']})", value=f"{item_cr:.2f}%")
+                                                st.progress(int(progress_value_item)); st.caption(f"Ventas {alias}: {int(total_ventas_item)}")
                         
-                        st.divider()
-                        st.subheader("📈 Análisis de Rendimiento Temporal")
-                        agrupacion = st.radio("Agrupar por:", ["Día", "Semana", "Mes"], horizontal=True, key="agrupacion_temporal")
-                        df_analisis_temp = df_filtrado_funnel.copy()
-                        df_analisis_temp['Día de la Semana'] = df_analisis_temp['Fecha'].dt.day_name()
-                        precio_pp = oferta_actual['funnel']['principal']['precio']
-                        comision_pp = oferta_actual.get('comision_pp', 0.0)
-                        ventas_pp_col = get_safe_column_name("PP")
-                        def calcular_metricas_temporales(df):
-                            df['Facturación FE'] = df.get(ventas_pp_col, 0) * precio_pp
-                            df['Ganancia Neta FE'] = df['Facturación FE'] - df['Inversión'] - (df.get(ventas_pp_col, 0) * comision_pp)
-                            df['ROAS FE'] = df['Facturación FE'].div(df['Inversión']).where(df['Inversión'] != 0, 0)
-                            df['ROAS Neto'] = (df['Facturación Total'] - (df.get(ventas_pp_col, 0) * comision_pp)).div(df['Inversión']).where(df['Inversión'] != 0, 0)
-                            return df
-                        agg_dict = {'Inversión': ('Inversión', 'sum'), 'Ganancia Neta': ('Ganancia Neta', 'sum'), 'Facturación Total': ('Facturación Total', 'sum'), ventas_pp_col: (ventas_pp_col, 'sum')}
-                        if agrupacion == "Día":
-                            df_agrupado_temp = df_analisis_temp.groupby(['Fecha', 'Día de la Semana']).agg(**agg_dict).reset_index()
-                            df_agrupado_temp = calcular_metricas_temporales(df_agrupado_temp)
-                            st.markdown("##### Rendimiento Diario")
-                            display_cols = ['Fecha', 'Día de la Semana', 'Inversión', 'Facturación Total', 'Facturación FE', 'Ganancia Neta', 'Ganancia Neta FE', 'ROAS Neto', 'ROAS FE']
-                            st.dataframe(df_agrupado_temp[display_cols].style.format({'Inversión': "${:,.2f}", 'Facturación Total': "${:,.2f}", 'Facturación FE': "${:,.2f}",'Ganancia Neta': "${:,.2f}", 'Ganancia Neta FE': "${:,.2f}", 'ROAS Neto': "{:.2f}", 'ROAS FE': "{:.2f}"}), use_container_width=True)
-                        else: # Semana o Mes
-                            if agrupacion == "Semana":
-                                df_analisis_temp['Periodo'] = df_analisis_temp['Fecha'].dt.to_period('W').apply(lambda r: r.start_time.strftime('%Y-%m-%d'))
-                            else: # Mes
-                                try:
-                                    locale.setlocale(locale.LC_TIME, 'es_ES.UTF-8')
-                                except locale.Error:
-                                    pass
-                                df_analisis_temp['Periodo'] = df_analisis_temp['Fecha'].dt.strftime('%B %Y').str.capitalize()
-                            df_agrupado_periodo = df_analisis_temp.groupby('Periodo').agg(**agg_dict).reset_index()
-                            df_agrupado_periodo = calcular_metricas_temporales(df_agrupado_periodo)
-                            st.markdown(f"##### Rendimiento por {agrupacion}")
-                            for index, row in df_agrupado_periodo.iterrows():
-                                expander_title = f"**{agrupacion}: {row['Periodo']}** | Inv: ${row['Inversión']:,.2f} | Gan. Neta: ${row['Ganancia Neta']:,.2f} | ROAS Neto: {row['ROAS Neto']:.2f}"
-                                with st.expander(expander_title):
-                                    df_desglose_periodo = df_analisis_temp[df_analisis_temp['Periodo'] == row['Periodo']]
-                                    df_desglose_diario = df_desglose_periodo.groupby(['Fecha', 'Día de la Semana']).agg(**agg_dict).reset_index()
-                                    df_desglose_diario = calcular_metricas_temporales(df_desglose_diario)
-                                    display_cols_desglose = ['Fecha', 'Día de la Semana', 'Inversión', 'Facturación Total', 'Facturación FE', 'Ganancia Neta', 'Ganancia Neta FE', 'ROAS Neto', 'ROAS FE']
-                                    st.dataframe(df_desglose_diario[display_cols_desglose].sort_values(by="Fecha").style.format({'Inversión': "${:,.2f}", 'Facturación Total': "${:,.2f}", 'Facturación FE': "${:,.2f}", 'Ganancia Neta': "${:,.2f}", 'Ganancia Neta FE': "${:,.2f}", 'ROAS Neto': "{:.2f}", 'ROAS FE': "{:.2f}"}), use_container_width=True)
-                    else: st.warning("No hay datos en el rango de fechas seleccionado.")
+                                    st.divider()
+                                    st.subheader("📈 Análisis de Rendimiento Temporal")
+                                    agrupacion = st.radio("Agrupar por:", ["Día", "Semana", "Mes"], horizontal=True, key="agrupacion_temporal")
+                                    ventas_pp_col = get_safe_column_name("PP")
+                                    def calcular_metricas_temporales(df):
+                                        df = calcular_metricas_df(df, oferta_actual['funnel'], diarias=False)
+                                        df['Ganancia Neta FE'] = df['Facturación FE'] - df['Inversión'] - df['Comisiones']
+                                        df['ROAS Neto'] = df['ROAS Total (Neto)']
+                                        return df
+                                    def construir_periodos():
+                                        df_analisis_temp = df_filtrado_funnel.assign(**{'Facturación FE': facturacion_fe(df_filtrado_funnel, oferta_actual)})
+                                        niveles = agregar_por_periodos(df_analisis_temp, ['Inversión', 'Ganancia Neta', 'Facturación Total', 'Facturación FE', ventas_pp_col])
+                                        return {nivel: calcular_metricas_temporales(tabla) for nivel, tabla in niveles.items()}
+                                    version_datos = version_oferta(id_actual)
+                                    periodos = memorizar_por_version((id_actual, 'periodos'), None if version_datos is None else (version_datos, start_date_f, end_date_f), construir_periodos)
+                                    df_diario_temp = periodos['Día']
+                                    display_cols = ['Fecha', 'Día de la Semana', 'Inversión', 'Facturación Total', 'Facturación FE', 'Ganancia Neta', 'Ganancia Neta FE', 'ROAS Neto', 'ROAS FE']
+                                    formato_temporal = {'Inversión': "${:,.2f}", 'Facturación Total': "${:,.2f}", 'Facturación FE': "${:,.2f}", 'Ganancia Neta': "${:,.2f}", 'Ganancia Neta FE': "${:,.2f}", 'ROAS Neto': "{:.2f}", 'ROAS FE': "{:.2f}"}
+                                    if agrupacion == "Día":
+                                        st.markdown("##### Rendimiento Diario")
+                                        st.dataframe(df_diario_temp[display_cols].style.format(formato_temporal), use_container_width=True)
+                                    else: # Semana o Mes
+                                        st.markdown(f"##### Rendimiento por {agrupacion}")
+                                        for fila in periodos[agrupacion].to_dict('records'):
+                                            expander_title = f"**{agrupacion}: {fila['Periodo']}** | Inv: ${fila['Inversión']:,.2f} | Gan. Neta: ${fila['Ganancia Neta']:,.2f} | ROAS Neto: {fila['ROAS Neto']:.2f}"
+                                            with st.expander(expander_title, key=f"exp_periodo_{agrupacion}_{fila['Periodo']}", on_change="rerun") as desplegable:
+                                                if desplegable.open:
+                                                    # El desglose diario del periodo es un tramo contiguo de la tabla diaria ya calculada.
+                                                    df_desglose_diario = df_diario_temp.iloc[fila['inicio']:fila['fin']]
+                                                    st.dataframe(df_desglose_diario[display_cols].style.format(formato_temporal), use_container_width=True)
+                                else: st.warning("No hay datos en el rango de fechas seleccionado.")
+                        fragmento_monitor_embudo()
 
 # --- PUNTO DE ENTRADA ---
-if 'logged_in' not in st.session_state:
-    st.session_state.logged_in = False
+# `streamlit run` ejecuta el script como __main__; importado (p. ej. desde los tests) sólo define.
+if __name__ == "__main__":
+    if 'logged_in' not in st.session_state:
+        st.session_state.logged_in = False
 
-if st.session_state.logged_in:
-    main_app()
-else:
-    show_login_page()
+    if st.session_state.logged_in:
+        main_app()
+    else:
+        show_login_page()
 
@@ -0,0 +1,53 @@
+import pathlib
+import sys
+import tempfile
+
+import pytest
+import streamlit as st
+from streamlit import config
+
+RAIZ = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(RAIZ))
+
+# Los secretos se leen al importar la app: backend SQLite local y login de desarrollo, sin Firebase.
+_SECRETOS = pathlib.Path(tempfile.mkdtemp()) / "secrets.toml"
+_SECRETOS.write_text(
+    '[storage]\nbackend = "sqlite"\nruta = ":memory:"\n'
+    '[auth]\nmodo = "local"\n'
+
+    '[team_config]\nworkspace_id = "pruebas"\nauthorized_emails = ["equipo@example.com"]\n'
+)
+config.set_option("secrets.files", [str(_SECRETOS)])
+
+import app_socios as app  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def sesion_limpia(monkeypatch, tmp_path):
+    """Cada test con su propia base SQLite, almacén, cola y sesión."""
+    monkeypatch.setitem(app.CONFIG_ALMACENAMIENTO, "ruta", str(tmp_path / "pruebas.db"))
+    monkeypatch.setattr(app, "VENTANA_AGRUPACION_SEG", 0.01)
+    st.cache_resource.clear()
+    st.session_state.clear()
+    yield
+    app.obtener_cola_escritura("pruebas").vaciar()
+    st.session_state.clear()
+    st.cache_resource.clear()
+
+
+@pytest.fixture
+def funnel():
+    return {
+        "principal": {"nombre": "Libro", "precio": 10.0, "alias": "PP", "estado": "🟢 Activo"},
+        "bump_1": {"nombre": "Guía", "precio": 5.0, "alias": "B1", "estado": "🟢 Activo"},
+    }
+
+
+@pytest.fixture
+def oferta():
+    """Una oferta recién creada (con una campaña de escala) en la sesión, como lo haría la interfaz."""
+    app.load_data_from_firestore()
+    app.crear_nueva_oferta("Prueba", "Low Ticket", 10.0)
+    id_oferta = st.session_state.oferta_seleccionada
+    app.crear_campana_escala(id_oferta, "Escala", "a", "Duplicación", 50.0)
+    return id_oferta
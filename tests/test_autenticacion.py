@@ -0,0 +1,8 @@
+import app_socios as app
+
+
+def test_login_sin_contrasena_solo_con_modo_local_explicito():
+    assert app.autenticacion_local({"modo": "local"})
+    # El backend de almacenamiento no decide la autenticación.
+    assert not app.autenticacion_local({})
+    assert not app.autenticacion_local({"modo": "firebase"})
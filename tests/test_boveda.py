@@ -0,0 +1,81 @@
+import pytest
+import streamlit as st
+
+import app_socios as app
+from app_socios import AlmacenWorkspace, IndiceBoveda, aplicar_cambios_remotos
+
+
+def entrada(id_entrada, nombre, **campos):
+    return {"id": id_entrada, "nombre": nombre, "tipo_oferta": "VSL", "nicho": "Salud", "idioma": "Español",
+            "calificacion": 3, "comentarios": "", "estatus": "🧪 En Pruebas", **campos}
+
+
+@pytest.fixture
+def indice():
+    return IndiceBoveda([
+        entrada("boveda_1", "Nutrición Keto", comentarios="Varias VSLs largas"),
+        entrada("boveda_2", "Keto rápido", tipo_oferta="QUIZ", idioma="Inglés"),
+        entrada("boveda_3", "Ayuno", nicho="Finanzas", estatus=None),
+    ])
+
+
+def test_busqueda_por_prefijo_y_sin_acentos(indice):
+    assert indice.buscar("vsl") == {"boveda_1", "boveda_3"}
+
+    assert indice.buscar("vsls") == {"boveda_1"}
+    assert indice.buscar("nutricion") == indice.buscar("NUTRICIÓN") == {"boveda_1"}
+    assert indice.buscar("ket nutri") == {"boveda_1"}
+    assert indice.buscar("ket zzz") == set()
+    assert indice.buscar("  ") == {"boveda_1", "boveda_2", "boveda_3"}
+
+
+def test_facetas(indice):
+    # Sin estatus cuenta como Idea, como se muestra.
+    assert indice.conteos("estatus") == {"🧪 En Pruebas": 2, app.ESTATUS_BOVEDA_POR_DEFECTO: 1}
+    assert indice.conteos("tipo_oferta", indice.buscar("keto")) == {"VSL": 1, "QUIZ": 1}
+    todos = set(indice.por_id)
+    # O dentro de una faceta, Y entre facetas.
+    assert indice.filtrar(todos, {"tipo_oferta": ["VSL", "QUIZ"], "nicho": ["Salud"]}) == {"boveda_1", "boveda_2"}
+    assert indice.filtrar(todos, {"tipo_oferta": ["QUIZ"], "nicho": ["Finanzas"]}) == set()
+    assert indice.filtrar(todos, {"idioma": []}) == todos
+
+
+def test_reindexar_y_quitar(indice):
+    indice.agregar(entrada("boveda_2", "Paleo", tipo_oferta="TSL"))
+    assert indice.buscar("keto") == {"boveda_1"} and indice.buscar("paleo") == {"boveda_2"}
+    assert indice.conteos("tipo_oferta") == {"VSL": 2, "TSL": 1}
+    indice.quitar("boveda_1")
+    assert indice.buscar("keto") == set() and "nutricion" not in indice.vocabulario
+    assert indice.conteos("tipo_oferta") == {"VSL": 1, "TSL": 1}
+    assert indice.vocabulario == sorted(indice.vocabulario)
+
+
+def test_guardados_de_la_sesion_mantienen_el_indice():
+    app.load_data_from_firestore()
+    indice = app.almacen_actual().indice_boveda
+    st.session_state.boveda.insert(0, entrada("boveda_10", "Método Keto"))
+    app.registrar_cambio("boveda", "boveda_10")
+    app.save_data_to_firestore()
+    assert indice.buscar("metodo") == {"boveda_10"}
+
+    st.session_state["estatus_10"] = "🗄️ Archivada"
+    app.update_boveda_status("boveda_10", "estatus_10")
+    assert indice.conteos("estatus") == {"🗄️ Archivada": 1}
+
+    app.eliminar_entrada_boveda("boveda_10")
+    assert indice.buscar("metodo") == set() and indice.conteos("estatus") == {}
+
+
+def test_cambios_remotos_mantienen_el_indice():
+    almacen = AlmacenWorkspace("ws")
+    nueva = entrada("boveda_20", "Ayuno intermitente")
+    aplicar_cambios_remotos(almacen, [("boveda", "boveda_20", nueva, False)], token="yo")
+    assert almacen.indice_boveda.buscar("interm") == {"boveda_20"}
+
+    aplicar_cambios_remotos(almacen, [("boveda", "boveda_20", dict(nueva, nombre="Ayuno 16/8", estatus=None), False)],
+                            token="yo")
+    assert almacen.indice_boveda.buscar("interm") == set() and almacen.indice_boveda.buscar("ayuno") == {"boveda_20"}
+    assert almacen.indice_boveda.conteos("estatus") == {app.ESTATUS_BOVEDA_POR_DEFECTO: 1}
+
+    aplicar_cambios_remotos(almacen, [("boveda", "boveda_20", nueva, True)], token="yo")
+    assert almacen.indice_boveda.por_id == {} and almacen.boveda == []
@@ -0,0 +1,92 @@
+import pandas as pd
+import pytest
+
+from app_socios import (CAMPO_ORIGEN_ESCRITURA, CAMPO_VERSION_INSTANTANEA, AlmacenWorkspace, RollupOferta,
+                        aplicar_cambios_remotos)
+
+V = CAMPO_VERSION_INSTANTANEA
+
+
+@pytest.fixture
+def registros():
+    return pd.DataFrame({"Fecha": pd.to_datetime(["2024-01-01"]), "Anuncio": ["a"], "Inversión": [1.0],
+                         "id_registro": ["r1"]})
+
+
+@pytest.fixture
+def almacen(registros):
+    almacen = AlmacenWorkspace("ws")
+    almacen.ofertas = {
+        "o1": {"nombre": "A", "estado": "Testeo", "funnel": {}, "testeos": registros, V: "t1",
+               "escala": {"c1": {"nombre_campana": "C", "registros": registros, V: "k1"}}, "_hidratada": True},
+        "o2": {"nombre": "B", "escala": {}, "_hidratada": False},
+    }
+    almacen.rollups = {"o1": RollupOferta()}
+    return almacen
+
+
+def test_eco_propio_se_ignora(almacen):
+    datos = {"nombre": "Otro", V: "t1", CAMPO_ORIGEN_ESCRITURA: "yo"}
+    assert aplicar_cambios_remotos(almacen, [("ofertas", "o1", datos, False)], token="yo") == set()
+    assert almacen.ofertas["o1"]["nombre"] == "A"
+
+
+def test_metadatos_con_la_misma_instantanea_no_invalidan(almacen, registros):
+    aplicar_cambios_remotos(almacen, [("ofertas", "o1", {"nombre": "A2", "estado": "Escala", "funnel": {}, V: "t1"}, False)],
+                            token="yo")
+    oferta = almacen.ofertas["o1"]
+    assert oferta["_hidratada"] and oferta["estado"] == "Escala" and oferta["testeos"] is registros
+
+
+def test_instantanea_nueva_invalida_la_hidratacion(almacen):
+    aplicar_cambios_remotos(almacen, [("ofertas", "o1", {"nombre": "A", V: "t2"}, False)], token="yo")
+    assert not almacen.ofertas["o1"]["_hidratada"] and almacen.ofertas["o1"][V] == "t2"
+
+
+def test_borrado_con_marca_propia_se_aplica(almacen):
+    # El último estado conocido puede llevar nuestra marca aunque el borrado lo hiciera otro proceso.
+    datos = {"nombre": "A", V: "t1", CAMPO_ORIGEN_ESCRITURA: "yo"}
+    assert aplicar_cambios_remotos(almacen, [("ofertas", "o1", datos, True)], token="yo") == {"o1"}
+    assert "o1" not in almacen.ofertas and "o1" not in almacen.rollups
+
+
+def test_campanas(almacen, registros):
+    campana = {"oferta_id": "o1", "campana_id": "c1", "nombre_campana": "C2", V: "k1"}
+    aplicar_cambios_remotos(almacen, [("campanas", "o1__c1", campana, False)], token="yo")
+    c1 = almacen.ofertas["o1"]["escala"]["c1"]
+    assert almacen.ofertas["o1"]["_hidratada"] and c1["nombre_campana"] == "C2" and c1["registros"] is registros
+    assert "oferta_id" not in c1
+
+    # Las de ofertas sin hidratar se ignoran: se leerán al hidratarlas.
+    ajena = {"oferta_id": "o2", "campana_id": "c9", V: "z"}
+    assert aplicar_cambios_remotos(almacen, [("campanas", "o2__c9", ajena, False)], token="yo") == set()
+
+    aplicar_cambios_remotos(almacen, [("campanas", "o1__c1", campana, True)], token="yo")
+    assert almacen.ofertas["o1"]["_hidratada"] and "c1" not in almacen.ofertas["o1"]["escala"]
+
+    nueva = {"oferta_id": "o1", "campana_id": "c2", V: "k2"}
+    aplicar_cambios_remotos(almacen, [("campanas", "o1__c2", nueva, False)], token="yo")
+    assert not almacen.ofertas["o1"]["_hidratada"]
+
+
+def test_log_de_registros(almacen):
+    alta = {"oferta_id": "o1", "segmento": "testeos", "ts": 1,
+            "fila": {"Fecha": "2024-01-02", "Anuncio": "b", "Inversión": 2.0}, "ventas": {"PP": 3}}
+    assert aplicar_cambios_remotos(almacen, [("registros", "r2", alta, False)], token="yo") == {"o1"}
+    testeos = almacen.ofertas["o1"]["testeos"]
+    assert testeos["id_registro"].tolist() == ["r1", "r2"]
+    assert testeos.loc[1, "Ventas: PP"] == 3 and testeos.loc[0, "Ventas: PP"] == 0
+
+    # Al compactarse el documento se borra del log, pero la fila ya está en el snapshot.
+    aplicar_cambios_remotos(almacen, [("registros", "r2", alta, True)], token="yo")
+    assert almacen.ofertas["o1"]["_ids_log"] == set()
+    assert len(almacen.ofertas["o1"]["testeos"]) == 2
+
+
+def test_rollups_se_aplican_aunque_sean_eco(almacen):
+    dia = {"oferta_id": "o1", "segmento": "testeos", "fecha": "2024-01-01",
+           "componentes": {"a": {"inversion": 5.0, "registros": 1}}, CAMPO_ORIGEN_ESCRITURA: "yo"}
+    aplicar_cambios_remotos(almacen, [("rollups", "o1__testeos__2024-01-01", dia, False)], token="yo")
+    assert almacen.rollups["o1"].totales(["testeos"])["inversion"] == 5.0
+    aplicar_cambios_remotos(almacen, [("rollups", "o1__testeos__2024-01-01", dia, True)], token="yo")
+    assert almacen.rollups["o1"].dias == {} and almacen.rollups["o1"].totales(["testeos"])["inversion"] == 0
@@ -0,0 +1,61 @@
+import streamlit as st
+
+import app_socios as app
+
+TEXTO = "Fase 1\n- Investigar\n- Guion\nFase 2\n- Grabar"
+
+
+def textos(tareas):
+    return [item["text"] for _, item in app.items_checklist(tareas)]
+
+
+def test_parse_y_unparse():
+    tareas = app.parse_checklist(TEXTO)
+    assert isinstance(tareas, dict) and len(set(tareas)) == 5
+    assert textos(tareas) == ["Fase 1", "Investigar", "Guion", "Fase 2", "Grabar"]
+    assert app.unparse_checklist(tareas) == "Fase 1\n- Investigar\n- Guion\nFase 2\n- Grabar"
+    # Los checklists guardados como lista se siguen leyendo en su orden.
+    assert app.unparse_checklist([item for _, item in app.items_checklist(tareas)]) == app.unparse_checklist(tareas)
+
+
+def test_merge_conserva_id_y_estado_de_las_tareas_que_siguen():
+    tareas = app.parse_checklist(TEXTO)
+    ids = {item["text"]: id_tarea for id_tarea, item in tareas.items()}
+    tareas[ids["Guion"]]["completed"] = True
+    nuevas = app.merge_checklists(tareas, "Fase 1\n- Guion\n- Anuncios\nFase 2\n- Grabar")
+    assert textos(nuevas) == ["Fase 1", "Guion", "Anuncios", "Fase 2", "Grabar"]
+    assert nuevas[ids["Guion"]]["completed"] and not nuevas[ids["Grabar"]]["completed"]
+    assert ids["Investigar"] not in nuevas
+
+
+def test_marcar_tarea_envia_solo_su_campo(oferta, monkeypatch):
+    st.session_state.ofertas[oferta]["checklist"] = {"plantilla_nombre": "P", "tareas": app.parse_checklist(TEXTO)}
+    app.registrar_cambio("ofertas", oferta, "checklist")
+    app.save_data_to_firestore()
+    cola = app.obtener_cola_escritura("pruebas")
+    assert cola.vaciar()
+
+    encoladas = []
+    encolar = cola.encolar
+    monkeypatch.setattr(cola, "encolar", lambda operaciones: (encoladas.extend(operaciones), encolar(operaciones)))
+    id_tarea = next(i for i, item in st.session_state.ofertas[oferta]["checklist"]["tareas"].items() if item["text"] == "Guion")
+    st.session_state["tarea"] = True
+    app.update_tarea_checklist(oferta, id_tarea, "tarea")
+
+    (accion, ref, campos), = encoladas
+    assert accion == "update" and ref == app.Documento("ofertas", oferta)
+    assert set(campos) - {(app.CAMPO_ORIGEN_ESCRITURA,)} == {("checklist", "tareas", id_tarea, "completed")}
+    assert cola.vaciar()
+    guardada = app.backend_actual().leer("ofertas", oferta)["checklist"]["tareas"]
+    assert guardada[id_tarea]["completed"] and sum(item.get("completed", False) for item in guardada.values()) == 1
+
+
+def test_checklist_en_lista_se_convierte_al_marcar(oferta):
+    lista = [{"type": "phase", "text": "Fase"}, {"type": "task", "text": "Hacer", "completed": False}]
+    st.session_state.ofertas[oferta]["checklist"] = {"plantilla_nombre": "P", "tareas": lista}
+    st.session_state["tarea"] = True
+    app.update_tarea_checklist(oferta, "1", "tarea")
+    assert app.obtener_cola_escritura("pruebas").vaciar()
+    guardada = app.backend_actual().leer("ofertas", oferta)["checklist"]["tareas"]
+    assert guardada == {"0": {"type": "phase", "text": "Fase", "orden": 0},
+                        "1": {"type": "task", "text": "Hacer", "completed": True, "orden": 1}}
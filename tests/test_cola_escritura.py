@@ -0,0 +1,83 @@
+import app_socios as app
+from app_socios import BORRAR_CAMPO, ColaEscritura, Consulta, Documento, Incremento
+
+
+class BackendMemoria(app.BackendAlmacenamiento):
+    """Backend de prueba: registra cada lote confirmado y puede fallar las primeras `fallos` veces."""
+
+    def __init__(self, fallos=0):
+        self.lotes = []
+        self.fallos = fallos
+
+    def confirmar(self, operaciones):
+        if self.fallos:
+            self.fallos -= 1
+            raise RuntimeError("backend caído")
+        self.lotes.append(list(operaciones))
+
+    def leer(self, coleccion, id_doc, campos=None):
+        return None
+
+    def listar(self, coleccion, campos=None):
+        return iter(())
+
+    def consultar(self, coleccion, campo, valor):
+        return iter(())
+
+
+def acciones(lote):
+    return [(accion, ref) for accion, ref, _ in lote]
+
+
+def test_borrado_por_consulta_y_set_posterior_salen_en_orden():
+    backend = BackendMemoria()
+    cola = ColaEscritura("ws", backend)
+    dia = Documento("rollups", "o1__testeos__2024-01-01")
+    todos = Consulta("rollups", "oferta_id", "o1")
+    cola.encolar([("incrementar", dia, {("componentes", "a", "inversion"): Incremento(1.0)})])
+    cola.encolar([("delete_consulta", todos, None), ("set", dia, {"a": 1})])
+    assert cola.vaciar()
+    assert len(backend.lotes) == 1
+    # El set debe llegar después del borrado masivo, o éste se llevaría por delante el día reescrito.
+    assert acciones(backend.lotes[0]) == [("delete_consulta", todos), ("set", dia)]
+    assert backend.lotes[0][1][2] == {"a": 1}
+
+
+def test_update_se_fusiona_en_set_pendiente():
+    backend = BackendMemoria()
+    cola = ColaEscritura("ws", backend)
+    ref = Documento("ofertas", "o1")
+    cola.encolar([("set", ref, {"nombre": "A", "estado": "Testeo", "nota": "x"})])
+    cola.encolar([("update", ref, {("estado",): "Escala", ("nota",): BORRAR_CAMPO})])
+    assert cola.vaciar()
+    assert backend.lotes == [[("set", ref, {"nombre": "A", "estado": "Escala"})]]
+
+
+def test_incrementos_del_mismo_campo_se_suman():
+    backend = BackendMemoria()
+    cola = ColaEscritura("ws", backend)
+    ref = Documento("rollups", "o1__testeos__2024-01-01")
+    campo = ("componentes", "a", "inversion")
+    cola.encolar([("incrementar", ref, {campo: Incremento(1.5)})])
+    cola.encolar([("incrementar", ref, {campo: Incremento(2.0)})])
+    assert cola.vaciar()
+    (accion, _, datos), = backend.lotes[0]
+    assert accion == "incrementar" and datos[campo].valor == 3.5
+
+
+def test_operaciones_agotadas_quedan_como_fallidas_y_se_reintentan(monkeypatch):
+    monkeypatch.setattr(app, "MAX_REINTENTOS_ESCRITURA", 2)
+    backend = BackendMemoria(fallos=2)
+    cola = ColaEscritura("ws", backend)
+    ref = Documento("ofertas", "o1")
+    cola.encolar([("set", ref, {"nombre": "A"})])
+    assert cola.vaciar()
+    assert backend.lotes == []
+    assert cola.fallidas == 1 and cola.ultimo_error == "backend caído"
+
+    # Lo encolado después se fusiona con la operación reintentada, no la pisa.
+    cola.encolar([("update", ref, {("estado",): "Escala"})])
+    cola.reintentar_fallidas()
+    assert cola.vaciar()
+    assert cola.fallidas == 0
+    assert [op for lote in backend.lotes for op in lote] == [("set", ref, {"nombre": "A", "estado": "Escala"})]
@@ -0,0 +1,93 @@
+import io
+
+import pandas as pd
+import pytest
+import streamlit as st
+
+import app_socios as app
+
+CSV = (
+    "Day;Ad name;Amount spent (USD);Checkouts Initiated;Ventas: PP;Ventas: B1\n"
+    "2024-01-01;A1;10,5;3;2;1\n"
+    "2024-01-01;A1;4,5;1;1;0\n"
+    "02/01/2024;A2;7;0;0;0\n"
+    "xx;A2;1;0;0;0\n"
+    "2024-01-03;A3;-1;0;0;0\n"
+)
+
+
+def archivo(contenido, nombre):
+    buffer = io.BytesIO(contenido)
+    buffer.name = nombre
+    return buffer
+
+
+@pytest.fixture
+def oferta_base(funnel):
+    return {"funnel": funnel, "comision_pp": 1.0, "anuncios_testeo": []}
+
+
+def leer(buffer, funnel):
+    mapeo = app.sugerir_mapeo_importacion(app.columnas_exportacion(buffer), funnel, "Anuncio")
+    assert app.validar_mapeo_importacion(app.columnas_exportacion(buffer), mapeo, funnel, "Anuncio") == []
+    return app.leer_importacion(buffer, mapeo, "Anuncio")
+
+
+def test_fechas_iso_y_con_el_dia_primero():
+    fechas = app.fechas_importacion(pd.Series(["2024-01-02", "03/01/2024", "no es fecha", None]))
+    assert fechas[:2].tolist() == [pd.Timestamp("2024-01-02"), pd.Timestamp("2024-01-03")]
+    assert fechas[2:].isna().all()
+
+
+def test_leer_csv_agrega_y_rechaza(funnel):
+    importado, leidas, rechazadas = leer(archivo(CSV.encode(), "export.csv"), funnel)
+    assert (leidas, rechazadas) == (5, 2)
+    # Las dos ubicaciones de A1 el mismo día se suman en una fila.
+    a1 = importado[importado["Anuncio"] == "A1"].iloc[0]
+    assert a1["Inversión"] == 15.0 and a1["Ventas: PP"] == 3 and a1["Pagos Iniciados"] == 4
+    assert sorted(importado["Anuncio"]) == ["A1", "A2"]
+
+
+def test_leer_parquet(funnel):
+    origen = pd.DataFrame({"Fecha": pd.to_datetime(["2024-01-01", "2024-01-01"]), "Ad name": ["A1", "A1"],
+                           "Spend": [1.0, 2.0], "Ventas: PP": [1, 0], "Ventas: B1": [0, 1]})
+    buffer = archivo(b"", "export.parquet")
+    origen.to_parquet(buffer)
+    buffer.seek(0)
+    importado, leidas, rechazadas = leer(buffer, funnel)
+    assert (leidas, rechazadas) == (2, 0)
+    assert importado[["Inversión", "Ventas: PP", "Ventas: B1"]].iloc[0].tolist() == [3.0, 1, 1]
+
+
+def test_combinar_actualiza_en_su_sitio_y_anade_al_final(funnel, oferta_base):
+    importado, _, _ = leer(archivo(CSV.encode(), "export.csv"), funnel)
+    existente = app.aplicar_esquema(pd.DataFrame({
+        "Fecha": pd.to_datetime(["2024-01-01", "2023-12-31"]), "Anuncio": ["A1", "A0"],
+        "Inversión": [1.0, 3.0], "Ventas: PP": [1, 1], "id_registro": ["x", "z"]}))
+
+    combinado, actualizados, nuevos = app.combinar_importacion(existente, importado, "Anuncio", oferta_base)
+    assert (actualizados, nuevos) == (1, 1)
+    assert combinado["id_registro"].iloc[:2].tolist() == ["x", "z"]
+    fila = combinado.iloc[0]
+    assert fila["Inversión"] == 15.0 and fila["Facturación Total"] == 3 * 10.0 + 1 * 5.0
+    assert combinado["id_registro"].iloc[2] not in ("x", "z")
+
+    # Reimportar el mismo fichero no duplica nada ni cambia ningún valor.
+    otra_vez, actualizados, nuevos = app.combinar_importacion(combinado, importado, "Anuncio", oferta_base)
+    assert (actualizados, nuevos) == (2, 0)
+    pd.testing.assert_frame_equal(otra_vez, combinado)
+
+
+def test_importar_registros_guarda_y_actualiza_rollups(oferta):
+    app.asegurar_rollups([oferta])
+    sin_bump = pd.read_csv(io.StringIO(CSV), sep=";", dtype=str).drop(columns="Ventas: B1")
+    contenido = sin_bump.to_csv(sep=";", index=False).encode()
+    importado, _, _ = leer(archivo(contenido, "export.csv"), st.session_state.ofertas[oferta]["funnel"])
+    resumen = app.importar_registros(oferta, None, importado)
+    assert resumen == {"actualizados": 0, "nuevos": 2, "descartados": 0, "altas": 2}
+    assert {a["nombre"] for a in st.session_state.ofertas[oferta]["anuncios_testeo"]} == {"A1", "A2"}
+
+    assert app.importar_registros(oferta, None, importado)["nuevos"] == 0
+    assert app.obtener_cola_escritura("pruebas").vaciar()
+    assert len(app.backend_actual().consultar_registros(oferta)) == 2
+    assert app.almacen_actual().rollups[oferta].totales(["testeos"])["inversion"] == 22.0
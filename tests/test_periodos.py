@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+import app_socios as app
+
+
+def registros():
+    generador = np.random.default_rng(3)
+    # Del jueves 25 de enero al sábado 10 de febrero de 2024, con huecos, horas y varias filas por día.
+    fechas = pd.date_range("2024-01-25", "2024-02-10", freq="D").delete([3, 9])
+    fechas = fechas.repeat(2) + pd.to_timedelta(generador.integers(0, 24, len(fechas) * 2), unit="h")
+    df = pd.DataFrame({"Fecha": fechas, "Inversión": generador.random(len(fechas)) * 10,
+                       "Ventas: PP": generador.integers(0, 4, len(fechas))})
+    return df.sample(frac=1, random_state=1).reset_index(drop=True)
+
+
+def test_semanas_y_meses_coinciden_con_groupby():
+    df = registros()
+    columnas = ["Inversión", "Ventas: PP"]
+    niveles = app.agregar_por_periodos(df, columnas + ["No existe"])
+    diario = niveles["Día"]
+    assert diario["Fecha"].is_monotonic_increasing
+    assert diario.loc[diario["Fecha"] == "2024-01-29", "Día de la Semana"].item() == "Lunes"
+
+    semana = df["Fecha"].dt.to_period("W-SUN").dt.start_time
+    esperado_semana = df.groupby(semana)[columnas].sum()
+    semanas = niveles["Semana"]
+    assert semanas["Periodo"].tolist() == ["2024-01-22", "2024-01-29", "2024-02-05"]
+    assert pd.to_datetime(semanas["Periodo"]).dt.dayofweek.eq(0).all()
+    np.testing.assert_allclose(semanas[columnas].to_numpy(), esperado_semana.to_numpy())
+
+    mes = df["Fecha"].dt.to_period("M")
+    meses = niveles["Mes"]
+    assert meses["Periodo"].tolist() == ["Enero 2024", "Febrero 2024"]
+    np.testing.assert_allclose(meses[columnas].to_numpy(), df.groupby(mes)[columnas].sum().to_numpy())
+
+    # [inicio, fin) de cada periodo es exactamente su desglose diario.
+    for nivel, claves in (("Semana", diario["Fecha"].dt.to_period("W-SUN")), ("Mes", diario["Fecha"].dt.to_period("M"))):
+        tabla = niveles[nivel]
+        assert tabla["inicio"].iloc[0] == 0 and tabla["fin"].iloc[-1] == len(diario)
+        for (_, fila), periodo in zip(tabla.iterrows(), claves.unique()):
+            tramo = diario.iloc[fila["inicio"]:fila["fin"]]
+            assert (tramo["Fecha"].dt.to_period(periodo.freq) == periodo).all()
+            assert len(tramo) == (claves == periodo).sum()
+            np.testing.assert_allclose(tramo[columnas].sum().to_numpy(), fila[columnas].to_numpy(dtype=float))
+
+
+def test_sin_registros():
+    niveles = app.agregar_por_periodos(pd.DataFrame({"Fecha": pd.to_datetime([]), "Inversión": []}), ["Inversión"])
+    assert niveles["Día"].empty and niveles["Semana"].empty and niveles["Mes"].empty
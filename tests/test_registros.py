@@ -0,0 +1,64 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+import app_socios as app
+
+
+def test_concatenar_con_tablas_vacias_no_cambia_los_dtypes():
+    vacia = pd.DataFrame(columns=["Fecha", "Anuncio", "Inversión", "Ganancia Bruta"])
+    filas = app.aplicar_esquema(pd.DataFrame({"Fecha": pd.to_datetime(["2024-01-01"]), "Anuncio": ["a"],
+                                              "Inversión": [1.5], "Ventas: PP": [2]}))
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", FutureWarning)
+        combinado = app.concatenar_registros([vacia, filas])
+    # Las columnas de la tabla vacía se conservan; los dtypes salen de las filas reales.
+    assert list(combinado.columns) == ["Fecha", "Anuncio", "Inversión", "Ganancia Bruta", "Ventas: PP"]
+    assert combinado.dtypes.drop("Ganancia Bruta").equals(filas.dtypes[combinado.columns.drop("Ganancia Bruta")])
+    assert combinado["Ganancia Bruta"].isna().all()
+
+
+@pytest.fixture
+def tabla_con_esquema():
+    return pd.DataFrame({
+        "Fecha": pd.to_datetime(["2024-01-01", "2024-01-02", "2024-01-02"]),
+        "Anuncio": pd.Categorical(["a", "b", "a"], categories=["a", "b", "c"]),
+        "Inversión": [1.25, 0.0, 3.5],
+        "Pagos Iniciados": np.array([3, 0, 1], dtype="int32"),
+        "Ventas: PP": np.array([1.0, np.nan, 2.0], dtype="float32"),
+        "id_registro": ["r1", "r2", "r3"],
+    })
+
+
+def test_codificar_df_conserva_los_dtypes(tabla_con_esquema):
+    assert app.aplicar_esquema(tabla_con_esquema) is tabla_con_esquema
+    blob = app.codificar_df(tabla_con_esquema)
+    assert blob.startswith(app.CABECERA_DF_BINARIO) and blob[len(app.CABECERA_DF_BINARIO)] == app.VERSION_DF_ARROW_ZSTD
+    pd.testing.assert_frame_equal(app.decodificar_df(blob), tabla_con_esquema)
+    assert list(app.decodificar_df(blob)["Anuncio"].cat.categories) == ["a", "b", "c"]
+
+
+def test_decodificar_payload_json_antiguo(tabla_con_esquema):
+    antiguo = tabla_con_esquema.astype({"Anuncio": str, "Pagos Iniciados": "int64", "Ventas: PP": "float64"})
+    legado = app.decodificar_df(app.df_to_json(antiguo))
+    # El JSON 'split' de antes se lee con el mismo esquema que el binario (sin las categorías sin uso).
+    esperado = tabla_con_esquema.assign(Anuncio=tabla_con_esquema["Anuncio"].cat.remove_unused_categories())
+    pd.testing.assert_frame_equal(legado, esperado)
+    assert app.decodificar_df(None).empty and app.decodificar_df("").empty
+
+
+def test_tipos_mezclados_se_guardan_en_json():
+    mezclado = pd.DataFrame({"Fecha": pd.to_datetime(["2024-01-01", "2024-01-02"]), "Nota": [1, "uno"]})
+    valor = app.codificar_df(mezclado)
+    assert isinstance(valor, str)
+    assert app.decodificar_df(valor)["Nota"].tolist() == [1, "uno"]
+
+
+def test_cabecera_desconocida():
+    with pytest.raises(ValueError):
+        app.decodificar_df(b"OTRO" + bytes(8))
+    with pytest.raises(ValueError):
+        app.decodificar_df(app.CABECERA_DF_BINARIO + bytes([app.VERSION_DF_ARROW_ZSTD + 1]))
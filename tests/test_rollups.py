@@ -0,0 +1,67 @@
+import numpy as np
+import streamlit as st
+
+import app_socios as app
+
+
+def celdas(rollup):
+    return {(clave, componente): np.round(celda, 9).tolist()
+            for clave, componentes in rollup.dias.items() for componente, celda in componentes.items()}
+
+
+def rollup_reconstruido(id_oferta):
+    oferta = st.session_state.ofertas[id_oferta]
+    segmentos = {"testeos": app.obtener_registros(oferta, "testeos")}
+    for id_campana, campana in oferta["escala"].items():
+        segmentos[id_campana] = app.obtener_registros(campana, "registros")
+    return app.RollupOferta.desde_registros(segmentos)
+
+
+def registro(oferta, fecha, nombre, inversion, ventas, columna="Anuncio"):
+    return app.calcular_metricas_diarias({"Fecha": fecha, columna: nombre, "Inversión": inversion,
+                                          "Pagos Iniciados": ventas + 1, "Ventas: PP": ventas}, oferta)
+
+
+def test_incrementos_igualan_a_la_reconstruccion(oferta):
+    app.asegurar_rollups([oferta])  # como el dashboard: el almacén ya sigue los rollups de la oferta
+    datos = st.session_state.ofertas[oferta]
+    id_campana = next(iter(datos["escala"]))
+    ids = [app.anexar_registro(oferta, None, registro(datos, f"2024-01-0{d}", nombre, 10.0 * d, d))
+           for d in (1, 2, 3) for nombre in ("a", "b")]
+    app.anexar_registro(oferta, id_campana, registro(datos, "2024-01-02", "a", 7.5, 2, "Componente"))
+    app.save_data_to_firestore()
+
+    # Edición que cambia de día y de anuncio, y baja del único registro de otro día.
+    app.reemplazar_registro(oferta, None, ids[0], {"Fecha": app.pd.Timestamp("2024-01-03"), "Anuncio": "b",
+                                                   "Inversión": 99.0})
+    app.borrar_registro(oferta, None, ids[3])
+    app.save_data_to_firestore()
+
+    incremental = app.almacen_actual().rollups[oferta]
+    assert celdas(incremental) == celdas(rollup_reconstruido(oferta))
+    assert incremental.totales(["testeos"])["registros"] == 5
+
+    # Otro proceso que lee los documentos de rollups del backend ve lo mismo.
+    assert app.obtener_cola_escritura("pruebas").vaciar()
+    st.cache_resource.clear()
+    st.session_state.clear()
+    app.load_data_from_firestore()
+    app.asegurar_rollups([oferta])
+    assert celdas(app.almacen_actual().rollups[oferta]) == celdas(incremental)
+
+
+def test_reconstruir_rollups_reescribe_los_documentos(oferta):
+    app.asegurar_rollups([oferta])
+    datos = st.session_state.ofertas[oferta]
+    for d in (1, 2):
+        app.anexar_registro(oferta, None, registro(datos, f"2024-02-0{d}", "a", 5.0, 1))
+    app.save_data_to_firestore()
+    esperado = celdas(app.almacen_actual().rollups[oferta])
+    # Un rollup que se ha desviado de los registros (p. ej. un incremento perdido).
+    app.almacen_actual().rollups[oferta].sumar("testeos", "2024-02-09", "a", np.ones(len(app.METRICAS_ROLLUP)))
+
+    app.reconstruir_rollups(oferta)
+    assert app.obtener_cola_escritura("pruebas").vaciar()
+    documentos = [doc for _, doc in app.backend_actual().consultar("rollups", "oferta_id", oferta)]
+    assert sorted(doc["fecha"] for doc in documentos) == ["2024-02-01", "2024-02-02"]
+    assert celdas(app.almacen_actual().rollups[oferta]) == esperado
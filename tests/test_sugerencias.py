@@ -0,0 +1,88 @@
+import pandas as pd
+import streamlit as st
+
+
+import app_socios as app
+
+
+def sugerencia(id_oferta, anuncio):
+    oferta = st.session_state.ofertas[id_oferta]
+    return app.analizar_sugerencias_anuncios(id_oferta, app.obtener_registros(oferta, "testeos"))[anuncio]
+
+
+def anexar_dias(id_oferta, anuncio, dias, inversion=10.0, ventas=3):
+    datos = st.session_state.ofertas[id_oferta]
+    for dia in dias:
+        app.anexar_registro(id_oferta, None, app.calcular_metricas_diarias(
+            {"Fecha": f"2024-01-{dia:02d}", "Anuncio": anuncio, "Inversión": inversion,
+             "Pagos Iniciados": ventas + 1, "Ventas: PP": ventas}, datos))
+    app.save_data_to_firestore()
+
+
+def test_sugerencia_usa_la_tarifa_de_cada_dia(oferta):
+    app.actualizar_configuracion_financiera(oferta, 0.0, 0.0, desde="2024-01-01")
+    anexar_dias(oferta, "a", range(1, 11))
+    assert sugerencia(oferta, "a").startswith("🏆 GANADOR")
+
+
+    # Una comisión que se come casi todo el precio, pero sólo desde después de los registros: la
+    # etiqueta no cambia, igual que la tabla de confianza.
+    app.actualizar_configuracion_financiera(oferta, 9.5, 0.0, desde="2024-06-01")
+    assert st.session_state.ofertas[oferta]["comision_pp"] == 9.5
+    assert sugerencia(oferta, "a").startswith("🏆 GANADOR")
+    confianza = app.confianza_anuncios([oferta]).set_index("componente")
+    assert confianza.loc["a", "roas_break_even"] == 1.0
+
+    # Vigente ya en esos días, el mismo anuncio pasa a perder dinero.
+    app.actualizar_configuracion_financiera(oferta, 9.5, 0.0, desde="2024-01-01")
+    assert sugerencia(oferta, "a").startswith("❄️ Apagar")
+    assert app.confianza_anuncios([oferta]).set_index("componente").loc["a", "roas_break_even"] == 20.0
+
+
+def test_apagar_exige_tambien_roas_neto_bajo(oferta):
+    app.actualizar_configuracion_financiera(oferta, 9.5, 0.0, desde="2024-01-01")
+    anexar_dias(oferta, "a", range(1, 11))
+    assert sugerencia(oferta, "a").startswith("❄️ Apagar")
+
+    # Con el corte de ROAS a 0 ningún anuncio se apaga sólo por la probabilidad.
+    app.actualizar_umbrales_sugerencias(oferta, {"roas_apagar": 0.0})
+    assert app.umbrales_sugerencias(st.session_state.ofertas[oferta])["prob_apagar"] == 0.1
+    assert sugerencia(oferta, "a").startswith("🧪 Testeando")
+
+
+def racha_con_bucle(df):
+    """La racha como la calculaba el bucle original: registros con ventas PP desde el último hacia atrás."""
+    rachas = {}
+    for anuncio, grupo in df.groupby("Anuncio"):
+        racha = 0
+        for _, fila in grupo.sort_values(by="Fecha").iloc[::-1].iterrows():
+            if fila["Ventas: PP"] > 0:
+                racha += 1
+            else:
+                break
+        rachas[anuncio] = racha
+    return rachas
+
+
+def test_racha_coincide_con_el_bucle_original():
+    filas = [
+        # Sin ventas nunca.
+        ("sin_ventas", "2024-01-01", 0), ("sin_ventas", "2024-01-02", 0),
+        # El último registro no vende aunque los anteriores sí.
+        ("ultimo_sin_venta", "2024-01-01", 2), ("ultimo_sin_venta", "2024-01-02", 1), ("ultimo_sin_venta", "2024-01-03", 0),
+        # Todos venden.
+        ("todo_ventas", "2024-01-01", 1), ("todo_ventas", "2024-01-02", 3), ("todo_ventas", "2024-01-03", 2),
+        # Fechas desordenadas: el corte está en el 03, que aparece primero en la tabla.
+        ("desordenado", "2024-01-05", 1), ("desordenado", "2024-01-03", 0), ("desordenado", "2024-01-04", 2),
+        ("desordenado", "2024-01-01", 1), ("desordenado", "2024-01-02", 1),
+    ]
+    df = pd.DataFrame(filas, columns=["Anuncio", "Fecha", "Ventas: PP"])
+    df = df.assign(Fecha=pd.to_datetime(df["Fecha"]), **{"Inversión": 5.0, "Ganancia Neta": 1.0, "Pagos Iniciados": 1})
+    df = df.sample(frac=1, random_state=7).reset_index(drop=True)
+
+    metricas = app.metricas_sugerencias(app.aplicar_esquema(df))
+    esperado = racha_con_bucle(df)
+    assert metricas["racha"].to_dict() == esperado
+    assert esperado == {"desordenado": 2, "sin_ventas": 0, "todo_ventas": 3, "ultimo_sin_venta": 0}
+    assert metricas.loc["todo_ventas", "ventas_pp"] == 6
+    assert metricas.loc["desordenado", "roas_neto"] == (5 * 1.0 + 25.0) / 25.0
@@ -0,0 +1,66 @@
+import warnings
+
+import pandas as pd
+
+import pytest
+
+import app_socios as app
+
+
+@pytest.fixture
+def oferta(funnel):
+    oferta = {"funnel": funnel, "comision_pp": 1.0, "cpa_objetivo": 4.0}
+    app.registrar_tarifa(oferta, "2024-02-01", precios={"principal": 20.0})
+    app.registrar_tarifa(oferta, "2024-03-01", comision_pp=2.0)
+    return oferta
+
+
+def test_historial_deja_en_la_oferta_la_tarifa_de_hoy(oferta):
+    assert [e["desde"] for e in oferta["historial_tarifas"]] == [app.FECHA_INICIO_TARIFAS, "2024-02-01", "2024-03-01"]
+    assert oferta["funnel"]["principal"]["precio"] == 20.0 and oferta["comision_pp"] == 2.0
+
+
+def test_tarifas_vigentes_por_fecha(oferta):
+    fechas = ["2023-12-31", "2024-01-31", "2024-02-01", "2024-02-29", "2024-03-01", "2024-06-01"]
+    funnel, comision = app.tarifas_vigentes(oferta, fechas)
+    # Un día igual a 'desde' ya toma la tarifa nueva.
+    assert funnel["principal"]["precio"].tolist() == [10.0, 10.0, 20.0, 20.0, 20.0, 20.0]
+    # El elemento que la entrada no menciona conserva el precio anterior.
+    assert funnel["bump_1"]["precio"].tolist() == [5.0] * 6
+    assert comision.tolist() == [1.0, 1.0, 1.0, 1.0, 2.0, 2.0]
+    assert funnel["principal"]["alias"] == "PP"
+
+
+def test_tarifas_vigentes_coinciden_con_tarifa_en(oferta):
+    fechas = pd.date_range("2024-01-15", "2024-03-15", freq="7D")
+    funnel, comision = app.tarifas_vigentes(oferta, fechas)
+    for i, fecha in enumerate(fechas.strftime("%Y-%m-%d")):
+        tarifa = app.tarifa_en(oferta, fecha)
+        assert comision[i] == tarifa["comision_pp"]
+        assert {k: v["precio"][i] for k, v in funnel.items()} == tarifa["precios"]
+
+
+def test_fechas_anteriores_al_historial_toman_la_primera_tarifa(funnel):
+    oferta = {"funnel": funnel, "comision_pp": 1.0,
+              "historial_tarifas": [{"desde": "2024-05-01", "comision_pp": 3.0, "precios": {"principal": 12.0}}]}
+    funnel_vigente, comision = app.tarifas_vigentes(oferta, ["2024-01-01", "2024-05-02"])
+    assert comision.tolist() == [3.0, 3.0]
+    assert funnel_vigente["principal"]["precio"].tolist() == [12.0, 12.0]
+    assert funnel_vigente["bump_1"]["precio"].tolist() == [5.0, 5.0]
+
+
+def test_sin_historial_aplica_la_tarifa_actual(funnel):
+    funnel_vigente, comision = app.tarifas_vigentes({"funnel": funnel, "comision_pp": 1.5}, ["2024-01-01"])
+    assert comision.tolist() == [1.5] and funnel_vigente["principal"]["precio"].tolist() == [10.0]
+
+
+def test_tabla_tarifas_en_float_sin_avisos(funnel):
+    oferta = {"funnel": funnel, "comision_pp": 1.0,
+              "historial_tarifas": [{"desde": "2024-01-01", "precios": {"principal": 12.0}},
+                                    {"desde": "2024-05-01", "comision_pp": 3.0, "precios": {}}]}
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", FutureWarning)
+        tabla = app.tabla_tarifas(oferta)
+    assert (tabla.dtypes.drop("desde") == float).all()
+    assert tabla["comision_pp"].tolist() == [3.0, 3.0]
+    assert tabla["principal"].tolist() == [12.0, 12.0] and tabla["bump_1"].tolist() == [5.0, 5.0]